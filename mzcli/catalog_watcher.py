@@ -0,0 +1,237 @@
+import logging
+import threading
+from itertools import groupby
+
+import psycopg2
+
+from .completion_refresher import RELATION_KINDS, catalog_snapshot
+
+_logger = logging.getLogger(__name__)
+
+
+class CatalogWatcher:
+    """Streams catalog changes into the completer.
+
+    A background thread runs SUBSCRIBE (or TAIL, on older servers) over the
+    relations and schemata of the current database on a dedicated
+    connection. Every committed batch of changes is applied to the live
+    completer: dropped objects are removed, and created relations have their
+    columns fetched over a pooled connection.
+
+    The subscription only starts after the completer's catalog snapshot was
+    taken, so once it runs, every completer it hasn't seen yet is caught up
+    with the catalog. This covers the changes made before the subscription
+    started, or while the watcher was reconnecting.
+    """
+
+    # Seconds to wait for changes before checking whether to stop
+    fetch_timeout = 1
+    # Seconds to wait before reconnecting after the connection was lost
+    reconnect_delay = 5
+
+    catalog_query = """\
+        SELECT r.id,
+               s.name schema_name,
+               r.name relation_name,
+               r.type
+        FROM   mz_relations r
+        JOIN   mz_schemas s
+                   ON s.id = r.schema_id
+               LEFT JOIN  mz_databases d
+                   ON d.id = s.database_id
+         WHERE s.database_id IS NULL
+            OR d.name = '{dbname}'
+        UNION ALL
+        SELECT s.id,
+               s.name schema_name,
+               NULL,
+               'schema'
+        FROM   mz_schemas s
+               LEFT JOIN  mz_databases d
+                   ON d.id = s.database_id
+         WHERE s.database_id IS NULL
+            OR d.name = '{dbname}'
+        """
+
+    def __init__(self, pgexecute, get_completer, lock, callback=None):
+        """
+        :param pgexecute: PGExecute object whose connection parameters are
+                          used to open the watcher's connections.
+        :param get_completer: callable returning the live PGCompleter.
+        :param lock: lock guarding the completer.
+        :param callback: called with the completer after changes are applied.
+        """
+        self.pgexecute = pgexecute
+        self.get_completer = get_completer
+        self.lock = lock
+        self.callback = callback
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="catalog_watcher")
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def join(self, timeout=None):
+        """Wait for the watcher to stop, after its current FETCH at the latest."""
+        if self._thread:
+            self._thread.join(timeout)
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def _run(self):
+        while not self._stop.is_set():
+            executor = None
+            try:
+                executor = self.pgexecute.copy()
+                self._watch(executor)
+            except psycopg2.OperationalError as e:
+                _logger.error("Catalog watcher lost its connection: %r", e)
+                self._stop.wait(self.reconnect_delay)
+            except psycopg2.DatabaseError as e:
+                _logger.error("Catalog watcher stopped: %r", e)
+                break
+            finally:
+                if executor is not None and executor.conn:
+                    executor.conn.close()
+
+    def _watch(self, executor):
+        query = self.catalog_query.format(dbname=executor.dbname)
+        with executor.conn.cursor() as cur:
+            for command in ("SUBSCRIBE", "TAIL"):
+                cur.execute("BEGIN")
+                try:
+                    cur.execute(
+                        "DECLARE c CURSOR FOR {} ({}) WITH (SNAPSHOT = false)".format(
+                            command, query
+                        )
+                    )
+                except psycopg2.ProgrammingError as e:
+                    _logger.debug("%s not supported: %r", command, e)
+                    cur.execute("ROLLBACK")
+                    continue
+                if cur.protocol_error:
+                    raise psycopg2.NotSupportedError(cur.protocol_message)
+                break
+            else:
+                raise psycopg2.NotSupportedError("SUBSCRIBE is not supported")
+
+            _logger.debug("Watching the catalog with %s", command)
+            fetch = "FETCH ALL c WITH (timeout = '{}s')".format(self.fetch_timeout)
+            caught_up = None
+            while not self._stop.is_set():
+                cur.execute(fetch)
+                rows = cur.fetchall()
+                if rows:
+                    self.apply(rows)
+                # The first FETCH returned, so the subscription has started
+                completer = self.get_completer()
+                if completer is caught_up or completer.catalog_relations is None:
+                    continue
+                self.catch_up(completer)
+                caught_up = completer
+
+    def _fetch_columns(self, relations):
+        """Fetch the columns of (id, schema_name, relation_name) tuples."""
+        executor = self.pgexecute.acquire()
+        try:
+            return list(executor.relation_columns(relations))
+        finally:
+            self.pgexecute.release(executor)
+
+    def catch_up(self, completer):
+        """Apply the catalog changes since the completer's catalog snapshot."""
+        executor = self.pgexecute.acquire()
+        try:
+            schemata = executor.schemata()
+            relations = catalog_snapshot(executor)
+        finally:
+            self.pgexecute.release(executor)
+        if relations is None:
+            return
+        with self.lock:
+            old_relations = dict(completer.catalog_relations)
+            old_schemata = [
+                completer.unescape_name(s) for s in completer.dbmetadata["tables"]
+            ]
+
+        types = {kind: type_ for type_, kind in RELATION_KINDS.items()}
+        rows = [
+            (None, -1, None, s, None, "schema")
+            for s in old_schemata
+            if s not in schemata
+        ]
+        rows += [
+            (None, 1, None, s, None, "schema")
+            for s in schemata
+            if s not in old_schemata
+        ]
+        for id, (schema, name, kind) in old_relations.items():
+            if relations.get(id) != (schema, name, kind):
+                rows.append((None, -1, id, schema, name, types[kind]))
+        for id, (schema, name, kind) in relations.items():
+            if old_relations.get(id) != (schema, name, kind):
+                rows.append((None, 1, id, schema, name, types[kind]))
+        _logger.debug("Catching up with %d catalog changes", len(rows))
+        if rows:
+            self.apply(rows)
+
+    def apply(self, rows):
+        """Apply SUBSCRIBE rows to the live completer.
+
+        :param rows: list of (mz_timestamp, mz_diff, id, schema_name,
+                     relation_name, type) tuples
+        """
+        for _, batch in groupby(rows, key=lambda row: row[0]):
+            self._apply_batch(list(batch))
+
+        if self.callback:
+            self.callback(self.get_completer())
+
+    def _apply_batch(self, rows):
+        # Deletions come first, so renames and replacements at the same
+        # timestamp end up with the new object.
+        rows.sort(key=lambda row: row[1])
+        completer = self.get_completer()
+        added = {
+            id: (schema, name, RELATION_KINDS[type_])
+            for _, diff, id, schema, name, type_ in rows
+            if diff > 0 and type_ in RELATION_KINDS
+        }
+        if added and not completer.lazy_columns:
+            columns = self._fetch_columns(
+                (id, schema, name) for id, (schema, name, _) in added.items()
+            )
+        else:
+            columns = []
+        _logger.debug("Catalog changes: %r", rows)
+
+        kinds = {(schema, name): kind for schema, name, kind in added.values()}
+        with self.lock:
+            for _, diff, id, schema, name, type_ in rows:
+                if type_ == "schema":
+                    if diff > 0:
+                        completer.extend_schemata([schema])
+                    else:
+                        completer.remove_schemata([schema])
+                elif type_ in RELATION_KINDS:
+                    kind = RELATION_KINDS[type_]
+                    if diff > 0:
+                        completer.extend_relations([(schema, name)], kind=kind)
+                    else:
+                        completer.remove_relations([(schema, name)], kind=kind)
+                    if completer.catalog_relations is not None:
+                        if diff > 0:
+                            completer.catalog_relations[id] = (schema, name, kind)
+                        else:
+                            completer.catalog_relations.pop(id, None)
+            for column in columns:
+                kind = kinds.get(column[:2])
+                if kind:
+                    completer.extend_columns([column], kind=kind)
@@ -0,0 +1,80 @@
+import logging
+import threading
+
+_logger = logging.getLogger(__name__)
+
+
+class ColumnLoader:
+    """Fetches the columns of single relations on demand, for completers that
+    only load relation names on refresh.
+
+    Lookups run on a connection borrowed from the executor's pool, so they
+    don't interfere with queries running on the main connection. They're
+    called while completing, so they give up after `timeout` seconds rather
+    than freezing the prompt. A lookup that timed out keeps running in the
+    background, and its result is returned by the next call for the relation.
+    """
+
+    timeout = 2
+
+    def __init__(self, get_executor, timeout=None):
+        """
+        :param get_executor: callable returning the current PGExecute object,
+                             whose connection pool is used for lookups.
+        :param timeout: seconds to wait for a lookup, defaults to `timeout`.
+        """
+        self._get_executor = get_executor
+        if timeout is not None:
+            self.timeout = timeout
+        self._lock = threading.Lock()
+        self._lookups = {}
+
+    def __call__(self, schema, relname):
+        """Returns a list of (schema_name, relation_name, column_name,
+        column_type, has_default, default) tuples.
+
+        :raise TimeoutError: if the columns weren't fetched in time.
+        """
+        key = (schema, relname)
+        with self._lock:
+            lookup = self._lookups.get(key)
+            if lookup is None:
+                lookup = self._lookups[key] = _Lookup(self._load, schema, relname)
+        lookup.join(self.timeout)
+        if lookup.is_alive():
+            raise TimeoutError(
+                "Timed out loading the columns of {}.{}".format(schema, relname)
+            )
+        with self._lock:
+            if self._lookups.get(key) is lookup:
+                del self._lookups[key]
+        if lookup.error is not None:
+            raise lookup.error
+        return lookup.columns
+
+    def _load(self, schema, relname):
+        pgexecute = self._get_executor()
+        executor = pgexecute.acquire()
+        try:
+            _logger.debug("Loading columns of %r.%r", schema, relname)
+            return list(executor.named_relation_columns(schema, relname))
+        finally:
+            pgexecute.release(executor)
+
+
+class _Lookup(threading.Thread):
+    """Runs a single column lookup, keeping its result or error."""
+
+    def __init__(self, load, schema, relname):
+        super().__init__(daemon=True)
+        self._load = load
+        self._relation = (schema, relname)
+        self.columns = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.columns = self._load(*self._relation)
+        except Exception as e:
+            self.error = e
@@ -0,0 +1,117 @@
+"""On-disk snapshots of the auto-completion metadata.
+
+A snapshot is written after every completion refresh and loaded when mzcli
+starts, so completions are available immediately while the background
+refresh reconciles them with the catalog.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from .config import ensure_dir_exists
+
+_logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+RELATION_KINDS = ("tables", "sources", "views")
+
+
+def cache_filename(cache_dir, executor):
+    """Returns the cache file for the connection of a PGExecute object.
+
+    The file is keyed by host, port, database and user.
+    """
+    key = "\0".join(
+        str(x or "")
+        for x in (executor.host, executor.port, executor.dbname, executor.user)
+    )
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(os.path.expanduser(cache_dir), digest + ".json.gz")
+
+
+def dump_completer(completer):
+    """Returns a JSON-serializable snapshot of the completer's metadata."""
+    unescape = completer.unescape_name
+    meta = completer.dbmetadata
+    relations = {
+        kind: {
+            unescape(schema): {
+                unescape(rel): [[unescape(c.name), c.datatype] for c in cols.values()]
+                for rel, cols in rels.items()
+            }
+            for schema, rels in meta[kind].items()
+        }
+        for kind in RELATION_KINDS
+    }
+    datatypes = {
+        unescape(schema): [unescape(t) for t in types]
+        for schema, types in meta["datatypes"].items()
+    }
+    return {
+        "version": CACHE_VERSION,
+        "databases": list(completer.databases),
+        "search_path": [unescape(s) for s in completer.search_path],
+        "schemata": [unescape(s) for s in meta["tables"]],
+        "relations": relations,
+        "datatypes": datatypes,
+    }
+
+
+def load_completer(completer, snapshot):
+    """Populates a completer from a snapshot made by `dump_completer`."""
+    completer.set_search_path(snapshot["search_path"])
+    completer.extend_schemata(snapshot["schemata"])
+    for kind, schemas in snapshot["relations"].items():
+        completer.extend_relations(
+            [(s, r) for s, rels in schemas.items() for r in rels], kind=kind
+        )
+        completer.extend_columns(
+            (
+                (s, r, col, datatype, False, None)
+                for s, rels in schemas.items()
+                for r, cols in rels.items()
+                for col, datatype in cols
+            ),
+            kind=kind,
+        )
+    completer.extend_datatypes(
+        (s, t) for s, types in snapshot["datatypes"].items() for t in types
+    )
+    completer.extend_database_names(snapshot["databases"])
+
+
+def save(filename, snapshot):
+    """Atomically writes a snapshot to filename."""
+    ensure_dir_exists(filename)
+    tmp_filename = filename + ".tmp"
+    try:
+        with gzip.open(tmp_filename, "wt", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(tmp_filename, filename)
+    except OSError as e:
+        _logger.error("Failed to write completion cache %r: %r", filename, e)
+
+
+def load(filename, completer):
+    """Loads the snapshot in filename into completer.
+
+    Returns True if a usable snapshot was found.
+    """
+    try:
+        with gzip.open(filename, "rt", encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        _logger.error("Failed to read completion cache %r: %r", filename, e)
+        return False
+    if snapshot.get("version") != CACHE_VERSION:
+        return False
+    try:
+        load_completer(completer, snapshot)
+    except (KeyError, TypeError, ValueError) as e:
+        _logger.error("Invalid completion cache %r: %r", filename, e)
+        return False
+    return True
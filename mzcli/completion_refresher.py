@@ -1,9 +1,29 @@
+import logging
 import threading
 import os
-from collections import OrderedDict
+import queue
+from collections import OrderedDict, namedtuple
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import psycopg2.extensions as ext
 
 from .pgcompleter import PGCompleter
 
+_logger = logging.getLogger(__name__)
+
+# Maps Materialize relation types onto PGCompleter.dbmetadata kinds
+RELATION_KINDS = {
+    "table": "tables",
+    "source": "sources",
+    "view": "views",
+    "materialized-view": "views",
+}
+
+# Statistics of a single refresher run
+RefresherStats = namedtuple("RefresherStats", "name seconds rows round_trips")
+
 
 class CompletionRefresher:
 
@@ -12,8 +32,32 @@ class CompletionRefresher:
     def __init__(self):
         self._completer_thread = None
         self._restart_refresh = threading.Event()
-
-    def refresh(self, executor, special, callbacks, history=None, settings=None):
+        self._incremental = False
+        # Refreshes started while an in-place update runs, as (target, args,
+        # incremental) tuples, run by the same thread once it completes
+        self._queued = []
+        self._running = False
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # {refresher name: RefresherStats} of the last full refresh
+        self.refresher_stats = OrderedDict()
+        self.refresh_count = 0
+        self.restart_count = 0
+        self.last_refresh_seconds = None
+        self._progress = (0, 0)
+        # Executors running refresher queries that may be cancelled
+        self._active_executors = set()
+        self._cancellable = False
+
+    def refresh(
+        self,
+        executor,
+        special,
+        callbacks,
+        history=None,
+        settings=None,
+        partial_callbacks=None,
+    ):
         """
         Creates a PGCompleter object and populates it with the relevant
         completion suggestions in a background thread.
@@ -25,86 +69,601 @@ class CompletionRefresher:
         callbacks - A function or a list of functions to call after the thread
                     has completed the refresh. The newly created completion
                     object will be passed in as an argument to each callback.
+        partial_callbacks - A function or a list of functions to call with a
+                    snapshot of the completion object each time a stage of
+                    the refresh has completed: schemata, then relation
+                    names. Columns follow with the final callbacks.
         """
         if executor.is_virtual_database():
             # do nothing
             return [(None, None, None, "Auto-completion refresh can't be started.")]
 
-        if self.is_refreshing():
-            self._restart_refresh.set()
-            return [(None, None, None, "Auto-completion refresh restarted.")]
-        else:
-            self._completer_thread = threading.Thread(
-                target=self._bg_refresh,
-                args=(executor, special, callbacks, history, settings),
-                name="completion_refresh",
-            )
-            self._completer_thread.setDaemon(True)
-            self._completer_thread.start()
-            return [
-                (None, None, None, "Auto-completion refresh started in the background.")
-            ]
+        return self._start_thread(
+            self._bg_refresh,
+            (executor, special, callbacks, history, settings, partial_callbacks),
+            incremental=False,
+        )
 
-    def is_refreshing(self):
-        return self._completer_thread and self._completer_thread.is_alive()
+    def refresh_incremental(self, executor, completer, lock, callbacks, settings=None):
+        """
+        Brings an existing PGCompleter up to date with the catalog in a
+        background thread. Only relations that were added or changed since
+        the completer's catalog snapshot have their columns fetched, unless
+        the completer loads columns lazily.
+
+        executor - PGExecute object, used to extract the credentials to connect
+                   to the database.
+        completer - PGCompleter object with a catalog snapshot, updated in
+                    place.
+        lock - lock guarding completer.
+        settings - dict of settings for completer object
+        callbacks - A function or a list of functions to call after the thread
+                    has completed the refresh. The updated completion object
+                    will be passed in as an argument to each callback.
+        """
+        if executor.is_virtual_database():
+            return [(None, None, None, "Auto-completion refresh can't be started.")]
+
+        return self._start_thread(
+            self._bg_incremental_refresh,
+            (executor, completer, lock, callbacks, settings),
+            incremental=True,
+        )
+
+    def refresh_objects(
+        self, executor, completer, lock, changes, callbacks, settings=None
+    ):
+        """
+        Applies the catalog changes made by DDL statements to an existing
+        PGCompleter in a background thread, fetching columns only for the
+        created objects.
 
-    def _bg_refresh(self, pgexecute, special, callbacks, history=None, settings=None):
+        executor - PGExecute object, used to extract the credentials to connect
+                   to the database.
+        completer - PGCompleter object, updated in place.
+        lock - lock guarding completer.
+        changes - list of DdlChange namedtuples.
+        settings - dict of settings for completer object
+        callbacks - A function or a list of functions to call after the thread
+                    has completed the update. The updated completion object
+                    will be passed in as an argument to each callback.
+        """
+        if executor.is_virtual_database():
+            return [(None, None, None, "Auto-completion refresh can't be started.")]
+
+        return self._start_thread(
+            self._bg_refresh_objects,
+            (executor, completer, lock, changes, callbacks, settings),
+            incremental=True,
+        )
+
+    def _request_restart(self):
+        """Ask the running refresh to start over.
+
+        Refreshers stop at the next row they load, and their in-flight
+        queries are cancelled so they don't wait for the server to finish
+        catalog work that would be thrown away.
+        """
+        self._restart_refresh.set()
+        with self._stats_lock:
+            executors = list(self._active_executors)
+        for executor in executors:
+            try:
+                executor.conn.cancel()
+            except Exception as e:
+                _logger.debug("Failed to cancel refresher query: %r", e)
+
+    def _start_thread(self, target, args, incremental):
+        """Run target in the background, unless a refresh is running.
+
+        A running full refresh is restarted instead, since it may have read
+        the catalog before the changes. In-place updates are short and can't
+        be restarted, so target is queued to run once they complete, and
+        publishes its results through its callbacks like any refresh.
+        """
+        with self._thread_lock:
+            if self._running and self._incremental:
+                self._queued.append((target, args, incremental))
+                return [(None, None, None, "Auto-completion refresh queued.")]
+            if self._running:
+                self._request_restart()
+                return [(None, None, None, "Auto-completion refresh restarted.")]
+            self._running = True
+            self._incremental = incremental
+        self._completer_thread = threading.Thread(
+            target=self._run_thread, args=(target, args), name="completion_refresh"
+        )
+        self._completer_thread.setDaemon(True)
+        self._completer_thread.start()
+        return [
+            (None, None, None, "Auto-completion refresh started in the background.")
+        ]
+
+    def _run_thread(self, target, args):
+        while target:
+            try:
+                target(*args)
+            except Exception:
+                _logger.exception("Completion refresh failed")
+            with self._thread_lock:
+                if self._queued:
+                    target, args, self._incremental = self._queued.pop(0)
+                else:
+                    target = None
+                    self._running = False
+
+    def is_refreshing(self):
+        return self._running
+
+    def progress(self):
+        """Returns (completed, total) refreshers of the running full refresh,
+        or None."""
+        if self.is_refreshing() and not self._incremental:
+            return self._progress
+        return None
+
+    def _bg_refresh(
+        self,
+        pgexecute,
+        special,
+        callbacks,
+        history=None,
+        settings=None,
+        partial_callbacks=None,
+    ):
         settings = settings or {}
         completer = PGCompleter(
             smart_completion=True, pgspecial=special, settings=settings
         )
 
+        # The connection shared with the user's queries must not be
+        # cancelled from under them.
+        self._cancellable = not settings.get("single_connection")
         if settings.get("single_connection"):
             executor = pgexecute
+            concurrency = 1
         else:
-            # Create a new pgexecute method to populate the completions.
-            executor = pgexecute.copy()
+            # Borrow a pooled executor to populate the completions.
+            executor = pgexecute.acquire()
+            concurrency = max(1, settings.get("refresh_concurrency") or 1)
         # If callbacks is a single function then push it into a list.
         if callable(callbacks):
             callbacks = [callbacks]
-
-        while 1:
-            for refresher in self.refreshers.values():
-                refresher(completer, executor)
-                if self._restart_refresh.is_set():
-                    self._restart_refresh.clear()
+        if callable(partial_callbacks):
+            partial_callbacks = [partial_callbacks]
+
+        def publish():
+            self._publish(completer, partial_callbacks)
+
+        # Executors handed out to refreshers running in parallel. The first
+        # one is the executor above, the rest are created on demand.
+        executors = queue.Queue()
+        executors.put(executor)
+        extra_executors = []
+
+        try:
+            start = time()
+            while 1:
+                with self._stats_lock:
+                    self.refresher_stats = OrderedDict()
+                    self._progress = (0, len(self.refreshers))
+                completer.catalog_relations = self._catalog_snapshot(executor)
+                if concurrency > 1:
+                    completed = self._parallel_refresh(
+                        completer,
+                        pgexecute,
+                        executors,
+                        extra_executors,
+                        concurrency,
+                        publish,
+                    )
+                else:
+                    completed = self._serial_refresh(completer, executor, publish)
+                if completed:
                     break
-            else:
-                # Break out of while loop if the for loop finishes natually
-                # without hitting the break statement.
-                break
 
-            # Start over the refresh from the beginning if the for loop hit the
-            # break statement.
-            continue
+                # Start over the refresh from the beginning if a restart was
+                # requested while refreshing.
+                self._restart_refresh.clear()
+                self.restart_count += 1
+                _logger.debug("Completion refresh restarted")
+
+            self.refresh_count += 1
+            self.last_refresh_seconds = time() - start
+            _logger.debug("Completion refresh took %.3fs", self.last_refresh_seconds)
+
+            # Load history into pgcompleter so it can learn user preferences
+            n_recent = 100
+            if history:
+                for recent in history.get_strings()[-n_recent:]:
+                    completer.extend_query_history(recent, is_init=True)
+
+            for callback in callbacks:
+                callback(completer)
+        finally:
+            if not settings.get("single_connection"):
+                pgexecute.release(executor)
+            for extra in extra_executors:
+                pgexecute.release(extra)
+
+    def _bg_incremental_refresh(
+        self, pgexecute, completer, lock, callbacks, settings=None
+    ):
+        settings = settings or {}
+        if settings.get("single_connection"):
+            executor = pgexecute
+        else:
+            executor = pgexecute.acquire()
+        if callable(callbacks):
+            callbacks = [callbacks]
+
+        try:
+            while 1:
+                updated = self._update_from_catalog(completer, executor, lock)
+                if not self._restart_refresh.is_set():
+                    break
+                self._restart_refresh.clear()
+        finally:
+            if not settings.get("single_connection"):
+                pgexecute.release(executor)
+
+        if updated:
+            for callback in callbacks:
+                callback(completer)
+
+    def _bg_refresh_objects(
+        self, pgexecute, completer, lock, changes, callbacks, settings=None
+    ):
+        settings = settings or {}
+        if settings.get("single_connection"):
+            executor = pgexecute
+        else:
+            executor = pgexecute.acquire()
+        if callable(callbacks):
+            callbacks = [callbacks]
 
-        # Load history into pgcompleter so it can learn user preferences
-        n_recent = 100
-        if history:
-            for recent in history.get_strings()[-n_recent:]:
-                completer.extend_query_history(recent, is_init=True)
+        try:
+            for change in changes:
+                apply_ddl_change(completer, executor, lock, change)
+        finally:
+            if not settings.get("single_connection"):
+                pgexecute.release(executor)
 
         for callback in callbacks:
             callback(completer)
 
-        if not settings.get("single_connection") and executor.conn:
-            # close connection established with pgexecute.copy()
-            executor.conn.close()
+    def _update_from_catalog(self, completer, executor, lock):
+        """Apply the catalog changes since the completer's last snapshot.
 
+        Returns False if the catalog can't be listed.
+        """
+        with lock:
+            old_relations = dict(completer.catalog_relations or {})
+            old_schemata = [
+                completer.unescape_name(s) for s in completer.dbmetadata["tables"]
+            ]
+        relations = self._catalog_snapshot(executor)
+        search_path = executor.search_path()
+        schemata = executor.schemata()
+        if relations is None:
+            return False
+
+        removed = [rel for id, rel in old_relations.items() if relations.get(id) != rel]
+        added = {
+            id: rel for id, rel in relations.items() if old_relations.get(id) != rel
+        }
+        kinds = {(schema, name): kind for schema, name, kind in added.values()}
+        if completer.lazy_columns:
+            # Fetched when they are first needed
+            columns = []
+        else:
+            columns = list(
+                executor.relation_columns(
+                    (id, schema, name) for id, (schema, name, _) in added.items()
+                )
+            )
+        if self._restart_refresh.is_set():
+            return True
 
-def refresher(name, refreshers=CompletionRefresher.refreshers):
+        _logger.debug(
+            "Incremental refresh: %d relations removed, %d added",
+            len(removed),
+            len(added),
+        )
+        with lock:
+            completer.set_search_path(search_path)
+            completer.remove_schemata(set(old_schemata) - set(schemata))
+            completer.extend_schemata([s for s in schemata if s not in old_schemata])
+            for schema, name, kind in removed:
+                completer.remove_relations([(schema, name)], kind=kind)
+            for (schema, name), kind in kinds.items():
+                completer.extend_relations([(schema, name)], kind=kind)
+            for column in columns:
+                kind = kinds.get(column[:2])
+                if kind:
+                    completer.extend_columns([column], kind=kind)
+            completer.catalog_relations = relations
+        return True
+
+    def _catalog_snapshot(self, executor):
+        """Take a catalog snapshot, see ``catalog_snapshot``.
+
+        The queries of a restarted refresh are cancelled, and a cancel that
+        arrives after its query finished hits the next one, so the snapshot
+        is taken again once if it's cancelled.
+        """
+        try:
+            return catalog_snapshot(executor)
+        except ext.QueryCanceledError:
+            _logger.debug("Catalog snapshot cancelled, retrying")
+            return catalog_snapshot(executor)
+
+    def _stages(self):
+        """Returns the refreshers as lists of (name, refresher) tuples, one
+        list per stage, in the order the stages run."""
+        stages = OrderedDict()
+        for name, refresher in sorted(
+            self.refreshers.items(), key=lambda r: getattr(r[1], "stage", 1)
+        ):
+            stages.setdefault(getattr(refresher, "stage", 1), []).append(
+                (name, refresher)
+            )
+        return list(stages.values())
+
+    def _publish(self, completer, callbacks):
+        """Pass a snapshot of the completer being refreshed to callbacks.
+
+        The refresh keeps extending its own completer, so the snapshot can be
+        used while later stages are still loading.
+        """
+        if not callbacks or self._restart_refresh.is_set():
+            return
+        snapshot = completer.copy()
+        for callback in callbacks:
+            callback(snapshot)
+
+    def _serial_refresh(self, completer, executor, publish=None):
+        """Run the refreshers one after another on a single executor,
+        calling publish after each stage but the last.
+
+        Returns False if a restart was requested before all refreshers ran.
+        """
+        stages = self._stages()
+        for i, stage in enumerate(stages):
+            for name, refresher in stage:
+                if not self._run_refresher(name, refresher, completer, executor):
+                    return False
+                if self._restart_refresh.is_set():
+                    return False
+            if publish and i < len(stages) - 1:
+                publish()
+        return True
+
+    def _run_refresher(self, name, refresher, completer, executor):
+        """Run a refresher, recording its wall time, the number of rows it
+        loaded into the completer and the number of queries it ran.
+
+        Returns False if the refresher was cancelled by a restart.
+        """
+        counter = _CountingCompleter(completer, self._restart_refresh)
+        round_trips = executor.round_trips
+        start = time()
+        if self._cancellable:
+            with self._stats_lock:
+                self._active_executors.add(executor)
+        try:
+            try:
+                refresher(counter, executor)
+            except ext.QueryCanceledError:
+                if self._restart_refresh.is_set():
+                    raise
+                # Hit by a cancel meant for the previous run, which arrived
+                # after the query it was sent for completed
+                _logger.debug("Refresher %s cancelled, retrying", name)
+                counter.rows = 0
+                refresher(counter, executor)
+        except (_RefreshCancelled, ext.QueryCanceledError):
+            if not self._restart_refresh.is_set():
+                raise
+            _logger.debug("Refresher %s cancelled", name)
+            return False
+        finally:
+            with self._stats_lock:
+                self._active_executors.discard(executor)
+        stats = RefresherStats(
+            name, time() - start, counter.rows, executor.round_trips - round_trips
+        )
+        _logger.debug(
+            "Refresher %s: %.3fs, %d rows, %d round trips",
+            name,
+            stats.seconds,
+            stats.rows,
+            stats.round_trips,
+        )
+        with self._stats_lock:
+            self.refresher_stats[name] = stats
+            done, total = self._progress
+            self._progress = (done + 1, total)
+        return True
+
+    def _parallel_refresh(
+        self,
+        completer,
+        pgexecute,
+        executors,
+        extra_executors,
+        concurrency,
+        publish=None,
+    ):
+        """Run independent refreshers on up to `concurrency` connections.
+
+        Stages run one after another, and publish is called after each stage
+        but the last. The refreshers of a stage run in a thread pool, each
+        borrowing an executor from `executors`, and their updates to the
+        completer are applied under a lock once their data has been fetched.
+
+        Returns False if a restart was requested before all refreshers ran.
+        """
+        lock = threading.Lock()
+
+        def run(name, refresher):
+            if self._restart_refresh.is_set():
+                return
+            try:
+                executor = executors.get_nowait()
+            except queue.Empty:
+                executor = pgexecute.acquire()
+                with lock:
+                    extra_executors.append(executor)
+            try:
+                recorder = _RecordingCompleter(completer)
+                if self._run_refresher(name, refresher, recorder, executor):
+                    with lock:
+                        recorder.apply()
+            finally:
+                executors.put(executor)
+
+        stages = self._stages()
+        with ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="completion_refresh"
+        ) as pool:
+            for i, stage in enumerate(stages):
+                for future in [pool.submit(run, *r) for r in stage]:
+                    future.result()
+                if self._restart_refresh.is_set():
+                    return False
+                if publish and i < len(stages) - 1:
+                    publish()
+
+        return True
+
+
+class _RefreshCancelled(Exception):
+    """Raised inside a refresher when a restart was requested."""
+
+
+class _CountingCompleter:
+    """Wraps a completer to count the rows passed to its extend_* methods.
+
+    Loading a row raises _RefreshCancelled once `cancelled` is set, so long
+    refreshers stop between catalog batches instead of running to the end.
+    """
+
+    def __init__(self, completer, cancelled=None):
+        self._completer = completer
+        self._cancelled = cancelled
+        self.rows = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._completer, name)
+        if not name.startswith("extend_") or name == "extend_query_history":
+            return attr
+
+        def count(data, *args, **kwargs):
+            return attr(self._count(data), *args, **kwargs)
+
+        return count
+
+    def _count(self, data):
+        for row in data:
+            if self._cancelled is not None and self._cancelled.is_set():
+                raise _RefreshCancelled()
+            self.rows += 1
+            yield row
+
+
+class _RecordingCompleter:
+    """Stands in for a PGCompleter while a refresher runs in a worker thread.
+
+    Calls to the completer's extend_* and set_* methods are recorded, with
+    any iterator arguments consumed so the catalog queries run in the worker
+    thread. `apply` replays the recorded calls on the real completer.
+    """
+
+    def __init__(self, completer):
+        self._completer = completer
+        self._calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._completer, name)
+        if not name.startswith(("extend_", "set_")):
+            return attr
+
+        def record(*args, **kwargs):
+            args = [list(a) if isinstance(a, Iterator) else a for a in args]
+            self._calls.append((name, args, kwargs))
+
+        return record
+
+    def apply(self):
+        for name, args, kwargs in self._calls:
+            getattr(self._completer, name)(*args, **kwargs)
+        self._calls = []
+
+
+def apply_ddl_change(completer, executor, lock, change):
+    """Apply a DdlChange to completer, fetching columns of created objects."""
+    if change.kind is None:
+        return
+    _logger.debug("Applying DDL change to completions: %r", change)
+    if change.action == "create":
+        columns = list(executor.named_relation_columns(change.schema, change.name))
+        if not columns:
+            return
+        schema, name = columns[0][:2]
+        with lock:
+            for kind in RELATION_KINDS.values():
+                completer.remove_relations([(schema, name)], kind=kind)
+            completer.extend_relations([(schema, name)], kind=change.kind)
+            completer.extend_columns(columns, kind=change.kind)
+        return
+
+    with lock:
+        schema = change.schema or completer.find_relation_schema(
+            change.name, change.kind
+        )
+        if change.action == "drop":
+            completer.remove_relations([(schema, change.name)], kind=change.kind)
+        elif change.action == "rename":
+            completer.rename_relation(
+                schema, change.name, change.new_name, kind=change.kind
+            )
+
+
+def catalog_snapshot(executor):
+    """Returns {relation_id: (schema_name, rel_name, kind)} for the relations
+    in the catalog, or None if the catalog can't be listed."""
+    try:
+        return {
+            id: (schema, name, RELATION_KINDS[type_])
+            for id, schema, name, type_ in executor.catalog_relations()
+            if type_ in RELATION_KINDS
+        }
+    except ext.QueryCanceledError:
+        raise
+    except Exception as e:
+        _logger.debug("Catalog snapshot failed, incremental refresh disabled: %r", e)
+        return None
+
+
+def refresher(name, refreshers=CompletionRefresher.refreshers, stage=1):
     """Decorator to populate the dictionary of refreshers with the current
     function.
+
+    Refreshers run in the order of their stage, and all the refreshers of a
+    stage complete before the next stage starts. A snapshot of the completer
+    can be published after each stage.
     """
 
     def wrapper(wrapped):
+        wrapped.stage = stage
         refreshers[name] = wrapped
         return wrapped
 
     return wrapper
 
 
-@refresher("schemata")
+@refresher("schemata", stage=0)
 def refresh_schemata(completer, executor):
     completer.set_search_path(executor.search_path())
     completer.extend_schemata(executor.schemata())
@@ -113,20 +672,16 @@ def refresh_schemata(completer, executor):
 @refresher("tables")
 def refresh_tables(completer, executor):
     completer.extend_relations(executor.tables(), kind="tables")
-    completer.extend_columns(executor.table_columns(), kind="tables")
-    completer.extend_foreignkeys(executor.foreignkeys())
 
 
 @refresher("sources")
 def refresh_sources(completer, executor):
     completer.extend_relations(executor.sources(), kind="sources")
-    completer.extend_columns(executor.source_columns(), kind="sources")
 
 
 @refresher("views")
 def refresh_views(completer, executor):
     completer.extend_relations(executor.views(), kind="views")
-    completer.extend_columns(executor.view_columns(), kind="views")
 
 
 @refresher("types")
@@ -158,3 +713,22 @@ def refresh_casing(completer, executor):
 def refresh_functions(completer, executor):
     pass
     # completer.extend_functions(executor.functions())
+
+
+@refresher("table_columns", stage=2)
+def refresh_table_columns(completer, executor):
+    if not completer.lazy_columns:
+        completer.extend_columns(executor.table_columns(), kind="tables")
+        completer.extend_foreignkeys(executor.foreignkeys())
+
+
+@refresher("source_columns", stage=2)
+def refresh_source_columns(completer, executor):
+    if not completer.lazy_columns:
+        completer.extend_columns(executor.source_columns(), kind="sources")
+
+
+@refresher("view_columns", stage=2)
+def refresh_view_columns(completer, executor):
+    if not completer.lazy_columns:
+        completer.extend_columns(executor.view_columns(), kind="views")
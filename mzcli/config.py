@@ -74,6 +74,27 @@ def get_casing_file(config):
     return casing_file
 
 
+def get_completion_cache_dir(config):
+    cache_dir = config["main"].get("completion_cache_dir", "default")
+    if cache_dir == "default":
+        cache_dir = config_location() + "completions"
+    return cache_dir
+
+
+def get_type_oid_cache_file(config):
+    cache_file = config["main"].get("type_oid_cache", "default")
+    if cache_file == "default":
+        cache_file = config_location() + "type_oids.json"
+    return cache_file
+
+
+def get_slow_query_log_file(config):
+    log_file = config["main"].get("slow_query_log")
+    if log_file == "default":
+        log_file = config_location() + "slow_queries.jsonl"
+    return log_file
+
+
 def skip_initial_comment(f_stream: TextIO) -> int:
     """
     Initial comment in ~/.pg_service.conf is not always marked with '#'
@@ -0,0 +1,221 @@
+"""A full-screen view of the current state of a SUBSCRIBE statement.
+
+SUBSCRIBE emits a stream of (mz_timestamp, mz_diff, row...) updates. The
+view consolidates them into the rows of the subscribed relation and redraws
+them at a capped rate, highlighting the rows changed since the last redraw.
+"""
+import logging
+import threading
+from itertools import groupby
+
+from prompt_toolkit.application import Application
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.layout import HSplit, Layout, Window
+from prompt_toolkit.layout.controls import FormattedTextControl
+from prompt_toolkit.styles import Style
+
+_logger = logging.getLogger(__name__)
+
+UPDATE_COLUMNS = ("mz_timestamp", "mz_diff")
+
+
+class ConsolidatedView:
+    """The current rows of a subscribed relation, built from its updates.
+
+    Rows are kept in a dict mapping each row to its multiplicity, so an
+    update costs a single lookup however large the relation is.
+    """
+
+    def __init__(self, headers):
+        """
+        :param headers: column names of the SUBSCRIBE output, including
+                        mz_timestamp and mz_diff.
+        """
+        self._timestamp = headers.index("mz_timestamp")
+        self._diff = headers.index("mz_diff")
+        self._columns = [
+            i for i, header in enumerate(headers) if header not in UPDATE_COLUMNS
+        ]
+        self.headers = [headers[i] for i in self._columns]
+        self.counts = {}
+        self.timestamp = None
+        self.updates = 0
+        # Rows inserted or deleted since the last call to rows()
+        self.changed = set()
+        self._sorted = []
+        self._dirty = False
+
+    def apply(self, updates):
+        """Apply a batch of updates, one timestamp at a time."""
+        updates = sorted(updates, key=lambda update: update[self._timestamp])
+        for timestamp, group in groupby(
+            updates, key=lambda update: update[self._timestamp]
+        ):
+            for update in group:
+                row = tuple(update[i] for i in self._columns)
+                count = self.counts.get(row, 0) + update[self._diff]
+                if count > 0:
+                    self.counts[row] = count
+                else:
+                    self.counts.pop(row, None)
+                self.changed.add(row)
+            self.timestamp = timestamp
+        self.updates += len(updates)
+        self._dirty = self._dirty or bool(updates)
+
+    def rows(self):
+        """Returns (rows, changed): the sorted rows, with duplicates repeated,
+        and the rows changed since the previous call."""
+        if self._dirty:
+            try:
+                self._sorted = sorted(self.counts, key=_sort_key)
+            except TypeError:
+                self._sorted = list(self.counts)
+            self._dirty = False
+        changed, self.changed = self.changed, set()
+        rows = [row for row in self._sorted for _ in range(self.counts[row])]
+        return rows, changed
+
+
+def _sort_key(row):
+    return tuple((value is None, value) for value in row)
+
+
+class LiveView:
+    """Shows a ConsolidatedView of a SubscribeCursor in a full-screen
+    application until q or Ctrl+C is pressed.
+
+    Updates are fetched on a background thread into an UpdateBuffer, and
+    applied to the view when it is redrawn.
+    """
+
+    # Minimum number of seconds between two redraws
+    redraw_interval = 0.1
+
+    def __init__(self, cursor, headers, format_rows, buffer):
+        """
+        :param cursor: an open SubscribeCursor.
+        :param headers: column names of the SUBSCRIBE output, without
+                        mz_progressed.
+        :param format_rows: callable taking rows and headers, returning the
+                            formatted lines of a table.
+        :param buffer: UpdateBuffer receiving the updates of the cursor.
+        """
+        self.cursor = cursor
+        self.view = ConsolidatedView(headers)
+        self.format_rows = format_rows
+        self.buffer = buffer
+        self._offset = 0
+        self._app = None
+
+    @property
+    def error(self):
+        return self.buffer.error
+
+    def run(self):
+        """Run the view. The cursor is closed when it returns."""
+        self._app = self._create_application()
+        # Redraw when updates are buffered, which drains the buffer
+        self.buffer.callback = self._app.invalidate
+        reader = threading.Thread(target=self._read, name="live_view")
+        reader.daemon = True
+        reader.start()
+        try:
+            self._app.run()
+        finally:
+            self.buffer.stop(reader)
+            self.cursor.close()
+        if self.error:
+            _logger.error("Live view stopped: %r", self.error)
+            raise self.error
+
+    def _read(self):
+        if "mz_progressed" in (column[0] for column in self.cursor.description):
+            # Progress messages have no diff, only the updates they close
+            # are shown
+            batches = self.cursor.consistent_batches()
+        else:
+            batches = self.cursor.batches()
+        self.buffer.fill(batches)
+        self._app.invalidate()
+
+    def _create_application(self):
+        bindings = KeyBindings()
+
+        @bindings.add("q")
+        @bindings.add("c-c")
+        def _(event):
+            event.app.exit()
+
+        @bindings.add("down")
+        def _(event):
+            self._offset += 1
+
+        @bindings.add("up")
+        def _(event):
+            self._offset = max(self._offset - 1, 0)
+
+        @bindings.add("pagedown")
+        def _(event):
+            self._offset += self._page_size()
+
+        @bindings.add("pageup")
+        def _(event):
+            self._offset = max(self._offset - self._page_size(), 0)
+
+        layout = Layout(
+            HSplit(
+                [
+                    Window(FormattedTextControl(self._get_table)),
+                    Window(FormattedTextControl(self._get_status), height=1),
+                ]
+            )
+        )
+        style = Style.from_dict(
+            {"live.changed": "reverse", "live.status": "bg:#222222 #aaaaaa"}
+        )
+        return Application(
+            layout=layout,
+            key_bindings=bindings,
+            style=style,
+            full_screen=True,
+            min_redraw_interval=self.redraw_interval,
+        )
+
+    def _page_size(self):
+        # Leave room for the table borders and the status line
+        return max(self._app.output.get_size().rows - 5, 1)
+
+    def _get_table(self):
+        self.view.apply(self.buffer.get(timeout=0))
+        rows, changed = self.view.rows()
+        self._offset = min(self._offset, max(len(rows) - 1, 0))
+        visible = rows[self._offset : self._offset + self._page_size()]
+        if not visible:
+            return [("", "Waiting for rows...")]
+        lines = list(self.format_rows(visible, self.view.headers))
+        # Rows are the last lines of the table, between its borders. Changes
+        # aren't highlighted when values span several lines.
+        first_row = len(lines) - len(visible) - 1
+        aligned = first_row == 3
+        result = []
+        for i, line in enumerate(lines):
+            row = i - first_row
+            style = ""
+            if aligned and 0 <= row < len(visible) and visible[row] in changed:
+                style = "class:live.changed"
+            result.append((style, line + "\n"))
+        return result
+
+    def _get_status(self):
+        view = self.view
+        status = " {} rows, {} updates, as of {}".format(
+            sum(view.counts.values()), view.updates, view.timestamp
+        )
+        if self.buffer.describe():
+            status += " ({})".format(self.buffer.describe())
+        if self.error:
+            status += ", error: {}".format(self.error)
+        elif self.buffer.finished:
+            status += ", subscription complete"
+        return [("class:live.status", status + "  [q] quit  [↑↓] scroll")]
@@ -0,0 +1,101 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+
+from .pgexecute import backoff_delays
+
+_logger = logging.getLogger(__name__)
+
+
+class LivenessMonitor:
+    """Checks the connection while the user is idle at the prompt.
+
+    A background thread pings the connection every `interval` seconds while
+    the prompt is shown. A lost connection is reestablished, with its
+    session settings, before the user runs the next command. Pooled
+    connections idle for too long are closed on the same schedule.
+    """
+
+    def __init__(self, get_pgexecute, interval, attempts=1, max_delay=30):
+        """
+        :param get_pgexecute: callable returning the current PGExecute.
+        :param interval: seconds between two checks.
+        :param attempts: number of reconnect attempts.
+        :param max_delay: maximum number of seconds between two attempts.
+        """
+        self.get_pgexecute = get_pgexecute
+        self.interval = interval
+        self.attempts = attempts
+        self.max_delay = max_delay
+        self.reconnect_count = 0
+        self._idle = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="liveness_monitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @contextmanager
+    def idle(self):
+        """Context in which the connection isn't used, e.g. while prompting.
+        Leaving it waits for a check in progress to complete."""
+        with self._lock:
+            self._idle = True
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._idle = False
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+            pgexecute = self.get_pgexecute()
+            if pgexecute is not None:
+                pgexecute.evict_idle()
+
+    def check(self):
+        """Ping the connection if the user is idle, and reconnect if it is
+        broken.
+
+        The lock is only held during a ping or a reconnect attempt, not while
+        waiting between attempts, so leaving idle() is never blocked by the
+        backoff. Attempts stop once the user isn't idle anymore: the command
+        run next reconnects if needed.
+
+        :return: False if the connection is broken and wasn't reestablished
+        """
+        with self._lock:
+            pgexecute = self.get_pgexecute()
+            if not self._idle or pgexecute is None or pgexecute.ping():
+                return True
+        _logger.info("Connection lost while idle, reconnecting")
+        for delay in backoff_delays(self.attempts, max_delay=self.max_delay):
+            with self._lock:
+                if not self._idle:
+                    return False
+                pgexecute = self.get_pgexecute()
+                if pgexecute.ping():
+                    # Reconnected by a command run meanwhile
+                    return True
+                try:
+                    pgexecute.reconnect()
+                except psycopg2.OperationalError as e:
+                    if delay is None:
+                        _logger.error("Reconnect failed: %r", e)
+                        return False
+                    _logger.debug("Reconnect failed, retrying in %.1fs: %r", delay, e)
+                else:
+                    self.reconnect_count += 1
+                    return True
+            if self._stop.wait(delay):
+                return False
@@ -15,7 +15,6 @@ import traceback
 import logging
 import threading
 import shutil
-import functools
 import pendulum
 import datetime as dt
 import itertools
@@ -55,10 +54,29 @@ import pgspecial as special
 from .pgcompleter import PGCompleter
 from .pgtoolbar import create_toolbar_tokens_func
 from .pgstyle import style_factory, style_factory_output
-from .pgexecute import PGExecute
+from .pgexecute import (
+    FetchedRows,
+    PGExecute,
+    StreamingCursor,
+    SubscribeCursor,
+    set_type_oid_cache,
+)
 from .completion_refresher import CompletionRefresher
+from .column_loader import ColumnLoader
+from .catalog_watcher import CatalogWatcher
+from .live_view import ConsolidatedView, LiveView
+from .liveness import LivenessMonitor
+from .update_buffer import OVERFLOW_POLICIES, UpdateBuffer
+from .watch_result import WatchResult
+from .timing import StatementTiming
+from .stats import SessionStats
+from .slow_log import SlowQueryLog
+from . import completion_cache
 from .config import (
     get_casing_file,
+    get_completion_cache_dir,
+    get_type_oid_cache_file,
+    get_slow_query_log_file,
     load_config,
     config_location,
     ensure_dir_exists,
@@ -67,6 +85,8 @@ from .config import (
 )
 from .key_bindings import pgcli_bindings
 from .packages.prompt_utils import confirm_destructive_query
+from .packages.parseutils.ddl import parse_ddl
+from .packages.parseutils.fingerprint import normalize_query
 from .__init__ import __version__
 
 click.disable_unicode_literals_warning = True
@@ -78,6 +98,7 @@ except ImportError:
 
 from getpass import getuser
 from psycopg2 import OperationalError, InterfaceError
+from psycopg2.extensions import QueryCanceledError
 import psycopg2
 
 from collections import namedtuple
@@ -101,9 +122,22 @@ MetaQuery = namedtuple(
         "path_changed",  # True if any subquery changed the search path
         "mutated",  # True if any subquery executed insert/update/delete
         "is_special",  # True if the query is a special command
+        "ddl_changes",  # Catalog changes made, None if they couldn't be parsed
+        "timings",  # StatementTiming of each subquery
     ],
 )
-MetaQuery.__new__.__defaults__ = ("", False, 0, 0, False, False, False, False)
+MetaQuery.__new__.__defaults__ = (
+    "",
+    False,
+    0,
+    0,
+    False,
+    False,
+    False,
+    False,
+    None,
+    None,
+)
 
 OutputSettings = namedtuple(
     "OutputSettings",
@@ -175,6 +209,12 @@ class PGCli:
         self.pgexecute = pgexecute
         self.dsn_alias = None
         self.watch_command = None
+        # Callables called with the StatementTiming of every statement run
+        self.timing_hooks = []
+        self.session_stats = SessionStats()
+        self.timing_hooks.append(self.session_stats.record)
+        # Results of the statements run by \watch, while it runs
+        self._watch_results = None
 
         # Load config.
         c = self.config = get_config(mzclirc_file)
@@ -202,6 +242,40 @@ class PGCli:
             self.row_limit = row_limit
         else:
             self.row_limit = c["main"].as_int("row_limit")
+        self.fetch_count = c["main"].as_int("fetch_count")
+        self.stream_buffer_size = c["main"].as_int("stream_buffer_size")
+        self.stream_overflow = c["main"]["stream_overflow"]
+        if self.stream_overflow not in OVERFLOW_POLICIES:
+            self.stream_overflow = "block"
+        self.watch_mode = c["main"]["watch_mode"]
+        self.watch_diff = c["main"].as_bool("watch_diff")
+        self.reconnect_attempts = c["main"].as_int("reconnect_attempts")
+        self.reconnect_max_delay = c["main"].as_float("reconnect_max_delay")
+        self.liveness_monitor = LivenessMonitor(
+            lambda: self.pgexecute,
+            c["main"].as_float("ping_interval"),
+            self.reconnect_attempts,
+            self.reconnect_max_delay,
+        )
+        self.slow_query_log = None
+        slow_query_log_file = get_slow_query_log_file(c)
+        if slow_query_log_file:
+            self.slow_query_log = SlowQueryLog(
+                slow_query_log_file,
+                c["main"].as_float("slow_query_threshold"),
+                lambda: self.pgexecute,
+                explain=c["main"].as_bool("slow_query_explain"),
+                max_size=c["main"].as_int("slow_query_log_max_size"),
+            )
+            self.timing_hooks.append(self.slow_query_log.record)
+        self.keepalive_params = {}
+        if c["main"].get("keepalives_idle"):
+            self.keepalive_params = {
+                "keepalives": 1,
+                "keepalives_idle": c["main"].as_int("keepalives_idle"),
+                "keepalives_interval": c["main"].as_int("keepalives_interval"),
+                "keepalives_count": c["main"].as_int("keepalives_count"),
+            }
 
         # if not specified, set to DEFAULT_MAX_FIELD_WIDTH
         # if specified but empty, set to None to disable truncation
@@ -247,12 +321,23 @@ class PGCli:
         self.now = dt.datetime.today()
 
         self.completion_refresher = CompletionRefresher()
+        self.completion_cache_dir = get_completion_cache_dir(c)
+        set_type_oid_cache(get_type_oid_cache_file(c))
+        self.watch_catalog = c["main"].as_bool("watch_catalog")
+        self.catalog_watcher = None
 
         self.query_history = []
 
         # Initialize completer
         smart_completion = c["main"].as_bool("smart_completion")
         keyword_casing = c["main"]["keyword_casing"]
+        lazy_columns = c["main"].as_bool("lazy_columns")
+        self.column_loader = (
+            ColumnLoader(lambda: self.pgexecute) if lazy_columns else None
+        )
+        # Reentrant, as completers fetching columns lazily take it to add them
+        # while completing, which get_completions does holding it.
+        self._completer_lock = threading.RLock()
         self.settings = {
             "casing_file": get_casing_file(c),
             "generate_casing_file": c["main"].as_bool("generate_casing_file"),
@@ -264,13 +349,16 @@ class PGCli:
             "single_connection": single_connection,
             "less_chatty": less_chatty,
             "keyword_casing": keyword_casing,
+            "refresh_concurrency": c["main"].as_int("refresh_concurrency"),
+            "lazy_columns": lazy_columns,
+            "column_fetcher": self.column_loader,
+            "metadata_lock": self._completer_lock,
         }
 
         completer = PGCompleter(
             smart_completion, pgspecial=self.pgspecial, settings=self.settings
         )
         self.completer = completer
-        self._completer_lock = threading.Lock()
         self.register_special_commands()
 
         self.prompt_app = None
@@ -316,11 +404,16 @@ class PGCli:
             arg_type=NO_QUERY,
         )
         self.pgspecial.register(
-            refresh_callback,
-            "\\refresh",
+            self.refresh_command,
             "\\refresh",
-            "Refresh auto-completions.",
-            arg_type=NO_QUERY,
+            "\\refresh [stats]",
+            "Refresh auto-completions, or show statistics of the last refresh.",
+        )
+        self.pgspecial.register(
+            self.stats_command,
+            "\\stats",
+            "\\stats [reset|csv filename]",
+            "Show the latency of the queries run in this session.",
         )
         self.pgspecial.register(
             self.execute_from_file, "\\i", "\\i filename", "Execute commands from file."
@@ -340,6 +433,106 @@ class PGCli:
             "\\T [format]",
             "Change the table format used to output results",
         )
+        self.pgspecial.register(
+            self.live_view,
+            "\\live",
+            "\\live relation|query",
+            "Show the current rows of a relation or query, updated as they change.",
+        )
+
+    def live_view(self, pattern, **_):
+        query = pattern.strip().rstrip(";").strip()
+        if not query:
+            message = "\\live: missing required argument"
+            return [(None, None, None, message, "", False, True)]
+        if not re.match(r"(subscribe|tail)\b", query, re.IGNORECASE):
+            if re.match(r"(select|with|values)\b", query, re.IGNORECASE):
+                query = "SUBSCRIBE (%s)" % query
+            else:
+                query = "SUBSCRIBE %s" % query
+
+        cur = SubscribeCursor(self.pgexecute.conn, query)
+        if not cur.open():
+            message = "\\live: the server does not support SUBSCRIBE"
+            return [(None, None, None, message, "", False, True)]
+        # Progress messages are left out by the view, WITH (PROGRESS)
+        headers = [
+            column[0] for column in cur.description if column[0] != "mz_progressed"
+        ]
+        if "mz_timestamp" not in headers or "mz_diff" not in headers:
+            cur.close()
+            message = "\\live: the subscription has no mz_diff column"
+            return [(None, None, None, message, "", False, True)]
+
+        # A plain table, so every row is formatted on its own line
+        settings = OutputSettings(
+            table_format="psql",
+            dcmlfmt=self.decimal_format,
+            floatfmt=self.float_format,
+            missingval=self.null_string,
+            max_field_width=self.max_field_width,
+        )
+
+        def format_rows(rows, headers):
+            output = format_output(None, rows, headers, None, settings)
+            return "\n".join(output).splitlines()
+
+        buffer = self._update_buffer(headers, consolidated=True)
+        view = LiveView(cur, headers, format_rows, buffer)
+        view.run()
+        message = "Live view stopped after %s updates" % view.view.updates
+        return [(None, None, None, message)]
+
+    def refresh_command(self, pattern, **_):
+        if not pattern:
+            return self.refresh_completions(persist_priorities="all")
+        if pattern.strip().lower() != "stats":
+            message = "\\refresh: unknown argument %s" % pattern
+            return [(None, None, None, message)]
+
+        refresher = self.completion_refresher
+        headers = ["refresher", "seconds", "rows", "round trips"]
+        rows = [
+            (stats.name, "%0.03f" % stats.seconds, stats.rows, stats.round_trips)
+            for stats in refresher.refresher_stats.values()
+        ]
+        status = "%s refreshes, %s restarts" % (
+            refresher.refresh_count,
+            refresher.restart_count,
+        )
+        if refresher.last_refresh_seconds is not None:
+            status += ", last refresh took %0.03fs" % refresher.last_refresh_seconds
+        if refresher.progress():
+            status += ", refresh in progress"
+        return [("Completion refresh statistics", rows, headers, status)]
+
+    def stats_command(self, pattern, **_):
+        args = pattern.split(None, 1)
+        command = args[0].lower() if args else ""
+        if command == "reset":
+            self.session_stats.reset()
+            return [(None, None, None, "Query statistics reset")]
+        if command == "csv":
+            if len(args) < 2:
+                message = "\\stats csv: missing required argument filename"
+                return [(None, None, None, message, "", False, True)]
+            filename = os.path.abspath(os.path.expanduser(args[1].strip()))
+            try:
+                count = self.session_stats.export(filename)
+            except OSError as e:
+                return [(None, None, None, str(e), "", False, True)]
+            message = 'Wrote statistics of %s queries to "%s"' % (count, filename)
+            return [(None, None, None, message)]
+        if command:
+            message = "\\stats: unknown argument %s" % pattern
+            return [(None, None, None, message, "", False, True)]
+
+        rows = [
+            row[:3] + tuple("%0.03f" % seconds for seconds in row[3:])
+            for row in self.session_stats.rows()
+        ]
+        status = "%s queries, latencies in seconds" % len(rows)
+        return [("Query statistics", rows, SessionStats.headers, status)]
 
     def change_table_format(self, pattern, **_):
         try:
@@ -537,6 +730,10 @@ class PGCli:
             database = "materialize"
 
         kwargs.setdefault("application_name", "pgcli")
+        # Keepalive settings of the DSN take precedence
+        if "keepalives" not in (dsn or ""):
+            for name, value in self.keepalive_params.items():
+                kwargs.setdefault(name, value)
 
         # If password prompt is not forced but no password is provided, try
         # getting it from environment variable.
@@ -685,8 +882,9 @@ class PGCli:
                     click.secho("Your call!")
             output, query = self._evaluate_command(text)
         except KeyboardInterrupt:
-            # Restart connection to the database
-            self.pgexecute.connect()
+            # Keep the session, unless the connection was broken
+            if not self.pgexecute.reset_after_cancel():
+                click.secho("Reconnected to the database", err=True, fg="red")
             logger.debug("cancelled query, sql: %r", text)
             click.secho("cancelled query", err=True, fg="red")
         except NotImplementedError:
@@ -702,20 +900,30 @@ class PGCli:
             logger.error("traceback: %r", traceback.format_exc())
             click.secho(str(e), err=True, fg="red")
         else:
+            # The output of every subquery is written at once
+            timing = query.timings[-1] if query.timings else StatementTiming(text)
+            output_time = timing.output
             try:
                 if self.output_file and not text.startswith(("\\o ", "\\? ")):
-                    try:
-                        with open(self.output_file, "a", encoding="utf-8") as f:
-                            click.echo(text, file=f)
-                            click.echo("\n".join(output), file=f)
-                            click.echo("", file=f)  # extra newline
-                    except OSError as e:
-                        click.secho(str(e), err=True, fg="red")
+                    with timing.measure("output"):
+                        try:
+                            with open(self.output_file, "a", encoding="utf-8") as f:
+                                click.echo(text, file=f)
+                                click.echo("\n".join(output), file=f)
+                                click.echo("", file=f)  # extra newline
+                        except OSError as e:
+                            click.secho(str(e), err=True, fg="red")
                 else:
                     if output:
-                        self.echo_via_pager("\n".join(output))
+                        self._echo_output(output, timing)
             except KeyboardInterrupt:
                 pass
+            output_time = timing.output - output_time
+            query = query._replace(total_time=query.total_time + output_time)
+            if query.timings:
+                for timing in query.timings:
+                    for hook in self.timing_hooks:
+                        hook(timing)
 
             if self.pgspecial.timing_enabled:
                 # Only add humanized time display if > 1 second
@@ -731,15 +939,25 @@ class PGCli:
                     )
                 else:
                     print("Time: %0.03fs" % query.total_time)
+                for timing in query.timings or ():
+                    print("  %s" % timing.describe())
 
             # Check if we need to update completions, in order of most
             # to least drastic changes
             if query.db_changed:
                 with self._completer_lock:
                     self.completer.reset_completions()
+                self.load_completion_cache()
                 self.refresh_completions(persist_priorities="keywords")
+                self.start_catalog_watcher()
+            elif query.meta_changed and self.catalog_watcher_running():
+                # The catalog watcher picks up the changes.
+                pass
             elif query.meta_changed:
-                self.refresh_completions(persist_priorities="all")
+                if query.ddl_changes is not None:
+                    self.update_completions(query.ddl_changes)
+                else:
+                    self.refresh_completions(persist_priorities="all", incremental=True)
             elif query.path_changed:
                 logger.debug("Refreshing search path")
                 with self._completer_lock:
@@ -754,7 +972,11 @@ class PGCli:
         if history_file == "default":
             history_file = config_location() + "history"
         history = FileHistory(os.path.expanduser(history_file))
+        self.load_completion_cache()
         self.refresh_completions(history=history, persist_priorities="none")
+        self.start_catalog_watcher()
+        if self.liveness_monitor.interval > 0:
+            self.liveness_monitor.start()
 
         self.prompt_app = self._build_cli(history)
 
@@ -766,7 +988,8 @@ class PGCli:
         try:
             while True:
                 try:
-                    text = self.prompt_app.prompt()
+                    with self.liveness_monitor.idle():
+                        text = self.prompt_app.prompt()
                 except KeyboardInterrupt:
                     continue
 
@@ -789,6 +1012,15 @@ class PGCli:
         except (PgCliQuitError, EOFError):
             if not self.less_chatty:
                 print("Goodbye!")
+        finally:
+            if self.catalog_watcher:
+                self.catalog_watcher.stop()
+            self.liveness_monitor.stop()
+            if self.slow_query_log:
+                # Plans being fetched are only written if they arrive quickly
+                self.slow_query_log.flush(timeout=1)
+            if self.pgexecute:
+                self.pgexecute.close_pool()
 
     def handle_watch_command(self, text):
         # Initialize default metaquery in case execution fails
@@ -804,8 +1036,14 @@ class PGCli:
                 )
                 self.watch_command = None
 
-        # If there's a command to \watch, run it in a loop.
+        # If there's a command to \watch, subscribe to it, or run it in a loop
+        # if it can't be subscribed to.
         if self.watch_command:
+            if self.watch_mode == "subscribe" and not self.output_file:
+                query = self._watch_subscribe(self.watch_command, timing)
+                if query is not None:
+                    self.watch_command = None
+            self._watch_results = {}
             while self.watch_command:
                 try:
                     query = self.execute_command(self.watch_command)
@@ -813,6 +1051,7 @@ class PGCli:
                     sleep(timing)
                 except KeyboardInterrupt:
                     self.watch_command = None
+            self._watch_results = None
 
         # Otherwise, execute it as a regular command.
         else:
@@ -820,6 +1059,79 @@ class PGCli:
 
         self.query_history.append(query)
 
+    def _watch_subscribe(self, text, timing):
+        """Watch a query through a SUBSCRIBE to its result, printing the
+        current result every `timing` seconds until Ctrl+C is pressed.
+
+        Only the changes to the result are transferred, and applied to a
+        ConsolidatedView of it once their timestamp is closed, so every
+        printed result is consistent. Its rows are sorted by their values.
+
+        :return: a MetaQuery, or None if the query can't be subscribed to
+        """
+        if re.search(r"\border by\b", normalize_query(text)):
+            # The rows of a ConsolidatedView are sorted by their values, so
+            # the order of sorted results is kept by polling them
+            return None
+        start = time()
+        cur = self.pgexecute.subscribe(text)
+        if cur is None:
+            return None
+        self.logger.debug("Watching with SUBSCRIBE, sql: %r", text)
+
+        headers = [
+            column[0] for column in cur.description if column[0] != "mz_progressed"
+        ]
+        view = ConsolidatedView(headers)
+        buffer = self._update_buffer(headers, consolidated=True)
+        reader = threading.Thread(
+            target=buffer.fill, args=(cur.consistent_batches(),), name="watch"
+        )
+        reader.daemon = True
+        reader.start()
+        settings = self._output_settings()
+        execution = 0
+        successful = True
+        self._watch_results = {}
+        try:
+            # Wait for the current result to be complete
+            while not cur.snapshot_complete and not buffer.finished:
+                view.apply(buffer.get(timeout=0.1))
+            view.apply(buffer.get(timeout=0))
+            execution = time() - start
+            while True:
+                rows = view.rows()[0]
+                rows, headers, status = self._watch_output(
+                    0, rows, view.headers, "SELECT %s" % len(rows)
+                )
+                click.echo(
+                    "\n".join(format_output(None, rows, headers, status, settings))
+                )
+                if buffer.finished:
+                    break
+                click.echo(f"Waiting for {timing} seconds before repeating")
+                deadline = time() + timing
+                while time() < deadline and not buffer.finished:
+                    view.apply(buffer.get(timeout=deadline - time()))
+            if buffer.error:
+                raise buffer.error
+        except (KeyboardInterrupt, QueryCanceledError):
+            pass
+        except psycopg2.Error as e:
+            self.logger.error("sql: %r, error: %r", text, e)
+            click.secho(str(e), err=True, fg="red")
+            successful = False
+        finally:
+            buffer.stop(reader)
+            cur.close()
+            self._watch_results = None
+        return MetaQuery(
+            query=text,
+            successful=successful,
+            total_time=time() - start,
+            execution_time=execution,
+        )
+
     def _build_cli(self, history):
         key_bindings = pgcli_bindings(self)
 
@@ -926,6 +1238,224 @@ class PGCli:
 
         return new_cur, new_status
 
+    def _flush_output(self, output, timing):
+        """Print the output of the previous statements of a command before a
+        result is streamed. Output to a file is written once the command
+        completes.
+
+        :param timing: StatementTiming of the last of those statements.
+        """
+        if output and not self.output_file:
+            self._echo_output(output, timing)
+            del output[:]
+
+    def _echo_output(self, output, timing):
+        """Print output, adding the time it took to the output phase of
+        timing, or to its pager time when the output was paged."""
+        start = time()
+        paged = self.echo_via_pager("\n".join(output))
+        if paged:
+            timing.pager += time() - start
+        else:
+            timing.output += time() - start
+
+    def _output_stream(self, title, cur, headers, sql, settings):
+        """Print the rows of a StreamingCursor one batch at a time, applying
+        the row limit. Returns the status of the statement."""
+        if is_select(sql) and not self._has_limit(sql):
+            limit = self.row_limit
+        else:
+            limit = 0
+        timing = cur.timing
+        measured = timing.fetch + timing.typecast + timing.format
+        start = time()
+        paged = False
+        try:
+            paged = self._echo_stream(
+                self._format_stream(title, cur, headers, settings, limit)
+            )
+        finally:
+            cur.close()
+            # Batches are fetched and formatted as they are output
+            measured = timing.fetch + timing.typecast + timing.format - measured
+            if paged:
+                timing.pager += max(time() - start - measured, 0)
+            else:
+                timing.output += max(time() - start - measured, 0)
+        if limit and cur.rows > limit:
+            click.secho("The result was limited to %s rows" % limit, fg="red")
+            return "SELECT " + str(limit)
+        return cur.statusmessage
+
+    def _output_subscribe(self, title, cur, headers, settings, output):
+        """Print the updates of a SubscribeCursor as they arrive, until the
+        subscription completes or Ctrl+C is pressed.
+
+        Updates are fetched on a background thread into an UpdateBuffer, whose
+        overflow policy applies when they arrive faster than they are printed.
+        They're printed through the pager like other streamed results, or,
+        with an output file, added to output, which is written to the file
+        once the subscription stops.
+        """
+        printed = 0
+        stopped = False
+        buffer = self._update_buffer(headers)
+        reader = threading.Thread(
+            target=buffer.fill, args=(cur.batches(),), name="subscribe"
+        )
+        reader.daemon = True
+        reader.start()
+
+        def formatted_batches():
+            nonlocal title, printed, stopped
+            try:
+                while True:
+                    batch = buffer.get()
+                    if not batch:
+                        break
+                    yield format_output(
+                        title, batch, headers, None, settings, offset=printed
+                    )
+                    title = None
+                    printed += len(batch)
+                if buffer.error:
+                    raise buffer.error
+            except (KeyboardInterrupt, QueryCanceledError):
+                # The pager would swallow the interruption
+                stopped = True
+
+        try:
+            if self.output_file:
+                for formatted in formatted_batches():
+                    output.extend(formatted)
+            else:
+                self._echo_stream(
+                    "\n".join(formatted) + "\n" for formatted in formatted_batches()
+                )
+        except (KeyboardInterrupt, QueryCanceledError):
+            stopped = True
+        finally:
+            buffer.stop(reader)
+            cur.close()
+        if stopped:
+            # Only the subscription is cancelled, the connection stays open
+            message = "Subscription stopped after %s updates" % printed
+            if buffer.describe():
+                message += " (%s)" % buffer.describe()
+            click.secho(message, fg="red")
+
+    def _update_buffer(self, headers, consolidated=False):
+        """
+        :param consolidated: whether the updates are applied to a
+                             ConsolidatedView, which would keep rows whose
+                             retraction was dropped. Updates are then
+                             coalesced instead of dropped.
+        """
+        policy = self.stream_overflow
+        if consolidated and policy == "drop":
+            policy = "coalesce"
+        return UpdateBuffer(headers, self.stream_buffer_size, policy)
+
+    def _format_stream(self, title, cur, headers, settings, limit):
+        """Yields the formatted output of a StreamingCursor, one string per
+        batch of rows. Every batch is formatted as its own table."""
+        printed = 0
+        for batch in cur.batches():
+            if limit and printed + len(batch) > limit:
+                batch = batch[: limit - printed]
+            if batch:
+                with cur.timing.measure("format"):
+                    formatted = format_output(
+                        title, batch, headers, None, settings, offset=printed
+                    )
+                    formatted = "\n".join(formatted) + "\n"
+                yield formatted
+            title = None
+            printed += len(batch)
+            if limit and printed >= limit:
+                break
+        if title:
+            # The result was empty
+            yield title + "\n"
+        if settings.table_format != "csv":
+            status = "SELECT {}".format(min(cur.rows, limit) if limit else cur.rows)
+            yield status + "\n"
+
+    def _echo_stream(self, chunks):
+        """Like echo_via_pager, for output produced in chunks. In the
+        long output mode of the pager, the first chunk decides whether the
+        pager is used.
+
+        :return: whether the pager was used
+        """
+        chunks = iter(chunks)
+        first = next(chunks, None)
+        if first is None:
+            return False
+        chunks = itertools.chain([first], chunks)
+        if self.pgspecial.pager_config == PAGER_OFF or self.watch_command:
+            use_pager = False
+        elif (
+            self.pgspecial.pager_config == PAGER_LONG_OUTPUT
+            and self.table_format != "csv"
+        ):
+            lines = first.rstrip("\n").split("\n")
+            use_pager = self.is_too_tall(lines) or any(
+                self.is_too_wide(l) for l in lines
+            )
+        else:
+            use_pager = True
+        if use_pager:
+            click.echo_via_pager(chunks)
+        else:
+            for chunk in chunks:
+                click.echo(chunk, nl=False)
+        return use_pager
+
+    def _watch_output(self, key, cur, headers, status):
+        """Compare a result of \\watch with the one of the previous run.
+
+        :return: (cur, headers, status) to output: only a status when the
+                 result didn't change, and only the added and removed rows
+                 with watch_diff.
+        """
+        result = self._watch_results.get(key)
+        if result is None:
+            result = self._watch_results[key] = WatchResult(self.watch_diff)
+        rows = result.update(cur)
+        if not result.changed:
+            return None, headers, "No changes"
+        if result.diff and result.runs > 1:
+            status = "%s rows added, %s rows removed" % (
+                len(result.added),
+                len(result.removed),
+            )
+            return result.changes(), [""] + list(headers), status
+        return rows, headers, status
+
+    def _output_settings(self):
+        if self.pgspecial.auto_expand or self.auto_expand:
+            max_width = self.prompt_app.output.get_size().columns
+        else:
+            max_width = None
+
+        expanded = self.pgspecial.expanded_output or self.expanded_output
+        return OutputSettings(
+            table_format=self.table_format,
+            dcmlfmt=self.decimal_format,
+            floatfmt=self.float_format,
+            missingval=self.null_string,
+            expanded=expanded,
+            max_width=max_width,
+            case_function=(
+                self.completer.case
+                if self.settings["case_column_headers"]
+                else lambda x: x
+            ),
+            style_output=self.style_output,
+            max_field_width=self.max_field_width,
+        )
+
     def _evaluate_command(self, text):
         """Used to run a command entered by the user during CLI operation
         (Puts the E in REPL)
@@ -940,117 +1470,266 @@ class PGCli:
         mutated = False  # INSERT, DELETE, etc
         db_changed = False
         path_changed = False
+        ddl_changes = []
         output = []
+        timings = []
         total = 0
         execution = 0
 
         # Run the query.
         start = time()
         on_error_resume = self.on_error == "RESUME"
+        # Streamed results are printed as they arrive, which isn't possible
+        # when writing them to the output file after the query text.
+        fetch_count = 0 if self.output_file else self.fetch_count
         res = self.pgexecute.run(
-            text, self.pgspecial, exception_formatter, on_error_resume
+            text,
+            self.pgspecial,
+            exception_formatter,
+            on_error_resume,
+            fetch_count=fetch_count,
+            row_limit=self.row_limit,
         )
 
         is_special = None
+        # When the previous statement was done with
+        produced = start
 
-        for title, cur, headers, status, sql, success, is_special in res:
+        for i, (title, cur, headers, status, sql, success, is_special) in enumerate(
+            res
+        ):
             logger.debug("headers: %r", headers)
             logger.debug("rows: %r", cur)
             logger.debug("status: %r", status)
 
-            if self._should_limit_output(sql, cur):
-                cur, status = self._limit_output(cur)
-
-            if self.pgspecial.auto_expand or self.auto_expand:
-                max_width = self.prompt_app.output.get_size().columns
+            settings = self._output_settings()
+            if isinstance(cur, StreamingCursor) and timings:
+                # Results are printed in the order of their statements
+                self._flush_output(output, timings[-1])
+            timing = self.pgexecute.timing
+            if timing is None:
+                # Special commands are run while their result is produced
+                timing = StatementTiming(sql)
+                timing.execute = time() - produced
+            timing.special = bool(is_special)
+            timings.append(timing)
+            if isinstance(cur, SubscribeCursor):
+                self._output_subscribe(title, cur, headers, settings, output)
+                total = time() - start
+            elif isinstance(cur, StreamingCursor):
+                status = self._output_stream(title, cur, headers, sql, settings)
+                total = time() - start
             else:
-                max_width = None
-
-            expanded = self.pgspecial.expanded_output or self.expanded_output
-            settings = OutputSettings(
-                table_format=self.table_format,
-                dcmlfmt=self.decimal_format,
-                floatfmt=self.float_format,
-                missingval=self.null_string,
-                expanded=expanded,
-                max_width=max_width,
-                case_function=(
-                    self.completer.case
-                    if self.settings["case_column_headers"]
-                    else lambda x: x
-                ),
-                style_output=self.style_output,
-                max_field_width=self.max_field_width,
-            )
-            execution = time() - start
-            formatted = format_output(title, cur, headers, status, settings)
-
-            output.extend(formatted)
-            total = time() - start
+                if self._should_limit_output(sql, cur):
+                    cur, status = self._limit_output(cur)
+
+                if cur is not None:
+                    # Rows of client-side cursors are converted as they are read
+                    description = getattr(cur, "description", None) or []
+                    with timing.measure("typecast"):
+                        rows = list(cur)
+                    timing.rows = len(rows)
+                    cur = FetchedRows(rows, description, len(rows), status)
+                if self._watch_results is not None and cur is not None:
+                    cur, headers, status = self._watch_output(i, cur, headers, status)
+                with timing.measure("format"):
+                    output.extend(format_output(title, cur, headers, status, settings))
+                total = time() - start
+            execution += timing.server
 
             # Keep track of whether any of the queries are mutating or changing
             # the database
             if success:
                 mutated = mutated or is_mutating(status)
                 db_changed = db_changed or has_change_db_cmd(sql)
-                meta_changed = meta_changed or has_meta_cmd(sql)
+                if has_meta_cmd(sql):
+                    meta_changed = True
+                    changes = parse_ddl(sql)
+                    if changes is None or ddl_changes is None:
+                        ddl_changes = None
+                    else:
+                        ddl_changes.extend(changes)
                 path_changed = path_changed or has_change_path_cmd(sql)
             else:
                 all_success = False
+            produced = time()
 
         meta_query = MetaQuery(
             text,
             all_success,
-            total,
+            # The time spent reading paged output isn't spent on the command
+            total - sum(timing.pager for timing in timings),
             execution,
             meta_changed,
             db_changed,
             path_changed,
             mutated,
             is_special,
+            ddl_changes,
+            timings,
         )
 
         return output, meta_query
 
     def _handle_server_closed_connection(self, text):
         """Used during CLI execution."""
+
+        def on_retry(error, delay):
+            click.secho(
+                "Reconnect failed, retrying in %.1f seconds" % delay, err=True, fg="red"
+            )
+
         try:
             click.secho("Reconnecting...", fg="green")
-            self.pgexecute.connect()
+            self.pgexecute.reconnect(
+                self.reconnect_attempts, self.reconnect_max_delay, on_retry
+            )
             click.secho("Reconnected!", fg="green")
             self.execute_command(text)
         except OperationalError as e:
             click.secho("Reconnect Failed", fg="red")
             click.secho(str(e), err=True, fg="red")
 
-    def refresh_completions(self, history=None, persist_priorities="all"):
+    def refresh_completions(
+        self, history=None, persist_priorities="all", incremental=False
+    ):
         """Refresh outdated completions
 
         :param history: A prompt_toolkit.history.FileHistory object. Used to
                         load keyword and identifier preferences
 
         :param persist_priorities: 'all' or 'keywords'
+
+        :param incremental: If True, update the current completer with the
+                            catalog changes since its last refresh instead of
+                            rebuilding it, when possible.
         """
+        if incremental and self.completer.catalog_relations is not None:
+            return self.completion_refresher.refresh_incremental(
+                self.pgexecute,
+                self.completer,
+                self._completer_lock,
+                self._on_completions_updated,
+                settings=self.settings,
+            )
+
+        # Publish the completer as it's being refreshed only when there's
+        # nothing to complete yet, a partial snapshot would otherwise hide
+        # the columns of the current completer until the refresh completes.
+        published = []
+        if not self.completer.dbmetadata["tables"]:
+
+            def partial_callback(completer):
+                self._on_completions_published(
+                    completer, "all" if published else persist_priorities
+                )
+                published.append(True)
+
+        else:
+            partial_callback = None
+
+        def callback(completer):
+            self._on_completions_refreshed(
+                completer, "all" if published else persist_priorities
+            )
 
-        callback = functools.partial(
-            self._on_completions_refreshed, persist_priorities=persist_priorities
-        )
         return self.completion_refresher.refresh(
             self.pgexecute,
             self.pgspecial,
             callback,
             history=history,
             settings=self.settings,
+            partial_callbacks=partial_callback,
+        )
+
+    def _completion_cache_file(self):
+        if not self.completion_cache_dir or not self.pgexecute:
+            return None
+        return completion_cache.cache_filename(
+            self.completion_cache_dir, self.pgexecute
+        )
+
+    def load_completion_cache(self):
+        """Load the completions saved for the current connection, if any."""
+        filename = self._completion_cache_file()
+        if not filename:
+            return
+        with self._completer_lock:
+            if completion_cache.load(filename, self.completer):
+                self.logger.debug("Loaded completion cache %r", filename)
+
+    def save_completion_cache(self):
+        """Save the current completions for the next session."""
+        filename = self._completion_cache_file()
+        if not filename:
+            return
+        with self._completer_lock:
+            snapshot = completion_cache.dump_completer(self.completer)
+        completion_cache.save(filename, snapshot)
+
+    def update_completions(self, ddl_changes):
+        """Apply the catalog changes made by DDL statements to the completer
+
+        :param ddl_changes: list of DdlChange namedtuples
+        """
+        ddl_changes = [c for c in ddl_changes if c.kind]
+        if not ddl_changes:
+            return []
+        return self.completion_refresher.refresh_objects(
+            self.pgexecute,
+            self.completer,
+            self._completer_lock,
+            ddl_changes,
+            self._on_completions_updated,
+            settings=self.settings,
+        )
+
+    def start_catalog_watcher(self):
+        """(Re)start streaming catalog changes into the completer, if enabled."""
+        if self.catalog_watcher:
+            # Two watchers would apply the same changes concurrently
+            self.catalog_watcher.stop()
+            self.catalog_watcher.join()
+            self.catalog_watcher = None
+        if not self.watch_catalog or self.pgexecute.is_virtual_database():
+            return
+        self.catalog_watcher = CatalogWatcher(
+            self.pgexecute,
+            lambda: self.completer,
+            self._completer_lock,
+            callback=self._on_catalog_changed,
         )
+        self.catalog_watcher.start()
+
+    def catalog_watcher_running(self):
+        return bool(self.catalog_watcher and self.catalog_watcher.is_running())
+
+    def _on_catalog_changed(self, completer):
+        if self.prompt_app:
+            self.prompt_app.app.invalidate()
 
     def _on_completions_refreshed(self, new_completer, persist_priorities):
         self._swap_completer_objects(new_completer, persist_priorities)
+        self.save_completion_cache()
 
         if self.prompt_app:
             # After refreshing, redraw the CLI to clear the statusbar
             # "Refreshing completions..." indicator
             self.prompt_app.app.invalidate()
 
+    def _on_completions_published(self, new_completer, persist_priorities):
+        # Partial snapshots aren't saved to the completion cache
+        self._swap_completer_objects(new_completer, persist_priorities)
+
+        if self.prompt_app:
+            self.prompt_app.app.invalidate()
+
+    def _on_completions_updated(self, completer):
+        self.save_completion_cache()
+
+        if self.prompt_app:
+            self.prompt_app.app.invalidate()
+
     def _swap_completer_objects(self, new_completer, persist_priorities):
         """Swap the completer object with the newly created completer.
 
@@ -1126,6 +1805,10 @@ class PGCli:
         return len(lines) >= (self.prompt_app.output.get_size().rows - 4)
 
     def echo_via_pager(self, text, color=None):
+        """Print text, through the pager if configured.
+
+        :return: whether the pager was used
+        """
         if self.pgspecial.pager_config == PAGER_OFF or self.watch_command:
             click.echo(text, color=color)
         elif (
@@ -1137,10 +1820,13 @@ class PGCli:
             # The last 4 lines are reserved for the pgcli menu and padding
             if self.is_too_tall(lines) or any(self.is_too_wide(l) for l in lines):
                 click.echo_via_pager(text, color=color)
+                return True
             else:
                 click.echo(text, color=color)
         else:
             click.echo_via_pager(text, color)
+            return True
+        return False
 
 
 @click.command()
@@ -1458,7 +2144,25 @@ def exception_formatter(e):
     return click.style(str(e), fg="red")
 
 
-def format_output(title, cur, headers, status, settings):
+class _RecordTitle(str):
+    """A vertical output separator title numbering records from offset."""
+
+    def __new__(cls, title, offset):
+        obj = super().__new__(cls, title)
+        obj.offset = offset
+        return obj
+
+    def format(self, n):
+        return str.format(self, n=n + self.offset)
+
+
+def format_output(title, cur, headers, status, settings, offset=0):
+    """Format a result for output.
+
+    offset is the number of rows already output when formatting a result in
+    batches. Batches after the first are formatted without CSV headers, and
+    their vertical output records are numbered from offset.
+    """
     output = []
     expanded = settings.expanded or settings.table_format == "vertical"
     table_format = "vertical" if settings.expanded else settings.table_format
@@ -1483,7 +2187,7 @@ def format_output(title, cur, headers, status, settings):
         return data, headers
 
     output_kwargs = {
-        "sep_title": "RECORD {n}",
+        "sep_title": _RecordTitle("RECORD {n}", offset),
         "sep_character": "-",
         "sep_length": (1, 25),
         "missing_value": settings.missingval,
@@ -1505,6 +2209,10 @@ def format_output(title, cur, headers, status, settings):
         # https://github.com/dbcli/pgcli/issues/1102
         dialect = "excel" if platform.system() == "Windows" else "unix"
         output_kwargs["dialect"] = dialect
+    if offset and table_format in ("csv", "csv-tab"):
+        formatter.format_name = table_format + "-noheader"
+    elif offset and table_format == "tsv":
+        formatter.format_name = "tsv_noheader"
 
     if title:  # Only print the title if it's not None.
         output.append(title)
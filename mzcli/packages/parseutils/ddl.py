@@ -0,0 +1,124 @@
+import re
+from collections import namedtuple
+
+# A change to the catalog made by a DDL statement.
+#   action   - 'create', 'drop' or 'rename'
+#   kind     - the PGCompleter.dbmetadata kind of the object ('tables',
+#              'sources' or 'views'), or None for objects that completions
+#              don't track, such as indexes and sinks
+#   schema   - the schema name, or None if the name was unqualified
+#   name     - the object name
+#   new_name - the new name of a renamed object
+DdlChange = namedtuple("DdlChange", ["action", "kind", "schema", "name", "new_name"])
+DdlChange.__new__.__defaults__ = (None, None, None)
+
+_IDENT = r'(?:"(?:[^"]|"")+"|[^\s."(),;]+)'
+_NAME = r"{0}(?:\s*\.\s*{0})*".format(_IDENT)
+
+_OBJECT_KINDS = {
+    "table": "tables",
+    "source": "sources",
+    "materialized source": "sources",
+    "view": "views",
+    "materialized view": "views",
+    "index": None,
+    "default index": None,
+    "sink": None,
+}
+_OBJECT_TYPE = r"(?P<type>materialized\s+view|materialized\s+source|default\s+index|view|source|table|index|sink)"
+
+_create_regex = re.compile(
+    r"^create\s+(?:or\s+replace\s+)?(?P<temp>temp\s+|temporary\s+)?"
+    + _OBJECT_TYPE
+    + r"\b\s*(?:if\s+not\s+exists\s+)?(?P<name>{})?".format(_NAME),
+    re.IGNORECASE | re.DOTALL,
+)
+_drop_regex = re.compile(
+    r"^drop\s+"
+    + _OBJECT_TYPE
+    + r"\s+(?:if\s+exists\s+)?(?P<names>{0}(?:\s*,\s*{0})*)\s*(?P<behavior>cascade|restrict)?$".format(
+        _NAME
+    ),
+    re.IGNORECASE | re.DOTALL,
+)
+_alter_regex = re.compile(
+    r"^alter\s+"
+    + _OBJECT_TYPE
+    + r"\s+(?:if\s+exists\s+)?(?P<name>{})(?P<rest>.*)$".format(_NAME),
+    re.IGNORECASE | re.DOTALL,
+)
+_rename_regex = re.compile(
+    r"^\s*rename\s+to\s+(?P<new_name>{})\s*$".format(_IDENT), re.IGNORECASE
+)
+_ident_regex = re.compile(_IDENT)
+# Sources created with these clauses also create subsources
+_subsources_regex = re.compile(
+    r"\bfor\s+(?:all\s+tables|tables|schemas)\b", re.IGNORECASE
+)
+
+
+def _unquote(ident):
+    if ident[0] == '"':
+        return ident[1:-1].replace('""', '"')
+    return ident.lower()
+
+
+def _split_name(name):
+    """Returns (schema, name) for a possibly qualified object name."""
+    parts = [_unquote(p) for p in _ident_regex.findall(name)]
+    if len(parts) == 1:
+        return None, parts[0]
+    return parts[-2], parts[-1]
+
+
+def _kind(object_type):
+    return _OBJECT_KINDS[" ".join(object_type.lower().split())]
+
+
+def parse_ddl(sql):
+    """Find the catalog changes made by a DDL statement.
+
+    :param sql: a single SQL statement
+    :return: a list of DdlChange namedtuples, or None if the effect of the
+             statement on the catalog can't be determined from its text
+    """
+    sql = sql.strip().rstrip(";").strip()
+
+    match = _create_regex.match(sql)
+    if match:
+        kind = _kind(match.group("type"))
+        if kind is None:
+            return []
+        if not match.group("name"):
+            return None
+        if kind == "sources" and _subsources_regex.search(sql):
+            return None
+        schema, name = _split_name(match.group("name"))
+        if match.group("temp") and schema is None:
+            schema = "mz_temp"
+        return [DdlChange("create", kind, schema, name)]
+
+    match = _drop_regex.match(sql)
+    if match:
+        kind = _kind(match.group("type"))
+        if kind is None:
+            return []
+        behavior = match.group("behavior")
+        if behavior and behavior.lower() == "cascade":
+            return None
+        names = re.findall(_NAME, match.group("names"))
+        return [DdlChange("drop", kind, *_split_name(name)) for name in names]
+
+    match = _alter_regex.match(sql)
+    if match:
+        kind = _kind(match.group("type"))
+        if kind is None:
+            return []
+        rename = _rename_regex.match(match.group("rest"))
+        if not rename:
+            return None
+        schema, name = _split_name(match.group("name"))
+        new_name = _unquote(rename.group("new_name"))
+        return [DdlChange("rename", kind, schema, name, new_name)]
+
+    return None
@@ -0,0 +1,115 @@
+import hashlib
+import re
+from functools import lru_cache
+
+from ..pgliterals.main import get_literals
+
+# A single regular expression matching every kind of token, tried in order
+_token_regex = re.compile(
+    r"""
+    (?P<space>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    | (?P<param>\$\d+|%(?:\([^)]*\))?s)
+    | (?P<string>
+        [eE]'(?:\\.|''|[^'\\])*'?
+        | [bBxXnN]?'(?:''|[^'])*'?
+        | \$(?P<tag>(?:[A-Za-z_]\w*)?)\$.*?(?:\$(?P=tag)\$|$)
+      )
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<quoted>"(?:""|[^"])*"?)
+    | (?P<word>[A-Za-z_\x80-\U0010ffff][\w$]*)
+    | (?P<cast>::)
+    | (?P<operator>[-+*/<>=~!@#%^&|`?]+)
+    | (?P<punctuation>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# No space is written after these tokens, or before the next ones
+_no_space_after = {"(", "[", ".", "::"}
+_no_space_before = {")", "[", "]", ",", ".", ";", "::"}
+
+# Words that aren't names, e.g. a sign after "then" starts a number. NULL is
+# a value, so it ends an operand like a name does.
+_keywords = frozenset(k.lower() for k in get_literals("keywords")) - {"null"}
+
+
+@lru_cache(maxsize=1024)
+def normalize_query(sql):
+    """Returns the shape of a query, the same for all queries that only
+    differ in their literals, whitespace, comments, casing of keywords and
+    unquoted identifiers, or the number of values in IN lists.
+
+    >>> normalize_query("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x'")
+    'select * from t where id in (...) and name = ?'
+    """
+    tokens = []
+    # Index of the "(" opening the current IN list, if it only has literals
+    in_list = None
+    for match in _token_regex.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("space", "comment"):
+            continue
+        if kind in ("param", "string", "number"):
+            # The sign of a number is part of the literal, unless it follows
+            # an operand
+            if (
+                kind == "number"
+                and tokens
+                and tokens[-1] in ("-", "+")
+                and (len(tokens) < 2 or not _ends_operand(tokens[-2]))
+            ):
+                tokens.pop()
+            tokens.append("?")
+            continue
+
+        token = match.group()
+        if kind == "word":
+            token = token.lower()
+        if token == "(":
+            in_list = len(tokens) if tokens and tokens[-1] == "in" else None
+        elif token == ")" and in_list is not None:
+            if all(t in ("?", ",") for t in tokens[in_list + 1 :]):
+                del tokens[in_list + 1 :]
+                tokens.append("...")
+            in_list = None
+        tokens.append(token)
+
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return _join(tokens)
+
+
+def fingerprint(sql):
+    """Returns a stable hash of the shape of a query, as a hex string.
+
+    Queries with the same normalize_query have the same fingerprint, across
+    sessions and mzcli versions.
+    """
+    normalized = normalize_query(sql).encode("utf-8")
+    return hashlib.blake2b(normalized, digest_size=8).hexdigest()
+
+
+def _is_name(token):
+    return (token[0].isalnum() or token[0] in '_"') and token not in _keywords
+
+
+def _ends_operand(token):
+    return token in ("?", ")", "]", "...") or _is_name(token)
+
+
+def _join(tokens):
+    parts = []
+    previous = None
+    for token in tokens:
+        if (
+            parts
+            and previous not in _no_space_after
+            and token not in _no_space_before
+            # Function calls, e.g. "count(*)"
+            and not (token == "(" and _is_name(previous))
+        ):
+            parts.append(" ")
+        parts.append(token)
+        previous = token
+    return "".join(parts)
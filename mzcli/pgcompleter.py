@@ -1,5 +1,7 @@
+import copy
 import logging
 import re
+import threading
 from itertools import count, repeat, chain
 import operator
 from collections import namedtuple, defaultdict, OrderedDict
@@ -112,6 +114,14 @@ class PGCompleter(Completer):
         self.asterisk_column_order = settings.get(
             "asterisk_column_order", "table_order"
         )
+        # In lazy mode refreshes only load relation names, and the columns of
+        # a relation are fetched with column_fetcher when first needed.
+        self.lazy_columns = settings.get("lazy_columns", False)
+        self.column_fetcher = settings.get("column_fetcher")
+        self._fetched_columns = set()
+        # Guards the fetched columns against concurrent updates of the
+        # completions, shared with the code updating them.
+        self._metadata_lock = settings.get("metadata_lock") or threading.RLock()
 
         keyword_casing = settings.get("keyword_casing", "upper").lower()
         if keyword_casing not in ("upper", "lower", "auto"):
@@ -129,6 +139,9 @@ class PGCompleter(Completer):
         }
         self.search_path = []
         self.casing = {}
+        # {relation_id: (schema_name, rel_name, kind)} as of the last refresh,
+        # or None when the catalog snapshot is unknown
+        self.catalog_relations = None
 
         self.all_completions = set(self.keywords + self.functions)
 
@@ -210,6 +223,58 @@ class PGCompleter(Completer):
                 )
             self.all_completions.add(relname)
 
+    def remove_schemata(self, schemata):
+        """remove schemata and everything in them.
+
+        :param schemata: list of schema names
+
+        """
+        schemata = self.escaped_names(schemata)
+        for metadata in self.dbmetadata.values():
+            for schema in schemata:
+                metadata.pop(schema, None)
+
+    def remove_relations(self, data, kind):
+        """remove tables or views and their columns.
+
+        :param data: list of (schema_name, rel_name) tuples
+        :param kind: either 'tables' or 'views'
+
+        """
+        metadata = self.dbmetadata[kind]
+        for schema, relname in data:
+            schema, relname = self.escaped_names([schema, relname])
+            metadata.get(schema, {}).pop(relname, None)
+            # A relation created with the same name has its columns fetched
+            self._fetched_columns.discard((kind, schema, relname))
+
+    def rename_relation(self, schema, relname, new_relname, kind):
+        """rename a table or view, keeping its columns.
+
+        :param kind: either 'tables' or 'views'
+
+        """
+        schema, relname, new_relname = self.escaped_names(
+            [schema, relname, new_relname]
+        )
+        metadata = self.dbmetadata[kind].get(schema, {})
+        if relname in metadata:
+            metadata[new_relname] = metadata.pop(relname)
+            self.all_completions.add(new_relname)
+
+    def find_relation_schema(self, relname, kind):
+        """Returns the first schema in the search path containing relname.
+
+        :param kind: either 'tables' or 'views'
+        :return: unescaped schema name, or None
+
+        """
+        relname = self.escape_name(relname)
+        for schema in self.search_path:
+            if relname in self.dbmetadata[kind].get(schema, {}):
+                return self.unescape_name(schema)
+        return None
+
     def extend_columns(self, column_data, kind):
         """extend column metadata.
 
@@ -316,6 +381,7 @@ class PGCompleter(Completer):
         self.databases = []
         self.special_commands = []
         self.search_path = []
+        self.catalog_relations = None
         self.dbmetadata = {
             "tables": {},
             "sources": {},
@@ -325,6 +391,32 @@ class PGCompleter(Completer):
         }
         self.all_completions = set(self.keywords + self.functions)
 
+    def copy(self):
+        """Returns a snapshot of the completer.
+
+        The containers of the snapshot are copied, so extending either
+        completer leaves the other unchanged. The metadata namedtuples stored
+        in them are shared.
+        """
+        completer = copy.copy(self)
+        completer.databases = list(self.databases)
+        completer.search_path = list(self.search_path)
+        completer.dbmetadata = {
+            kind: {
+                schema: {
+                    name: obj.copy() if isinstance(obj, (dict, list)) else obj
+                    for name, obj in objects.items()
+                }
+                for schema, objects in metadata.items()
+            }
+            for kind, metadata in self.dbmetadata.items()
+        }
+        if self.catalog_relations is not None:
+            completer.catalog_relations = dict(self.catalog_relations)
+        completer.all_completions = set(self.all_completions)
+        completer._fetched_columns = set(self._fetched_columns)
+        return completer
+
     def find_matches(self, text, collection, mode="fuzzy", meta=None):
         """Find completion matches for the given text.
 
@@ -1011,7 +1103,7 @@ class PGCompleter(Completer):
                         addcols(schema, relname, tbl.alias, "functions", cols)
                 else:
                     for reltype in ("tables", "views"):
-                        cols = meta[reltype].get(schema, {}).get(relname)
+                        cols = self._relation_columns(schema, relname, reltype)
                         if cols:
                             cols = cols.values()
                             addcols(schema, relname, tbl.alias, reltype, cols)
@@ -1019,6 +1111,36 @@ class PGCompleter(Completer):
 
         return columns
 
+    def _relation_columns(self, schema, relname, kind):
+        """Returns the columns of a relation, fetching them first in lazy mode.
+
+        :return: OrderedDict {colname:ColumnMetaData}, or None if the
+                 relation is unknown
+
+        """
+        cols = self.dbmetadata[kind].get(schema, {}).get(relname)
+        if cols or cols is None or not (self.lazy_columns and self.column_fetcher):
+            return cols
+        key = (kind, schema, relname)
+        if key in self._fetched_columns:
+            return cols
+        try:
+            column_data = self.column_fetcher(
+                self.unescape_name(schema), self.unescape_name(relname)
+            )
+        except Exception as e:
+            _logger.error("Failed to fetch columns of %s.%s: %r", schema, relname, e)
+            return cols
+        with self._metadata_lock:
+            cols = self.dbmetadata[kind].get(schema, {}).get(relname)
+            if cols is None:
+                # Dropped while its columns were fetched
+                return None
+            if key not in self._fetched_columns:
+                self._fetched_columns.add(key)
+                self.extend_columns(column_data, kind)
+        return cols
+
     def _get_schemas(self, obj_typ, schema):
         """Returns a list of schemas from which to suggest objects.
 
@@ -1,6 +1,12 @@
+import json
 import logging
+import os
+import random
+import re
 import select
+import threading
 import traceback
+from time import sleep, time
 
 import pgspecial as special
 import psycopg2
@@ -10,7 +16,9 @@ import psycopg2.extras
 import sqlparse
 from psycopg2.extensions import POLL_OK, POLL_READ, POLL_WRITE, make_dsn
 
+from .config import ensure_dir_exists
 from .packages.parseutils.meta import FunctionMetadata, ForeignKey
+from .timing import StatementTiming
 
 _logger = logging.getLogger(__name__)
 
@@ -31,6 +39,24 @@ ext.register_type(ext.new_type((17,), "BYTEA_TEXT", psycopg2.STRING))
 _WAIT_SELECT_TIMEOUT = 1
 _wait_callback_is_set = False
 
+# Statements whose rows can be fetched through a server-side cursor
+_streamable_regex = re.compile(r"^\s*(select|with)\b", re.IGNORECASE)
+# Statements streaming updates until they are cancelled
+_subscribe_regex = re.compile(r"^\s*(subscribe|tail)\b", re.IGNORECASE)
+# Statements changing a session variable, replayed after a reconnect
+_set_regex = re.compile(
+    r"^\s*set\s+(?:session\s+)?(?!local\b|transaction\b|characteristics\b)"
+    r'([\w.]+|"[^"]+")',
+    re.IGNORECASE,
+)
+_reset_regex = re.compile(r'^\s*reset\s+([\w.]+|"[^"]+")', re.IGNORECASE)
+_discard_all_regex = re.compile(r"^\s*discard\s+all\b", re.IGNORECASE)
+
+# File caching the type OIDs found by the connection bootstrap, keyed by
+# server. None disables the cache.
+_type_oid_cache_file = None
+_type_oid_cache_lock = threading.Lock()
+
 
 def _wait_select(conn):
     """
@@ -61,6 +87,28 @@ def _wait_select(conn):
         pass
 
 
+def _has_limit(sql):
+    """Returns True if the outermost query of sql has a LIMIT clause."""
+    depth = 0
+    for token in sqlparse.parse(sql)[0].flatten():
+        if token.match(sqlparse.tokens.Punctuation, "("):
+            depth += 1
+        elif token.match(sqlparse.tokens.Punctuation, ")"):
+            depth -= 1
+        elif depth == 0 and token.match(sqlparse.tokens.Keyword, "LIMIT"):
+            return True
+    return False
+
+
+def backoff_delays(attempts, base_delay=0.5, max_delay=30):
+    """Yields the seconds to wait after each failed attempt of an operation:
+    a random delay up to an exponentially growing bound ("full jitter"), so
+    clients don't retry in lockstep. None is yielded for the last attempt."""
+    for attempt in range(attempts - 1):
+        yield random.uniform(0, min(max_delay, base_delay * 2**attempt))
+    yield None
+
+
 def _set_wait_callback(is_virtual_database):
     global _wait_callback_is_set
     if _wait_callback_is_set:
@@ -142,6 +190,83 @@ def register_hstore_typecaster(conn):
             pass
 
 
+def register_typecasters(conn, loads_fn, type_oids):
+    """Register the date, JSON and hstore typecasters from known type OIDs,
+    without querying the server.
+
+    :param type_oids: dict with the (date, timestamp, timestamptz) OIDs under
+                      'date', the (oid, array_oid) of 'json' and 'jsonb', and
+                      the 'hstore' OID. Missing types are None.
+    """
+
+    def cast_date(value, cursor):
+        return value
+
+    oids = tuple(type_oids["date"])
+    psycopg2.extensions.register_type(
+        psycopg2.extensions.new_type(oids, "DATE", cast_date)
+    )
+    for name in ["json", "jsonb"]:
+        if type_oids.get(name):
+            oid, array_oid = type_oids[name]
+            psycopg2.extras.register_json(
+                conn, loads=loads_fn, oid=oid, array_oid=array_oid, name=name
+            )
+    if type_oids.get("hstore"):
+        oid = type_oids["hstore"]
+        ext.register_type(ext.new_type((oid,), "HSTORE", ext.UNICODE))
+
+
+def set_type_oid_cache(filename):
+    """Set the file caching type OIDs across connections, or None."""
+    global _type_oid_cache_file
+    _type_oid_cache_file = filename
+
+
+def _load_type_oids(key):
+    if not _type_oid_cache_file:
+        return None
+    try:
+        with open(_type_oid_cache_file) as f:
+            return json.load(f).get(key)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError) as e:
+        _logger.error("Failed to read type OID cache: %r", e)
+        return None
+
+
+def _save_type_oids(key, type_oids):
+    if not _type_oid_cache_file:
+        return
+    with _type_oid_cache_lock:
+        try:
+            with open(_type_oid_cache_file) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        if not isinstance(cache, dict):
+            cache = {}
+        cache[key] = type_oids
+        tmp_filename = _type_oid_cache_file + ".tmp"
+        try:
+            ensure_dir_exists(_type_oid_cache_file)
+            with open(tmp_filename, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmp_filename, _type_oid_cache_file)
+        except OSError as e:
+            _logger.error("Failed to write type OID cache: %r", e)
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    """A connection that counts the statements executed through its
+    ProtocolSafeCursors, i.e. its round trips to the server."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.round_trips = 0
+
+
 class ProtocolSafeCursor(psycopg2.extensions.cursor):
     def __init__(self, *args, **kwargs):
         self.protocol_error = False
@@ -164,6 +289,8 @@ class ProtocolSafeCursor(psycopg2.extensions.cursor):
         return super().fetchone()
 
     def execute(self, sql, args=None):
+        if isinstance(self.connection, CountingConnection):
+            self.connection.round_trips += 1
         try:
             psycopg2.extensions.cursor.execute(self, sql, args)
             self.protocol_error = False
@@ -174,6 +301,375 @@ class ProtocolSafeCursor(psycopg2.extensions.cursor):
             _logger.debug("%s: %s" % (ex.__class__.__name__, ex))
 
 
+class ExecutorPool:
+    """Keeps warm secondary executors for background work.
+
+    Completion refreshes, column lookups and other metadata queries acquire
+    an executor with the connection parameters of the main PGExecute and
+    release it when done, instead of opening and closing a connection every
+    time. Idle executors are health checked before reuse and closed once
+    they have been idle for `idle_timeout` seconds, when the pool is used or
+    evict() is called.
+    """
+
+    def __init__(self, pgexecute, max_idle=4, idle_timeout=300, check_after=30):
+        """
+        :param pgexecute: PGExecute object whose connection parameters are
+                          used to open the pool's connections.
+        :param max_idle: maximum number of idle executors kept open.
+        :param idle_timeout: seconds after which idle executors are closed.
+        :param check_after: seconds of idleness after which an executor is
+                            pinged before it is reused.
+        """
+        self.pgexecute = pgexecute
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        # [(executor, released at)], most recently released last
+        self._idle = []
+        # Incremented when the connection parameters change, executors of an
+        # older generation are closed when released
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns an idle executor, or a new one if none is usable."""
+        with self._lock:
+            self._evict()
+            idle, self._idle = self._idle, []
+            generation = self._generation
+        executor = None
+        while idle and executor is None:
+            candidate, released = idle.pop()
+            if self._is_healthy(candidate, time() - released):
+                executor = candidate
+            else:
+                _close(candidate)
+        if idle:
+            with self._lock:
+                self._idle = idle + self._idle
+        if executor is None:
+            executor = self.pgexecute.copy()
+            _logger.debug("Opened pooled connection")
+        executor._pool_generation = generation
+        return executor
+
+    def release(self, executor):
+        """Return an executor obtained with acquire() to the pool."""
+        conn = executor.conn
+        reusable = (
+            conn is not None
+            and not conn.closed
+            and conn.get_transaction_status() == ext.TRANSACTION_STATUS_IDLE
+        )
+        with self._lock:
+            if (
+                reusable
+                and getattr(executor, "_pool_generation", None) == self._generation
+                and len(self._idle) < self.max_idle
+            ):
+                self._idle.append((executor, time()))
+                executor = None
+            self._evict()
+        if executor is not None:
+            _close(executor)
+
+    def clear(self):
+        """Close the idle executors. Executors in use are closed when they
+        are released."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._generation += 1
+        for executor, _ in idle:
+            _close(executor)
+
+    def idle_count(self):
+        return len(self._idle)
+
+    def evict(self):
+        """Close the executors idle for longer than idle_timeout. This is
+        done whenever the pool is used, and should be done periodically
+        while it isn't."""
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        now = time()
+        idle = []
+        for executor, released in self._idle:
+            if now - released > self.idle_timeout:
+                _close(executor)
+            else:
+                idle.append((executor, released))
+        self._idle = idle
+
+    def _is_healthy(self, executor, idle_seconds):
+        conn = executor.conn
+        if conn is None or conn.closed:
+            return False
+        if idle_seconds < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error as e:
+            _logger.debug("Pooled connection failed its health check: %r", e)
+            return False
+
+
+def _close(executor):
+    if executor.conn is not None and not executor.conn.closed:
+        executor.conn.close()
+
+
+class StreamingCursor:
+    """Fetches the rows of a query in batches through a server-side cursor.
+
+    The first batch is small, so the first rows are available quickly. The
+    batch size then adapts to keep each FETCH around `target_seconds`, up to
+    `max_batch_size` rows, so memory use stays bounded by the batch size.
+
+    With a `limit`, at most limit + 1 rows are fetched: a rowcount above the
+    limit tells that the result has more rows, without transferring them.
+    """
+
+    name = "mzcli_stream"
+    first_batch_size = 100
+    target_seconds = 0.5
+
+    def __init__(self, conn, sql, max_batch_size, limit=0, batch_size=None):
+        self.conn = conn
+        self.sql = sql
+        self.max_batch_size = max_batch_size
+        self.limit = limit
+        self.batch_size = batch_size or min(self.first_batch_size, max_batch_size)
+        self.description = None
+        # Unknown until every row is fetched
+        self.rowcount = -1
+        self.rows = 0
+        self._cur = None
+        self._owns_transaction = False
+        self._batch = None
+        self._done = False
+        self.timing = StatementTiming(sql)
+
+    # Whether BEGIN, DECLARE and the first FETCH are sent in a single round
+    # trip. A statement whose cursor fails is run again without one.
+    single_round_trip = True
+
+    def open(self):
+        """Declare the cursor and fetch the first batch.
+
+        :return: False if the server can't declare the cursor, in which case
+                 the statement should be run without one
+        """
+        self._cur = self.conn.cursor()
+        declare = "DECLARE {} CURSOR FOR {}".format(self.name, self.sql)
+        try:
+            try:
+                if self.conn.get_transaction_status() == ext.TRANSACTION_STATUS_IDLE:
+                    self._owns_transaction = True
+                    if self.single_round_trip:
+                        self._batch = self._fetch("BEGIN; {}; ".format(declare))
+                        if not self._cur.protocol_error:
+                            return True
+                        self.close()
+                        return False
+                    with self.timing.measure("execute"):
+                        self._cur.execute("BEGIN")
+                with self.timing.measure("execute"):
+                    self._cur.execute(declare)
+            except psycopg2.OperationalError:
+                raise
+            except psycopg2.Error as e:
+                # The transaction the cursor was declared in is rolled back,
+                # unless it is the user's
+                if not self._owns_transaction:
+                    raise
+                _logger.debug("Can't declare cursor. sql: %r, error: %r", self.sql, e)
+                self.close()
+                return False
+            if self._cur.protocol_error:
+                self.close()
+                return False
+            self._batch = self._fetch()
+        except BaseException:
+            self.close()
+            raise
+        return True
+
+    @property
+    def statusmessage(self):
+        return "SELECT {}".format(self.rows)
+
+    def _fetch(self, prefix=""):
+        count = self.batch_size
+        if self.limit:
+            count = min(count, self.limit + 1 - self.rows)
+        start = time()
+        rows = self._timed_fetch(prefix + "FETCH {} {}".format(count, self.name))
+        elapsed = time() - start
+        if len(rows) < count or (self.limit and self.rows > self.limit):
+            self._done = True
+            self.rowcount = self.rows
+        elif elapsed < self.target_seconds / 2:
+            self.batch_size = min(self.batch_size * 2, self.max_batch_size)
+        elif elapsed > self.target_seconds * 2:
+            self.batch_size = max(self.batch_size // 2, 1)
+        return rows
+
+    def _timed_fetch(self, sql):
+        # Until the first rows are received, the statement is executing
+        phase = "fetch" if self.description else "execute"
+        with self.timing.measure(phase):
+            self._cur.execute(sql)
+        if self._cur.protocol_error:
+            return []
+        with self.timing.measure("typecast"):
+            rows = self._cur.fetchall()
+        if self.description is None:
+            self.description = self._cur.description
+        self.rows += len(rows)
+        self.timing.rows = self.rows
+        return rows
+
+    def batches(self):
+        """Yields lists of rows until the result is exhausted, then closes
+        the cursor."""
+        try:
+            while self._batch:
+                batch, self._batch = self._batch, None
+                yield batch
+                if not self._done:
+                    self._batch = self._fetch()
+        finally:
+            self.close()
+
+    def __iter__(self):
+        for batch in self.batches():
+            yield from batch
+
+    def close(self):
+        """Close the server-side cursor, and end the transaction it was
+        declared in unless the user started that transaction."""
+        cur, self._cur = self._cur, None
+        if cur is None or self.conn.closed:
+            return
+        try:
+            if self._owns_transaction:
+                cur.execute("ROLLBACK")
+            elif self.conn.get_transaction_status() == ext.TRANSACTION_STATUS_INTRANS:
+                cur.execute("CLOSE {}".format(self.name))
+        except psycopg2.Error as e:
+            _logger.debug("Failed to close streaming cursor: %r", e)
+        finally:
+            cur.close()
+
+
+class SubscribeCursor(StreamingCursor):
+    """Reads the updates of a SUBSCRIBE (or TAIL) statement as they arrive.
+
+    Updates are fetched with a timeout, so the caller regains control at
+    least every `fetch_timeout` seconds, e.g. to handle Ctrl+C. Batches are
+    yielded until the subscription completes or the cursor is closed.
+    """
+
+    fetch_timeout = 1
+    # Running a SUBSCRIBE without a cursor would never complete
+    single_round_trip = False
+
+    def __init__(self, conn, sql, max_batch_size=1000):
+        super().__init__(conn, sql, max_batch_size, batch_size=max_batch_size)
+        # With PROGRESS, the timestamp below which every update was yielded
+        # by consistent_batches()
+        self.frontier = None
+        self._first_timestamp = None
+
+    @property
+    def statusmessage(self):
+        return None
+
+    def _fetch(self):
+        start = time()
+        rows = self._timed_fetch(
+            "FETCH {} {} WITH (timeout = '{}s')".format(
+                self.batch_size, self.name, self.fetch_timeout
+            )
+        )
+        # A FETCH returning no rows before the timeout means that the
+        # subscription has completed, e.g. because of an UP TO clause
+        if not rows and time() - start < self.fetch_timeout / 2:
+            self._done = True
+        return rows
+
+    def batches(self):
+        """Yields lists of updates until the subscription completes, then
+        closes the cursor. An empty list is yielded for every FETCH that timed
+        out, so the caller can stop reading an idle subscription."""
+        try:
+            while self._cur is not None:
+                batch, self._batch = self._batch, None
+                if batch or (batch is not None and not self._done):
+                    yield batch
+                if self._done or self._cur is None:
+                    break
+                self._batch = self._fetch()
+        finally:
+            self.close()
+
+    def consistent_batches(self):
+        """Like batches, for a subscription WITH (PROGRESS). Updates are held
+        back until a progress message closes their timestamp, so every batch
+        ends at a consistent state of the result. Progress messages and the
+        mz_progressed column are left out."""
+        headers = [column[0] for column in self.description]
+        timestamp = headers.index("mz_timestamp")
+        progressed = headers.index("mz_progressed")
+        pending = []
+        batches = self.batches()
+        try:
+            for batch in batches:
+                closed, frontier = [], None
+                for update in batch:
+                    if self._first_timestamp is None:
+                        self._first_timestamp = update[timestamp]
+                    if update[progressed]:
+                        closed.extend(pending)
+                        pending = []
+                        frontier = update[timestamp]
+                    else:
+                        pending.append(update[:progressed] + update[progressed + 1 :])
+                yield closed
+                # Only once the closed updates were taken by the caller
+                if frontier is not None:
+                    self.frontier = frontier
+        finally:
+            batches.close()
+
+    @property
+    def snapshot_complete(self):
+        """Whether consistent_batches() yielded the whole result as of the
+        start of the subscription."""
+        # The first message is either an update of the snapshot or progress
+        # up to its timestamp, so the snapshot is closed by later progress
+        return self.frontier is not None and self.frontier > self._first_timestamp
+
+
+class FetchedRows:
+    """Rows read from a StreamingCursor, standing in for a client-side cursor
+    whose rows were all fetched."""
+
+    def __init__(self, rows, description, rowcount, statusmessage):
+        self.rows = rows
+        self.description = description
+        self.rowcount = rowcount
+        self.statusmessage = statusmessage
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
 class PGExecute:
 
     # The boolean argument to the current_schemas function indicates whether
@@ -204,6 +700,71 @@ class PGExecute:
            AND r.type = ANY(%s)
          """
 
+    columns_query = """\
+        SELECT s.name schema_name,
+               r.name relation_name,
+               c.name column_name,
+               c.type column_type
+        FROM   mz_relations r
+        JOIN   mz_schemas s
+                   ON s.id = r.schema_id
+        JOIN   mz_columns c
+                   ON c.id = r.id
+               LEFT JOIN  mz_databases d
+                   ON d.id = s.database_id
+         WHERE (s.database_id IS NULL
+            OR d.name = '{dbname}')
+           AND r.type = ANY(%s)
+        ORDER BY 1, 2, c.position
+         """
+
+    catalog_relations_query = """\
+        SELECT r.id,
+               s.name schema_name,
+               r.name relation_name,
+               r.type
+        FROM   mz_relations r
+        JOIN   mz_schemas s
+                   ON s.id = r.schema_id
+               LEFT JOIN  mz_databases d
+                   ON d.id = s.database_id
+         WHERE s.database_id IS NULL
+            OR d.name = '{dbname}'
+         """
+
+    relation_columns_query = """\
+        SELECT s.name schema_name,
+               r.name relation_name,
+               c.name column_name,
+               c.type column_type
+        FROM   mz_relations r
+        JOIN   mz_schemas s
+                   ON s.id = r.schema_id
+        JOIN   mz_columns c
+                   ON c.id = r.id
+         WHERE r.id = ANY(%s)
+        ORDER BY 1, 2, c.position
+         """
+
+    named_relation_columns_query = """\
+        SELECT s.name schema_name,
+               r.name relation_name,
+               c.name column_name,
+               c.type column_type
+        FROM   mz_relations r
+        JOIN   mz_schemas s
+                   ON s.id = r.schema_id
+        JOIN   mz_columns c
+                   ON c.id = r.id
+               LEFT JOIN  mz_databases d
+                   ON d.id = s.database_id
+         WHERE (s.database_id IS NULL
+            OR d.name = '{dbname}')
+           AND s.name = COALESCE(%s, current_schema())
+           AND r.name = %s
+        ORDER BY c.position
+         """
+
     databases_query = """
         SELECT d.datname
         FROM pg_catalog.pg_database d
@@ -219,6 +780,29 @@ class PGExecute:
         FROM pg_catalog.pg_database d
         ORDER BY 1"""
 
+    # Finds everything connect() needs from the server in a single round
+    # trip: the date and time types' OIDs from the result description, the
+    # OIDs of the JSON and hstore types and, when connecting over a socket,
+    # the socket directory.
+    bootstrap_query = """
+        SELECT NULL::date,
+               NULL::timestamp,
+               NULL::timestamp with time zone,
+               (SELECT min(t.oid) FROM pg_catalog.pg_type t
+                WHERE t.typname = 'json'),
+               (SELECT min(t.typarray) FROM pg_catalog.pg_type t
+                WHERE t.typname = 'json'),
+               (SELECT min(t.oid) FROM pg_catalog.pg_type t
+                WHERE t.typname = 'jsonb'),
+               (SELECT min(t.typarray) FROM pg_catalog.pg_type t
+                WHERE t.typname = 'jsonb'),
+               (SELECT min(t.oid) FROM pg_catalog.pg_type t
+                WHERE t.typname = 'hstore')"""
+
+    bootstrap_socket_directory = """,
+               (SELECT setting FROM pg_settings
+                WHERE name = 'unix_socket_directories')"""
+
     socket_directory_query = """
         SELECT setting
         FROM pg_settings
@@ -265,7 +849,13 @@ class PGExecute:
         self.host = None
         self.port = None
         self.server_version = None
+        self.mz_version = None
         self.extra_args = None
+        self._pool = None
+        # SET statements run in the session, by variable name
+        self.session_settings = {}
+        # StatementTiming of the statement whose result run yielded last
+        self.timing = None
         self.connect(database, user, password, host, port, dsn, **kwargs)
         self.reset_expanded = None
 
@@ -278,6 +868,30 @@ class PGExecute:
         """Returns a clone of the current executor."""
         return self.__class__(**self._conn_params)
 
+    @property
+    def pool(self):
+        """The ExecutorPool of secondary connections, created on first use."""
+        if self._pool is None:
+            self._pool = ExecutorPool(self)
+        return self._pool
+
+    def acquire(self):
+        """Returns a pooled clone of the current executor. Give it back with
+        release() instead of closing its connection."""
+        return self.pool.acquire()
+
+    def release(self, executor):
+        self.pool.release(executor)
+
+    def close_pool(self):
+        if self._pool is not None:
+            self._pool.clear()
+
+    def evict_idle(self):
+        """Close the pooled connections that have been idle for too long."""
+        if self._pool is not None:
+            self._pool.evict()
+
     def connect(
         self,
         database=None,
@@ -311,6 +925,7 @@ class PGExecute:
 
         conn_params.update({k: v for k, v in new_params.items() if v})
         conn_params["cursor_factory"] = ProtocolSafeCursor
+        conn_params["connection_factory"] = CountingConnection
 
         conn = psycopg2.connect(**conn_params)
         conn.set_client_encoding("utf8")
@@ -319,6 +934,9 @@ class PGExecute:
         if self.conn:
             self.conn.close()
         self.conn = conn
+        # Pooled connections were opened with the old parameters
+        self.close_pool()
+        self.session_settings = {}
         self.conn.autocommit = True
 
         # When we connect using a DSN, we don't really know what db,
@@ -352,23 +970,87 @@ class PGExecute:
         self.password = password
         self.extra_args = kwargs
 
-        if not self.host:
-            self.host = (
-                "pgbouncer"
-                if self.is_virtual_database()
-                else self.get_socket_directory()
-            )
-
         # pid = conn.get_backend_pid()
         self.pid = 1
         self.superuser = conn.get_parameter_status("is_superuser") in ("on", "1")
         self.server_version = conn.get_parameter_status("server_version") or ""
+        self.mz_version = conn.get_parameter_status("mz_version")
 
-        if not self.is_virtual_database():
+        type_oids = self._bootstrap()
+        if not self.host:
+            if self.is_virtual_database():
+                self.host = "pgbouncer"
+            elif type_oids and type_oids.get("socket_directory") is not None:
+                self.host = type_oids["socket_directory"]
+            else:
+                self.host = self.get_socket_directory()
+
+        if type_oids:
+            register_typecasters(conn, self._json_typecaster, type_oids)
+        elif not self.is_virtual_database():
             register_date_typecasters(conn)
             register_json_typecasters(self.conn, self._json_typecaster)
             register_hstore_typecaster(self.conn)
 
+    def _bootstrap(self):
+        """Find the type OIDs to register typecasters for, from the type OID
+        cache or with the bootstrap query, and whether the server is a
+        virtual database.
+
+        :return: dict of type OIDs as expected by register_typecasters, or
+                 None if they couldn't be found in one round trip
+        """
+        # Materialize always reports the same server_version, so the OIDs are
+        # only cached for servers reporting their own version, which tells
+        # when they may have changed.
+        key = None
+        if self.mz_version:
+            key = "\0".join(
+                str(x or "")
+                for x in (self.host, self.port, self.dbname, self.mz_version)
+            )
+        type_oids = _load_type_oids(key) if key else None
+        if type_oids:
+            # Only servers which aren't virtual databases are cached
+            self._is_virtual_database = False
+            return type_oids
+
+        query = self.bootstrap_query
+        if not self.host:
+            query += self.bootstrap_socket_directory
+        with self.conn.cursor() as cur:
+            _logger.debug("Bootstrap Query. sql: %r", query)
+            try:
+                cur.execute(query)
+            except psycopg2.DatabaseError as e:
+                if self.conn.closed:
+                    raise
+                _logger.debug("Bootstrap query failed, probing types: %r", e)
+                self._is_virtual_database = False
+                return None
+            self._is_virtual_database = bool(cur.protocol_error)
+            if self._is_virtual_database:
+                return None
+            row = cur.fetchone()
+            date_oids = [column[1] for column in cur.description[:3]]
+
+        type_oids = {
+            "date": date_oids,
+            "json": list(row[3:5]) if row[3] else None,
+            "jsonb": list(row[5:7]) if row[5] else None,
+            "hstore": row[7],
+        }
+        if not self.host:
+            type_oids["socket_directory"] = row[8] or ""
+        if key:
+            _save_type_oids(key, type_oids)
+        return type_oids
+
+    @property
+    def round_trips(self):
+        """Number of statements executed on the current connection."""
+        return getattr(self.conn, "round_trips", 0)
+
     @property
     def short_host(self):
         if "," in self.host:
@@ -399,6 +1081,98 @@ class PGExecute:
 
         return json_data
 
+    def reconnect(self, attempts=1, max_delay=30, on_retry=None):
+        """Reconnect with the current parameters, and run the SET statements
+        of the session again.
+
+        :param attempts: number of connection attempts, separated by
+                         jittered exponential backoff delays.
+        :param max_delay: maximum number of seconds between two attempts.
+        :param on_retry: called with the error and the delay before waiting
+                         to retry.
+        :raise: the OperationalError of the last attempt
+        """
+        settings = list(self.session_settings.values())
+        for delay in backoff_delays(attempts, max_delay=max_delay):
+            try:
+                self.connect()
+                break
+            except psycopg2.OperationalError as e:
+                if delay is None:
+                    raise
+                _logger.debug("Reconnect failed, retrying in %.1fs: %r", delay, e)
+                if on_retry:
+                    on_retry(e, delay)
+                sleep(delay)
+
+        with self.conn.cursor() as cur:
+            for sql in settings:
+                try:
+                    cur.execute(sql)
+                    self._record_session_setting(sql)
+                except psycopg2.Error as e:
+                    _logger.error("Failed to restore the session: %r", e)
+
+    def _record_session_setting(self, sql):
+        """Keep track of the session variables changed by sql."""
+        if self.conn.get_transaction_status() != ext.TRANSACTION_STATUS_IDLE:
+            # The change may still be rolled back
+            return
+        match = _set_regex.match(sql)
+        if match:
+            name = match.group(1).lower()
+            # The latest change to a variable replaces the previous one
+            self.session_settings.pop(name, None)
+            self.session_settings[name] = sql
+            return
+        match = _reset_regex.match(sql)
+        if match:
+            name = match.group(1).lower()
+            if name == "all":
+                self.session_settings.clear()
+            else:
+                self.session_settings.pop(name, None)
+        elif _discard_all_regex.match(sql):
+            self.session_settings.clear()
+
+    def ping(self):
+        """Check that the connection is alive. A round trip is only made
+        outside of transactions, which it could otherwise fail.
+
+        :return: False if the connection is broken
+        """
+        conn = self.conn
+        if conn is None or conn.closed:
+            return False
+        status = conn.get_transaction_status()
+        if status == ext.TRANSACTION_STATUS_IDLE:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+            except psycopg2.Error as e:
+                _logger.debug("Connection failed its liveness check: %r", e)
+                return False
+        return status != ext.TRANSACTION_STATUS_UNKNOWN
+
+    def reset_after_cancel(self):
+        """Check the connection after a command was interrupted, and
+        reconnect only if it is broken, so the session is kept otherwise.
+
+        :return: True if the connection was kept
+        """
+        conn = self.conn
+        if conn is not None and not conn.closed:
+            if conn.get_transaction_status() == ext.TRANSACTION_STATUS_ACTIVE:
+                # The interrupted command is still running on the server
+                conn.cancel()
+            # A user's transaction is kept, to be ended by the user
+            if conn.get_transaction_status() != ext.TRANSACTION_STATUS_ACTIVE:
+                if self.ping():
+                    return True
+        _logger.debug("Reconnecting after a cancel")
+        self.reconnect()
+        return False
+
     def failed_transaction(self):
         status = self.conn.get_transaction_status()
         return status == ext.TRANSACTION_STATUS_INERROR
@@ -411,7 +1185,13 @@ class PGExecute:
         )
 
     def run(
-        self, statement, pgspecial=None, exception_formatter=None, on_error_resume=False
+        self,
+        statement,
+        pgspecial=None,
+        exception_formatter=None,
+        on_error_resume=False,
+        fetch_count=0,
+        row_limit=0,
     ):
         """Execute the sql in the database and return the results.
 
@@ -424,6 +1204,13 @@ class PGExecute:
         :param on_error_resume: Bool. If true, queries following an exception
                (assuming exception_formatter has been supplied) continue to
                execute.
+        :param fetch_count: Int. If not 0, the rows of SELECT statements are
+               returned as a StreamingCursor fetching up to fetch_count rows
+               at a time, which must be closed before running other
+               statements.
+        :param row_limit: Int. If not 0, at most row_limit + 1 rows of SELECT
+               statements without a LIMIT clause are fetched. A rowcount
+               above row_limit tells that there are more rows.
 
         :return: Generator yielding tuples containing
                  (title, rows, headers, status, query, success, is_special)
@@ -441,6 +1228,7 @@ class PGExecute:
             sql = sqlparse.format(sql, strip_comments=False).strip()
             if not sql:
                 continue
+            self.timing = None
             try:
                 if pgspecial:
                     # \G is treated specially since we have to set the expanded output.
@@ -482,7 +1270,9 @@ class PGExecute:
                         pass
 
                 # Not a special command, so execute as normal sql
-                yield self.execute_normal_sql(sql) + (sql, True, False)
+                result = self.execute_normal_sql(sql, fetch_count, row_limit)
+                self._record_session_setting(sql)
+                yield result + (sql, True, False)
             except psycopg2.DatabaseError as e:
                 _logger.error("sql: %r, error: %r", sql, e)
                 _logger.error("traceback: %r", traceback.format_exc())
@@ -513,11 +1303,28 @@ class PGExecute:
         """
         return self.conn.closed != 0
 
-    def execute_normal_sql(self, split_sql):
+    def execute_normal_sql(self, split_sql, fetch_count=0, row_limit=0):
         """Returns tuple (title, rows, headers, status)"""
+        cur = self._server_cursor(split_sql, fetch_count, row_limit)
+        if cur and cur.open():
+            self.timing = cur.timing
+            title = ""
+            while len(self.conn.notices) > 0:
+                title = self.conn.notices.pop() + title
+            headers = [x[0] for x in cur.description or []]
+            if isinstance(cur, SubscribeCursor) or fetch_count:
+                # The status is only known once every row is fetched
+                return title, cur, headers, None
+            cur = FetchedRows(
+                list(cur), cur.description, cur.rowcount, cur.statusmessage
+            )
+            return title, cur, headers, cur.statusmessage
+
         _logger.debug("Regular sql statement. sql: %r", split_sql)
+        self.timing = StatementTiming(split_sql)
         cur = self.conn.cursor()
-        cur.execute(split_sql)
+        with self.timing.measure("execute"):
+            cur.execute(split_sql)
 
         # conn.notices persist between queies, we use pop to clear out the list
         title = ""
@@ -528,6 +1335,19 @@ class PGExecute:
         # rows.
         if cur.description:
             headers = [x[0] for x in cur.description]
+            if (
+                row_limit
+                and _streamable_regex.match(split_sql)
+                and not _has_limit(split_sql)
+            ):
+                # Without a cursor, e.g. in a user transaction, the result is
+                # transferred, but only the rows that can be shown, and one
+                # more telling that there are more, are converted
+                with self.timing.measure("typecast"):
+                    rows = cur.fetchmany(row_limit + 1)
+                cur = FetchedRows(
+                    rows, cur.description, cur.rowcount, cur.statusmessage
+                )
             return title, cur, headers, cur.statusmessage
         elif cur.protocol_error:
             _logger.debug("Protocol error, unsupported command.")
@@ -536,6 +1356,57 @@ class PGExecute:
             _logger.debug("No rows in result.")
             return title, None, None, cur.statusmessage
 
+    def _server_cursor(self, sql, fetch_count, row_limit):
+        """Returns a StreamingCursor to read the rows of sql with, or None if
+        they should be read with a client-side cursor."""
+        if _subscribe_regex.match(sql):
+            _logger.debug("Subscribe sql statement. sql: %r", sql)
+            return SubscribeCursor(self.conn, sql)
+
+        # Other server-side cursors are only declared outside of user
+        # transactions, where an error can't abort the user's transaction.
+        if (
+            not _streamable_regex.match(sql)
+            or self.conn.get_transaction_status() != ext.TRANSACTION_STATUS_IDLE
+        ):
+            return None
+        if _has_limit(sql):
+            row_limit = 0
+        if fetch_count:
+            _logger.debug("Streaming sql statement. sql: %r", sql)
+            return StreamingCursor(self.conn, sql, fetch_count, row_limit)
+        if row_limit:
+            # Every row to show, and one more telling that there are more,
+            # in a single FETCH
+            _logger.debug("Row limited sql statement. sql: %r", sql)
+            return StreamingCursor(
+                self.conn, sql, row_limit + 1, row_limit, batch_size=row_limit + 1
+            )
+        return None
+
+    def subscribe(self, text):
+        """Subscribe to the result of a single SELECT statement, with progress
+        messages telling when the updates of a timestamp are complete.
+
+        :return: an open SubscribeCursor, or None if the statement can't be
+                 subscribed to, in which case it should be polled instead
+        """
+        statements = [s for s in sqlparse.split(text) if s.strip()]
+        if (
+            len(statements) != 1
+            or not _streamable_regex.match(statements[0])
+            or self.conn.get_transaction_status() != ext.TRANSACTION_STATUS_IDLE
+        ):
+            return None
+        sql = "SUBSCRIBE ({}) WITH (PROGRESS)".format(statements[0].strip().rstrip(";"))
+        cur = SubscribeCursor(self.conn, sql)
+        try:
+            if cur.open():
+                return cur
+        except psycopg2.Error as e:
+            _logger.debug("Can't subscribe. sql: %r, error: %r", sql, e)
+        return None
+
     def search_path(self):
         """Returns the current search path as a list of schema names"""
 
@@ -591,6 +1462,17 @@ class PGExecute:
             cur.execute(schemata_query)
             return [x[0] for x in cur.fetchall()]
 
+    # Maps postgres relkind filters onto the Materialize relation types
+    relation_types = dict(
+        r="table",
+        v="view",
+        s="source",
+        m="view",
+        # these don't exist in materialized
+        p="partitioned",
+        f="foreign",
+    )
+
     def _relations(self, kinds=("r", "p", "f", "v", "m", "s")):
         """Get table or view name metadata
 
@@ -603,16 +1485,7 @@ class PGExecute:
                 'm' - materialized view
         :return: (schema_name, rel_name) tuples
         """
-        typemap = dict(
-            r="table",
-            v="view",
-            s="source",
-            m="view",
-            # these don't exist in materialized
-            p="partitioned",
-            f="foreign",
-        )
-        kinds = [typemap[k] for k in kinds]
+        kinds = [self.relation_types[k] for k in kinds]
 
         with self.conn.cursor() as cur:
             query = self.tables_query.format(dbname=self.dbname)
@@ -639,6 +1512,10 @@ class PGExecute:
     def _columns(self, kinds=("r", "p", "f", "s", "v", "m")):
         """Get column metadata for tables and views
 
+        All columns are read with a single catalog query. Servers whose
+        catalog lacks ``mz_columns`` fall back to one ``SHOW COLUMNS`` per
+        relation.
+
         :param kinds: kinds: list of postgres relkind filters:
                 'r' - table
                 'p' - partitioned table
@@ -648,27 +1525,100 @@ class PGExecute:
                 'm' - materialized view
         :return: list of (schema_name, relation_name, column_name, column_type, has_default, default) tuples
         """
+        types = [self.relation_types[k] for k in kinds]
+
         with self.conn.cursor() as cur:
-            for row in self._relations(kinds):
-                schema = row[0]
-                tbl = row[1]
-                # TODO: Materialize should support mogrified table names
-                if schema:
-                    q = '"{}"."{}"'.format(schema, tbl)
-                else:
-                    q = '"{}"'.format(tbl)
-                try:
-                    sql = "SHOW COLUMNS FROM {}".format(q)
-                    _logger.debug("Show Columns Query: %s", sql)
-                    cur.execute(sql)
-                except Exception:
-                    sql = 'SHOW COLUMNS FROM "{}"'.format(tbl)
-                    _logger.debug("Show columns %s failed, trying without schema", q)
-                    _logger.debug("Show Columns Query: %s", sql)
-                    cur.execute(sql)
+            query = self.columns_query.format(dbname=self.dbname)
+            sql = cur.mogrify(query, [types])
+            _logger.debug("Columns Query. sql: %r", sql)
+            if self._execute_columns_query(cur, sql):
+                for schema, tbl, column, datatype in cur:
+                    yield (schema, tbl, column, datatype, False, None)
+                return
+
+        yield from self._show_columns(kinds)
+
+    def _execute_columns_query(self, cur, sql):
+        """Run a column metadata query against mz_columns.
+
+        :return: False if the server can't run the query, in which case
+                 SHOW COLUMNS should be used instead
+        """
+        try:
+            cur.execute(sql)
+        except ext.QueryCanceledError:
+            raise
+        except psycopg2.DatabaseError as e:
+            if self.conn.closed:
+                raise
+            _logger.debug("Columns query failed, using SHOW COLUMNS: %r", e)
+            return False
+        return not cur.protocol_error
+
+    def _show_columns(self, kinds):
+        """Get column metadata by running SHOW COLUMNS for every relation.
+
+        :param kinds: list of postgres relkind filters, see ``_columns``
+        :return: list of (schema_name, relation_name, column_name, column_type, has_default, default) tuples
+        """
+        with self.conn.cursor() as cur:
+            for schema, tbl in self._relations(kinds):
+                yield from self._show_relation_columns(cur, schema, tbl)
 
-                for column in cur.fetchall():
-                    yield (schema, tbl, column[0], column[2], False, None)
+    def _show_relation_columns(self, cur, schema, tbl):
+        """Run SHOW COLUMNS for a single relation.
+
+        :return: list of (schema_name, relation_name, column_name, column_type, has_default, default) tuples
+        """
+        # TODO: Materialize should support mogrified table names
+        if schema:
+            q = '"{}"."{}"'.format(schema, tbl)
+        else:
+            q = '"{}"'.format(tbl)
+        try:
+            sql = "SHOW COLUMNS FROM {}".format(q)
+            _logger.debug("Show Columns Query: %s", sql)
+            cur.execute(sql)
+        except ext.QueryCanceledError:
+            raise
+        except Exception:
+            sql = 'SHOW COLUMNS FROM "{}"'.format(tbl)
+            _logger.debug("Show columns %s failed, trying without schema", q)
+            _logger.debug("Show Columns Query: %s", sql)
+            cur.execute(sql)
+
+        return [(schema, tbl, c[0], c[2], False, None) for c in cur.fetchall()]
+
+    def catalog_relations(self):
+        """Yields (id, schema_name, relation_name, relation_type) tuples for
+        every relation visible from the current database."""
+        with self.conn.cursor() as cur:
+            query = self.catalog_relations_query.format(dbname=self.dbname)
+            _logger.debug("Catalog Relations Query. sql: %r", query)
+            cur.execute(query)
+            yield from cur
+
+    def relation_columns(self, relations):
+        """Get column metadata for specific relations.
+
+        :param relations: list of (id, schema_name, relation_name) tuples
+        :return: list of (schema_name, relation_name, column_name, column_type, has_default, default) tuples
+        """
+        relations = list(relations)
+        if not relations:
+            return
+
+        with self.conn.cursor() as cur:
+            ids = [r[0] for r in relations]
+            sql = cur.mogrify(self.relation_columns_query, [ids])
+            _logger.debug("Relation Columns Query. sql: %r", sql)
+            if self._execute_columns_query(cur, sql):
+                for schema, tbl, column, datatype in cur:
+                    yield (schema, tbl, column, datatype, False, None)
+                return
+
+            for _, schema, tbl in relations:
+                yield from self._show_relation_columns(cur, schema, tbl)
 
     def table_columns(self):
         yield from self._columns(kinds=["r", "p", "f"])
@@ -679,6 +1629,26 @@ class PGExecute:
     def view_columns(self):
         yield from self._columns(kinds=["v", "m"])
 
+    def named_relation_columns(self, schema, name):
+        """Get column metadata for a relation looked up by name.
+
+        :param schema: schema name, or None for the current schema
+        :param name: relation name
+        :return: list of (schema_name, relation_name, column_name, column_type, has_default, default) tuples
+        """
+        with self.conn.cursor() as cur:
+            query = self.named_relation_columns_query.format(dbname=self.dbname)
+            sql = cur.mogrify(query, [schema, name])
+            _logger.debug("Named Relation Columns Query. sql: %r", sql)
+            if self._execute_columns_query(cur, sql):
+                for schema, tbl, column, datatype in cur:
+                    yield (schema, tbl, column, datatype, False, None)
+                return
+
+            if schema is None:
+                schema = self._select_one(cur, "SELECT current_schema()")[0]
+            yield from self._show_relation_columns(cur, schema, name)
+
     def databases(self):
         with self.conn.cursor() as cur:
             _logger.debug("Databases Query. sql: %r", self.databases_query)
@@ -63,7 +63,18 @@ def create_toolbar_tokens_func(mzcli):
             )
 
         if mzcli.completion_refresher.is_refreshing():
-            result.append(("class:bottom-toolbar", "     Refreshing completions..."))
+            progress = mzcli.completion_refresher.progress()
+            if progress:
+                result.append(
+                    (
+                        "class:bottom-toolbar",
+                        "     Refreshing completions... (%d/%d)" % progress,
+                    )
+                )
+            else:
+                result.append(
+                    ("class:bottom-toolbar", "     Refreshing completions...")
+                )
 
         return result
 
@@ -0,0 +1,163 @@
+import datetime as dt
+import json
+import logging
+import os
+import threading
+
+import psycopg2
+
+from .packages.parseutils.fingerprint import fingerprint, normalize_query
+
+_logger = logging.getLogger(__name__)
+
+# Statements whose plan can be shown with EXPLAIN
+_explainable = ("select", "with", "values", "table", "(")
+# Statements that run until they're cancelled, so are always slow
+_unbounded = ("subscribe", "tail")
+
+
+class SlowQueryLog:
+    """Appends the statements slower than a threshold to a file.
+
+    Every statement is written as a JSON object on its own line, with a
+    single write to a file opened for appending, so sessions can share the
+    file. The file is reopened for every statement, so moving it away, e.g.
+    by logrotate, starts a new file. Once the file is larger than
+    `max_size`, it is renamed with a ".1" suffix, keeping `backup_count`
+    previous files.
+    """
+
+    def __init__(
+        self,
+        filename,
+        threshold,
+        get_pgexecute,
+        explain=False,
+        max_size=10 * 1024 * 1024,
+        backup_count=3,
+    ):
+        """
+        :param filename: path of the log file.
+        :param threshold: seconds above which a statement is logged.
+        :param get_pgexecute: callable returning the current PGExecute.
+        :param explain: whether to log the EXPLAIN plan of SELECT statements.
+                        The plan is fetched on a secondary connection, in a
+                        background thread.
+        :param max_size: size in bytes above which the file is rotated, or 0
+                         to never rotate it.
+        :param backup_count: number of rotated files kept.
+        """
+        self.filename = os.path.expanduser(filename)
+        self.threshold = threshold
+        self.get_pgexecute = get_pgexecute
+        self.explain = explain
+        self.max_size = max_size
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def record(self, timing):
+        """Log a StatementTiming if it's slow, e.g. as a timing hook of PGCli."""
+        if timing.special or timing.total < self.threshold:
+            return
+        normalized = normalize_query(timing.sql)
+        if normalized.startswith(_unbounded):
+            return
+        entry = {
+            "time": dt.datetime.now(dt.timezone.utc).isoformat(),
+            "fingerprint": fingerprint(timing.sql),
+            "query": timing.sql,
+            "total": timing.total,
+            "phases": {phase: getattr(timing, phase) for phase in timing.phases},
+            "rows": timing.rows,
+        }
+        pgexecute = self.get_pgexecute()
+        if pgexecute is not None:
+            entry["connection"] = {
+                "host": pgexecute.host,
+                "port": pgexecute.port,
+                "user": pgexecute.user,
+                "dbname": pgexecute.dbname,
+                "server_version": pgexecute.server_version,
+            }
+        if (
+            self.explain
+            and pgexecute is not None
+            and normalized.startswith(_explainable)
+        ):
+            thread = threading.Thread(
+                target=self._explain_and_write,
+                # The session settings as of the statement, e.g. its cluster
+                args=(pgexecute, list(pgexecute.session_settings.values()), entry),
+                name="slow_query_explain",
+            )
+            thread.daemon = True
+            with self._lock:
+                self._threads = [t for t in self._threads if t.is_alive()]
+                self._threads.append(thread)
+            thread.start()
+        else:
+            self._write(entry)
+
+    def flush(self, timeout=None):
+        """Wait for the plans being fetched to be written."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def _explain_and_write(self, pgexecute, settings, entry):
+        """Fetch the plan of the statement of entry on a pooled connection,
+        with the SET statements of the session it ran in, then write entry.
+        """
+        try:
+            executor = pgexecute.acquire()
+        except psycopg2.Error as e:
+            entry["explain_error"] = str(e).strip()
+        else:
+            try:
+                with executor.conn.cursor() as cur:
+                    for sql in settings:
+                        cur.execute(sql)
+                    cur.execute("EXPLAIN " + entry["query"].strip().rstrip(";"))
+                    entry["explain"] = "\n".join(row[0] for row in cur.fetchall())
+            except psycopg2.Error as e:
+                entry["explain_error"] = str(e).strip()
+            finally:
+                self._release(pgexecute, executor, settings)
+        self._write(entry)
+
+    def _release(self, pgexecute, executor, settings):
+        """Return a pooled connection with its own session settings."""
+        try:
+            executor.conn.rollback()
+            if settings:
+                with executor.conn.cursor() as cur:
+                    cur.execute("RESET ALL")
+        except psycopg2.Error as e:
+            _logger.debug("Closing the connection of EXPLAIN: %r", e)
+            executor.conn.close()
+        pgexecute.release(executor)
+
+    def _write(self, entry):
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+                if self.max_size and os.path.exists(self.filename):
+                    if os.path.getsize(self.filename) >= self.max_size:
+                        self._rotate()
+                with open(self.filename, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                _logger.error("Could not write to the slow query log: %s", e)
+
+    def _rotate(self):
+        if self.backup_count < 1:
+            os.remove(self.filename)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            source = "%s.%s" % (self.filename, i)
+            if os.path.exists(source):
+                os.replace(source, "%s.%s" % (self.filename, i + 1))
+        os.replace(self.filename, self.filename + ".1")
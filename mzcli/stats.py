@@ -0,0 +1,143 @@
+import csv
+import math
+
+from .packages.parseutils.fingerprint import normalize_query
+
+
+class LatencySketch:
+    """Streaming quantiles of latencies, with a bounded relative error.
+
+    Values are counted in buckets whose bounds grow geometrically, so any
+    quantile is known within `relative_accuracy` of its true value while
+    memory only grows with the logarithm of the range of the values.
+    """
+
+    # Values below this many seconds are counted as zero
+    min_value = 1e-6
+
+    def __init__(self, relative_accuracy=0.01):
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(gamma)
+        self._buckets = {}
+        self._zeros = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value < self.min_value:
+            self._zeros += 1
+        else:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self._buckets[index] = self._buckets.get(index, 0) + 1
+
+    def quantile(self, q):
+        """Returns the value below which a fraction q of the values are."""
+        if not self.count:
+            return None
+        # The nearest rank, counting from 1
+        rank = max(math.ceil(q * self.count), 1)
+        seen = self._zeros
+        if rank <= seen:
+            return 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if rank <= seen:
+                # The middle of the bucket, in relative terms
+                value = (
+                    2
+                    * math.exp(index * self._log_gamma)
+                    / (1 + math.exp(self._log_gamma))
+                )
+                return min(max(value, self.min), self.max)
+        return self.max
+
+
+class QueryStats:
+    """Latencies and row counts of the runs of one query."""
+
+    def __init__(self, query):
+        self.query = query
+        self.latencies = LatencySketch()
+        self.rows = 0
+
+    def add(self, timing):
+        self.latencies.add(timing.total)
+        self.rows += timing.rows
+
+
+class SessionStats:
+    """Statistics of the statements run in the session, by query."""
+
+    headers = [
+        "query",
+        "count",
+        "rows",
+        "min",
+        "p50",
+        "p95",
+        "p99",
+        "max",
+        "total",
+    ]
+
+    def __init__(self, normalize=None):
+        """
+        :param normalize: callable returning the key under which the
+                          statistics of a statement are kept.
+        """
+        self.normalize = normalize or normalize_query
+        self.queries = {}
+
+    def record(self, timing):
+        """Add a StatementTiming, e.g. as a timing hook of PGCli. Special
+        commands are left out."""
+        if timing.special:
+            return
+        key = self.normalize(timing.sql)
+        stats = self.queries.get(key)
+        if stats is None:
+            stats = self.queries[key] = QueryStats(key)
+        stats.add(timing)
+
+    def reset(self):
+        self.queries.clear()
+
+    def rows(self):
+        """Yields a row of statistics per query, the slowest in total first.
+        Latencies are in seconds."""
+        queries = sorted(
+            self.queries.values(), key=lambda stats: stats.latencies.sum, reverse=True
+        )
+        for stats in queries:
+            latencies = stats.latencies
+            yield (
+                stats.query,
+                latencies.count,
+                stats.rows,
+                latencies.min,
+                latencies.quantile(0.5),
+                latencies.quantile(0.95),
+                latencies.quantile(0.99),
+                latencies.max,
+                latencies.sum,
+            )
+
+    def export(self, filename):
+        """Write the statistics to a CSV file.
+
+        :return: the number of queries written
+        """
+        rows = list(self.rows())
+        with open(filename, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(self.headers)
+            writer.writerows(rows)
+        return len(rows)
@@ -0,0 +1,64 @@
+from contextlib import contextmanager
+from time import time
+
+
+class StatementTiming:
+    """Where the time running a statement went, in seconds.
+
+    - execute: from sending the statement until its first rows are received.
+      With a client-side cursor, the whole result is received by then.
+    - fetch: receiving the remaining rows through a server-side cursor.
+    - typecast: converting the received rows to Python values.
+    - format: formatting the rows for output.
+    - output: writing the formatted rows to the terminal or file.
+
+    The time the output was shown in the pager is kept apart, in `pager`, as
+    it's mostly spent by the user reading it.
+    """
+
+    phases = ("execute", "fetch", "typecast", "format", "output")
+
+    def __init__(self, sql=""):
+        self.sql = sql
+        self.rows = 0
+        # Whether the statement is a special command, e.g. \dt
+        self.special = False
+        self.execute = 0.0
+        self.fetch = 0.0
+        self.typecast = 0.0
+        self.format = 0.0
+        self.output = 0.0
+        self.pager = 0.0
+
+    @property
+    def total(self):
+        return sum(getattr(self, phase) for phase in self.phases)
+
+    @property
+    def server(self):
+        """Time spent waiting for the server and the network."""
+        return self.execute + self.fetch
+
+    @contextmanager
+    def measure(self, phase):
+        """Add the time spent in the context to a phase."""
+        start = time()
+        try:
+            yield
+        finally:
+            setattr(self, phase, getattr(self, phase) + time() - start)
+
+    def describe(self):
+        description = ", ".join(
+            "%s: %0.03fs" % (phase, getattr(self, phase)) for phase in self.phases
+        )
+        if self.pager:
+            description += " (pager: %0.03fs)" % self.pager
+        return description
+
+    def __repr__(self):
+        return "StatementTiming(%r, rows=%s, %s)" % (
+            self.sql,
+            self.rows,
+            self.describe(),
+        )
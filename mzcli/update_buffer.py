@@ -0,0 +1,167 @@
+import threading
+
+# What to do with updates arriving while the buffer is full
+OVERFLOW_POLICIES = ("block", "coalesce", "drop")
+
+
+class UpdateBuffer:
+    """A bounded buffer of SUBSCRIBE updates, between the thread fetching
+    them and the one showing them.
+
+    When more than `maxsize` updates are waiting, the overflow policy
+    decides what happens:
+
+    - block: the fetching thread waits, so no more updates are fetched until
+      the buffered ones are shown.
+    - coalesce: updates to the same row are merged by summing their diffs,
+      keeping the latest timestamp. If the buffer is still full, the fetching
+      thread waits.
+    - drop: every other buffered update is dropped, keeping a sample of the
+      updates spread over time. Only suitable for updates that are printed:
+      consolidating the remaining ones doesn't give the rows of the relation.
+
+    Memory use is bounded by `maxsize` plus the size of one fetched batch.
+    """
+
+    def __init__(self, headers, maxsize=10000, policy="block", callback=None):
+        """
+        :param headers: column names of the SUBSCRIBE output.
+        :param maxsize: number of updates buffered before the overflow policy
+                        applies.
+        :param policy: one of OVERFLOW_POLICIES.
+        :param callback: called from the fetching thread after updates are
+                         added, before waiting for the buffer to drain.
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy: %s" % policy)
+        self.maxsize = max(maxsize, 1)
+        self.policy = policy
+        self.callback = callback
+        if "mz_diff" in headers:
+            self._timestamp = headers.index("mz_timestamp")
+            self._diff = headers.index("mz_diff")
+        else:
+            # Updates without diffs, e.g. with ENVELOPE UPSERT, can't be merged
+            self._diff = None
+        self.received = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.error = None
+        self._updates = []
+        self._finished = False
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def put(self, updates):
+        """Add a batch of updates, applying the overflow policy.
+
+        :return: False if the buffer was closed, and no more updates should
+                 be added
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            self._updates.extend(updates)
+            self.received += len(updates)
+            if len(self._updates) > self.maxsize:
+                if self.policy == "coalesce" and self._diff is not None:
+                    self._coalesce()
+                elif self.policy == "drop":
+                    self._drop()
+            self._cond.notify_all()
+            if self.callback:
+                self.callback()
+            while len(self._updates) > self.maxsize and not self._closed:
+                self._cond.wait()
+            return not self._closed
+
+    def get(self, timeout=None):
+        """Remove and return the buffered updates, waiting for some.
+
+        :return: an empty list if the buffer is finished or closed, or when
+                 the timeout expires.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._updates or self._finished or self._closed, timeout
+            )
+            updates, self._updates = self._updates, []
+            self._cond.notify_all()
+            return updates
+
+    def fill(self, batches):
+        """Put every batch of an iterable in the buffer, until it is exhausted
+        or the buffer is closed. Errors are kept in `error`."""
+        try:
+            for batch in batches:
+                if not self.put(batch):
+                    break
+        except BaseException as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+
+    def close(self):
+        """Stop accepting updates, waking up a waiting fetching thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def stop(self, reader):
+        """Close the buffer and wait for the thread filling it to stop, which
+        it does after its current FETCH times out at the latest.
+
+        Ctrl+C doesn't interrupt the wait, so the connection is never used by
+        the reader and the caller at the same time.
+        """
+        self.close()
+        while reader.is_alive():
+            try:
+                reader.join()
+            except KeyboardInterrupt:
+                pass
+
+    @property
+    def finished(self):
+        """True once the updates are exhausted and every one was read."""
+        with self._cond:
+            return self._finished and not self._updates
+
+    def _coalesce(self):
+        merged = {}
+        for update in self._updates:
+            if update[self._diff] is None:
+                # Progress messages, WITH (PROGRESS), aren't merged
+                merged[object()] = update
+                continue
+            key = tuple(
+                value
+                for i, value in enumerate(update)
+                if i != self._timestamp and i != self._diff
+            )
+            # Merged updates move to the end, in the order of their timestamp
+            previous = merged.pop(key, None)
+            if previous is not None:
+                update = list(update)
+                update[self._diff] += previous[self._diff]
+                update = tuple(update)
+            merged[key] = update
+        updates = [update for update in merged.values() if update[self._diff] != 0]
+        self.coalesced += len(self._updates) - len(updates)
+        self._updates = updates
+
+    def _drop(self):
+        while len(self._updates) > self.maxsize:
+            self.dropped += len(self._updates) // 2
+            self._updates = self._updates[::2]
+
+    def describe(self):
+        """Describe the updates that were coalesced or dropped, if any."""
+        counters = []
+        if self.coalesced:
+            counters.append("%s coalesced" % self.coalesced)
+        if self.dropped:
+            counters.append("%s dropped" % self.dropped)
+        return ", ".join(counters)
@@ -0,0 +1,79 @@
+import hashlib
+from collections import Counter
+
+
+class WatchResult:
+    """The result of a statement run by \\watch, compared across runs.
+
+    Only a digest of the previous result is kept, so an unchanged result
+    isn't printed again. With `diff`, the previous rows are kept too, so the
+    rows added and removed since the previous run can be printed instead of
+    the whole result.
+    """
+
+    def __init__(self, diff=False):
+        self.diff = diff
+        self.runs = 0
+        self.changed = True
+        self.added = []
+        self.removed = []
+        self._digest = None
+        self._counts = Counter()
+        self._rows = {}
+
+    def update(self, rows):
+        """Compare rows with the result of the previous run.
+
+        :param rows: iterable of the rows of the new result, read once.
+        :return: the rows, as a list
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        result = []
+        for row in rows:
+            digest.update(repr(row).encode("utf-8"))
+            digest.update(b"\0")
+            result.append(row)
+        digest = digest.digest()
+        self.changed = digest != self._digest
+        self._digest = digest
+        self.runs += 1
+        if self.diff:
+            self._compare(result)
+        return result
+
+    def _compare(self, rows):
+        counts = Counter()
+        current = {}
+        for row in rows:
+            key = _row_key(row)
+            counts[key] += 1
+            current[key] = row
+        if self.runs > 1:
+            self.added = [
+                current[key]
+                for key, n in (counts - self._counts).items()
+                for _ in range(n)
+            ]
+            self.removed = [
+                self._rows[key]
+                for key, n in (self._counts - counts).items()
+                for _ in range(n)
+            ]
+        self._counts = counts
+        self._rows = current
+
+    def changes(self):
+        """Returns the rows added and removed since the previous run, with
+        a leading "+" or "-" column."""
+        return [("+",) + tuple(row) for row in self.added] + [
+            ("-",) + tuple(row) for row in self.removed
+        ]
+
+
+def _row_key(row):
+    """A hashable key for a row, whose values may be lists."""
+    try:
+        hash(row)
+        return row
+    except TypeError:
+        return repr(row)
@@ -0,0 +1,60 @@
+import pytest
+from mzcli.packages.parseutils.ddl import parse_ddl, DdlChange
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("CREATE VIEW v AS SELECT 1", [DdlChange("create", "views", None, "v")]),
+        (
+            'create or replace materialized view s."MyView" as select 1;',
+            [DdlChange("create", "views", "s", "MyView")],
+        ),
+        (
+            "CREATE TEMP VIEW t AS SELECT 1",
+            [DdlChange("create", "views", "mz_temp", "t")],
+        ),
+        (
+            "CREATE TABLE IF NOT EXISTS db.sch.T (a int)",
+            [DdlChange("create", "tables", "sch", "t")],
+        ),
+        (
+            "CREATE SOURCE src FROM KAFKA CONNECTION k (TOPIC 't')",
+            [DdlChange("create", "sources", None, "src")],
+        ),
+        ("CREATE INDEX i ON v (a)", []),
+        ("CREATE DEFAULT INDEX ON v", []),
+        ("CREATE SINK k FROM v INTO KAFKA CONNECTION k (TOPIC 't')", []),
+        (
+            "DROP VIEW IF EXISTS a, s.b",
+            [
+                DdlChange("drop", "views", None, "a"),
+                DdlChange("drop", "views", "s", "b"),
+            ],
+        ),
+        ("DROP TABLE t RESTRICT", [DdlChange("drop", "tables", None, "t")]),
+        ("DROP INDEX i", []),
+        (
+            "ALTER VIEW s.v RENAME TO w",
+            [DdlChange("rename", "views", "s", "v", "w")],
+        ),
+        ("ALTER INDEX i SET (RETAIN HISTORY FOR '1h')", []),
+    ],
+)
+def test_parse_ddl(sql, expected):
+    assert parse_ddl(sql) == expected
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "DROP VIEW v CASCADE",
+        "CREATE SCHEMA s",
+        "DROP SCHEMA s",
+        "ALTER TABLE t ADD COLUMN c int",
+        "CREATE SOURCE pg FROM POSTGRES CONNECTION c (PUBLICATION 'p') FOR ALL TABLES",
+        "COMMIT",
+    ],
+)
+def test_parse_ddl_unknown_effect(sql):
+    assert parse_ddl(sql) is None
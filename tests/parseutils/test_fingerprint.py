@@ -0,0 +1,72 @@
+import pytest
+from mzcli.packages.parseutils.fingerprint import fingerprint, normalize_query
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("SELECT 1", "select ?"),
+        ("select  *\n\tFROM T;", "select * from t"),
+        ("select * from t where id = -1", "select * from t where id = ?"),
+        ("select a - 1, b+2 from t", "select a - ?, b + ? from t"),
+        ("select 1.5e3, .5, 'it''s', E'\\'', x'ff'", "select ?, ?, ?, ?, ?"),
+        ("select $$a'b$$, $fn$x$$y$fn$", "select ?, ?"),
+        (
+            "select * from t where a = $1 and b = %s",
+            "select * from t where a = ? and b = ?",
+        ),
+        ('select "MyCol" from "My".t', 'select "MyCol" from "My".t'),
+        ("select a /* x */ from t -- y", "select a from t"),
+        ("select a::int[], b[1] from t", "select a::int[], b[?] from t"),
+        ("select count(*) from t", "select count(*) from t"),
+        ("select -1, +2", "select ?, ?"),
+        (
+            "select case when -1 then -2 else -3 end",
+            "select case when ? then ? else ? end",
+        ),
+        ("select a -1, null -1 from t", "select a - ?, null - ? from t"),
+        (
+            "select * from t where a not in (1) and (b)",
+            "select * from t where a not in (...) and (b)",
+        ),
+        ("select 1; select 2;", "select ?; select ?"),
+        ("select 'unterminated", "select ?"),
+    ],
+)
+def test_normalize_query(sql, expected):
+    assert normalize_query(sql) == expected
+
+
+@pytest.mark.parametrize(
+    "sql, expected",
+    [
+        ("select * from t where id in (1)", "select * from t where id in (...)"),
+        (
+            "select * from t where id NOT IN (1, -2, 'c')",
+            "select * from t where id not in (...)",
+        ),
+        (
+            "select * from t where id in (select id from u where x in ($1, $2))",
+            "select * from t where id in (select id from u where x in (...))",
+        ),
+        ("select * from t where id in (a, 1)", "select * from t where id in (a, ?)"),
+        (
+            "select * from t where id in (f(1), 2)",
+            "select * from t where id in (f(?), ?)",
+        ),
+    ],
+)
+def test_normalize_query_collapses_in_lists(sql, expected):
+    assert normalize_query(sql) == expected
+
+
+def test_fingerprint_is_the_same_for_literal_variations():
+    assert fingerprint("SELECT * FROM t WHERE id IN (1, 2) AND n = 'a'") == fingerprint(
+        "select *  from t\nwhere ID in (3, 4, 5) and N = 'b';"
+    )
+    assert fingerprint("select a from t") != fingerprint("select b from t")
+    assert fingerprint('select "A" from t') != fingerprint("select a from t")
+
+
+def test_fingerprint_is_stable():
+    assert fingerprint("select 1") == "b9a4c90ce4157373"
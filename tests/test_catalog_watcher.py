@@ -0,0 +1,114 @@
+from threading import Lock
+from unittest.mock import MagicMock, Mock
+
+from mzcli.catalog_watcher import CatalogWatcher
+from mzcli.pgcompleter import PGCompleter
+
+
+def make_watcher(completer, columns=()):
+    executor = Mock()
+    executor.relation_columns.return_value = list(columns)
+    executor.conn.closed = 0
+    pgexecute = Mock()
+    pgexecute.acquire.return_value = executor
+    callback = Mock()
+    watcher = CatalogWatcher(pgexecute, lambda: completer, Lock(), callback)
+    return watcher, executor, callback
+
+
+def test_apply_catalog_changes():
+    completer = PGCompleter()
+    completer.extend_schemata(["public"])
+    completer.extend_relations([("public", "old")], kind="tables")
+    completer.catalog_relations = {"u1": ("public", "old", "tables")}
+    watcher, executor, callback = make_watcher(
+        completer, [("public", "v", "x", "integer", False, None)]
+    )
+
+    watcher.apply(
+        [
+            (10, -1, "u1", "public", "old", "table"),
+            (10, 1, "u2", "public", "v", "view"),
+            (11, 1, "u3", "s", None, "schema"),
+        ]
+    )
+
+    assert "old" not in completer.dbmetadata["tables"]["public"]
+    assert list(completer.dbmetadata["views"]["public"]["v"]) == ["x"]
+    assert "s" in completer.dbmetadata["tables"]
+    assert completer.catalog_relations == {"u2": ("public", "v", "views")}
+    assert list(executor.relation_columns.call_args[0][0]) == [("u2", "public", "v")]
+    callback.assert_called_once_with(completer)
+
+
+def test_apply_rename_at_same_timestamp():
+    completer = PGCompleter()
+    completer.extend_schemata(["public"])
+    completer.extend_relations([("public", "a")], kind="tables")
+    watcher, _, _ = make_watcher(completer)
+
+    watcher.apply(
+        [
+            (10, 1, "u1", "public", "b", "table"),
+            (10, -1, "u1", "public", "a", "table"),
+        ]
+    )
+
+    assert set(completer.dbmetadata["tables"]["public"]) == {"b"}
+
+
+def test_catch_up_with_changes_made_before_the_subscription():
+    completer = PGCompleter()
+    completer.extend_schemata(["public", "old"])
+    completer.extend_relations([("public", "a")], kind="tables")
+    completer.extend_relations([("public", "b")], kind="views")
+    completer.catalog_relations = {
+        "u1": ("public", "a", "tables"),
+        "u2": ("public", "b", "views"),
+    }
+    watcher, executor, callback = make_watcher(
+        completer, [("public", "c", "x", "integer", False, None)]
+    )
+    executor.schemata.return_value = ["public", "new"]
+    executor.catalog_relations.return_value = [
+        ("u1", "public", "a", "table"),
+        ("u3", "public", "c", "materialized-view"),
+    ]
+
+    watcher.catch_up(completer)
+
+    assert set(completer.dbmetadata["tables"]) == {"public", "new"}
+    assert set(completer.dbmetadata["tables"]["public"]) == {"a"}
+    assert list(completer.dbmetadata["views"]["public"]) == ["c"]
+    assert list(completer.dbmetadata["views"]["public"]["c"]) == ["x"]
+    assert completer.catalog_relations == {
+        "u1": ("public", "a", "tables"),
+        "u3": ("public", "c", "views"),
+    }
+    callback.assert_called_once_with(completer)
+
+
+def test_watch_catches_up_once_the_subscription_started():
+    completer = PGCompleter()
+    completer.catalog_relations = {}
+    watcher, executor, _ = make_watcher(completer)
+    executor.schemata.return_value = []
+    executor.catalog_relations.return_value = []
+    watch_executor = MagicMock()
+    cur = watch_executor.conn.cursor.return_value.__enter__.return_value
+    cur.protocol_error = False
+    fetches = []
+
+    def fetchall():
+        fetches.append(executor.catalog_relations.call_count)
+        if len(fetches) == 3:
+            watcher.stop()
+        return []
+
+    cur.fetchall.side_effect = fetchall
+
+    watcher._watch(watch_executor)
+
+    # Caught up after the first FETCH, and only once per completer
+    assert fetches == [0, 1, 1]
+    assert executor.catalog_relations.call_count == 1
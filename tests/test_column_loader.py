@@ -0,0 +1,59 @@
+import threading
+from unittest.mock import Mock
+
+import pytest
+
+from mzcli.column_loader import ColumnLoader
+
+
+COLUMNS = [("public", "users", "id", "integer", False, None)]
+
+
+def test_columns_are_loaded_on_a_pooled_connection():
+    pgexecute = Mock()
+    executor = pgexecute.acquire.return_value
+    executor.named_relation_columns.return_value = iter(COLUMNS)
+    loader = ColumnLoader(lambda: pgexecute)
+
+    assert loader("public", "users") == COLUMNS
+    executor.named_relation_columns.assert_called_once_with("public", "users")
+    pgexecute.release.assert_called_once_with(executor)
+
+
+def test_slow_lookups_time_out_and_are_reused():
+    pgexecute = Mock()
+    executor = pgexecute.acquire.return_value
+    unblock = threading.Event()
+
+    def named_relation_columns(schema, relname):
+        unblock.wait(5)
+        return iter(COLUMNS)
+
+    executor.named_relation_columns.side_effect = named_relation_columns
+    loader = ColumnLoader(lambda: pgexecute, timeout=0.05)
+
+    with pytest.raises(TimeoutError):
+        loader("public", "users")
+    with pytest.raises(TimeoutError):
+        loader("public", "users")
+    # The pending lookup is waited for again rather than started twice
+    assert pgexecute.acquire.call_count == 1
+
+    unblock.set()
+    loader.timeout = 5
+    assert loader("public", "users") == COLUMNS
+    assert pgexecute.acquire.call_count == 1
+    pgexecute.release.assert_called_once_with(executor)
+
+
+def test_lookup_errors_are_raised():
+    pgexecute = Mock()
+    pgexecute.acquire.return_value.named_relation_columns.side_effect = ValueError()
+    loader = ColumnLoader(lambda: pgexecute)
+
+    with pytest.raises(ValueError):
+        loader("public", "users")
+    # Failed lookups are started again
+    with pytest.raises(ValueError):
+        loader("public", "users")
+    assert pgexecute.acquire.call_count == 2
@@ -0,0 +1,54 @@
+from unittest.mock import Mock
+
+from mzcli import completion_cache
+from mzcli.pgcompleter import PGCompleter
+
+
+def make_completer():
+    completer = PGCompleter()
+    completer.set_search_path(["public"])
+    completer.extend_schemata(["public", "Other"])
+    completer.extend_relations([("public", "users")], kind="tables")
+    completer.extend_columns(
+        [
+            ("public", "users", "id", "integer", False, None),
+            ("public", "users", "Name", "text", False, None),
+        ],
+        kind="tables",
+    )
+    completer.extend_relations([("Other", "events")], kind="sources")
+    completer.extend_relations([("public", "v")], kind="views")
+    completer.extend_datatypes([("public", "mytype")])
+    completer.extend_database_names(["materialize"])
+    return completer
+
+
+def test_cache_filename_is_keyed_by_connection(tmpdir):
+    a = Mock(host="localhost", port=6875, dbname="materialize", user="u")
+    b = Mock(host="localhost", port=6875, dbname="other", user="u")
+    assert completion_cache.cache_filename(
+        str(tmpdir), a
+    ) != completion_cache.cache_filename(str(tmpdir), b)
+
+
+def test_save_and_load_round_trip(tmpdir):
+    filename = str(tmpdir.join("cache", "completions.json.gz"))
+    original = make_completer()
+    completion_cache.save(filename, completion_cache.dump_completer(original))
+
+    loaded = PGCompleter()
+    assert completion_cache.load(filename, loaded)
+    assert loaded.dbmetadata["tables"] == original.dbmetadata["tables"]
+    assert loaded.dbmetadata["sources"] == original.dbmetadata["sources"]
+    assert loaded.dbmetadata["views"] == original.dbmetadata["views"]
+    assert loaded.dbmetadata["datatypes"] == original.dbmetadata["datatypes"]
+    assert loaded.search_path == original.search_path
+    assert loaded.databases == original.databases
+
+
+def test_load_missing_or_invalid_cache(tmpdir):
+    assert not completion_cache.load(str(tmpdir.join("missing")), PGCompleter())
+
+    invalid = tmpdir.join("invalid")
+    invalid.write("not gzip")
+    assert not completion_cache.load(str(invalid), PGCompleter())
@@ -27,6 +27,9 @@ def test_ctor(refresher):
         "databases",
         "casing",
         "functions",
+        "table_columns",
+        "source_columns",
+        "view_columns",
     ]
     assert expected_handlers == actual_handlers
 
@@ -47,7 +50,7 @@ def test_refresh_called_once(refresher):
         assert len(actual) == 1
         assert len(actual[0]) == 4
         assert actual[0][3] == "Auto-completion refresh started in the background."
-        bg_refresh.assert_called_with(pgexecute, special, callbacks, None, None)
+        bg_refresh.assert_called_with(pgexecute, special, callbacks, None, None, None)
 
 
 def test_refresh_called_twice(refresher):
@@ -94,3 +97,357 @@ def test_refresh_with_callbacks(refresher):
     refresher.refresh(pgexecute, special, callbacks)
     time.sleep(1)  # Wait for the thread to work.
     assert callbacks[0].call_count == 1
+
+
+def test_restart_cancels_running_refresher(refresher):
+    """
+    A restart must stop a refresher between rows and cancel its query
+    instead of waiting for it to finish.
+    :param refresher:
+    """
+    callbacks = [Mock()]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    pgexecute.acquire.return_value.round_trips = 0
+    special = Mock()
+    runs = []
+
+    def slow_rows():
+        for i in range(100):
+            time.sleep(0.1)
+            yield ("public", "t{}".format(i))
+
+    def refresh_tables(completer, executor):
+        runs.append(executor)
+        rows = slow_rows() if len(runs) == 1 else iter([("public", "a")])
+        completer.extend_relations(rows, kind="tables")
+
+    refresher.refreshers = {"tables": refresh_tables}
+    refresher.refresh(pgexecute, special, callbacks)
+    time.sleep(0.5)  # Wait for the refresher to start loading rows.
+    refresher.refresh(pgexecute, special, callbacks)
+    time.sleep(1)  # Wait for the restarted refresh to finish.
+
+    assert not refresher.is_refreshing()
+    assert len(runs) == 2
+    assert refresher.restart_count == 1
+    runs[0].conn.cancel.assert_called_once_with()
+    assert callbacks[0].call_count == 1
+
+
+def test_parallel_refresh(refresher):
+    """
+    With refresh_concurrency > 1 every refresher must run and its updates must
+    land in the completer passed to the callbacks.
+    :param refresher:
+    """
+    callbacks = [Mock()]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    special = Mock()
+    calls = []
+
+    def refresh_first(completer, executor):
+        calls.append("first")
+        completer.extend_schemata(["public"])
+
+    def refresh_relations(completer, executor):
+        calls.append("relations")
+        completer.extend_relations(iter([("public", "a")]), kind="tables")
+
+    def refresh_views(completer, executor):
+        calls.append("views")
+        completer.extend_relations(iter([("public", "v")]), kind="views")
+
+    refresh_first.stage = 0
+    refresher.refreshers = {
+        "first": refresh_first,
+        "relations": refresh_relations,
+        "views": refresh_views,
+    }
+    pgexecute.acquire.return_value.round_trips = 0
+    refresher.refresh(
+        pgexecute, special, callbacks, settings={"refresh_concurrency": 2}
+    )
+    time.sleep(1)  # Wait for the thread to work.
+
+    assert callbacks[0].call_count == 1
+    assert calls[0] == "first"
+    assert sorted(calls[1:]) == ["relations", "views"]
+    completer = callbacks[0].call_args[0][0]
+    assert "a" in completer.dbmetadata["tables"]["public"]
+    assert "v" in completer.dbmetadata["views"]["public"]
+    assert refresher.refresher_stats["relations"].rows == 1
+
+
+def test_late_cancel_is_retried_in_parallel_refresh(refresher):
+    """
+    A cancel meant for a restarted refresh can hit the next query of any
+    pooled executor, which must not stop the refresh.
+    :param refresher:
+    """
+    from psycopg2.extensions import QueryCanceledError
+
+    callbacks = [Mock()]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    pgexecute.acquire.return_value.round_trips = 0
+    cancels = [QueryCanceledError()]
+
+    def refresh_relations(completer, executor):
+        if cancels:
+            raise cancels.pop()
+        completer.extend_schemata(["public"])
+        completer.extend_relations(iter([("public", "a")]), kind="tables")
+
+    def refresh_views(completer, executor):
+        time.sleep(0.1)
+
+    refresher.refreshers = {"relations": refresh_relations, "views": refresh_views}
+    refresher.refresh(pgexecute, Mock(), callbacks, settings={"refresh_concurrency": 2})
+    time.sleep(1)  # Wait for the thread to work.
+
+    completer = callbacks[0].call_args[0][0]
+    assert "a" in completer.dbmetadata["tables"]["public"]
+    assert refresher.restart_count == 0
+
+
+def test_executors_are_released_when_a_refresh_fails(refresher):
+    """
+    :param refresher:
+    """
+    callbacks = [Mock()]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    pgexecute.acquire.side_effect = lambda: Mock(round_trips=0)
+
+    def refresh_failing(completer, executor):
+        time.sleep(0.1)
+        raise ValueError()
+
+    def refresh_views(completer, executor):
+        time.sleep(0.1)
+
+    refresher.refreshers = {"failing": refresh_failing, "views": refresh_views}
+    refresher.refresh(pgexecute, Mock(), callbacks, settings={"refresh_concurrency": 2})
+    time.sleep(1)  # Wait for the thread to work.
+
+    callbacks[0].assert_not_called()
+    assert pgexecute.release.call_count == pgexecute.acquire.call_count == 2
+
+
+def test_partial_snapshots_are_published(refresher):
+    """
+    A snapshot of the completer must be published after each stage but the
+    last, and must not change as the refresh goes on.
+    :param refresher:
+    """
+    callbacks = [Mock()]
+    partial_callbacks = [Mock()]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    pgexecute.acquire.return_value.round_trips = 0
+    special = Mock()
+
+    def refresh_schemata(completer, executor):
+        completer.extend_schemata(["public"])
+
+    def refresh_relations(completer, executor):
+        completer.extend_relations([("public", "a")], kind="tables")
+
+    def refresh_columns(completer, executor):
+        completer.extend_columns(
+            [("public", "a", "x", "int", False, None)], kind="tables"
+        )
+
+    refresh_schemata.stage = 0
+    refresh_columns.stage = 2
+    refresher.refreshers = {
+        "columns": refresh_columns,
+        "relations": refresh_relations,
+        "schemata": refresh_schemata,
+    }
+    refresher.refresh(
+        pgexecute, special, callbacks, partial_callbacks=partial_callbacks
+    )
+    time.sleep(1)  # Wait for the thread to work.
+
+    snapshots = [c[0][0] for c in partial_callbacks[0].call_args_list]
+    assert len(snapshots) == 2
+    assert snapshots[0].dbmetadata["tables"] == {"public": {}}
+    assert list(snapshots[1].dbmetadata["tables"]["public"]) == ["a"]
+    assert not snapshots[1].dbmetadata["tables"]["public"]["a"]
+    completer = callbacks[0].call_args[0][0]
+    assert list(completer.dbmetadata["tables"]["public"]["a"]) == ["x"]
+
+
+def test_incremental_refresh(refresher):
+    """
+    Only added or changed relations should have their columns fetched, and
+    dropped relations should be removed from the completer.
+    :param refresher:
+    """
+    from threading import Lock
+    from mzcli.pgcompleter import PGCompleter
+
+    completer = PGCompleter()
+    completer.extend_schemata(["public"])
+    completer.extend_relations([("public", "old"), ("public", "kept")], "tables")
+    completer.catalog_relations = {
+        "u1": ("public", "old", "tables"),
+        "u2": ("public", "kept", "tables"),
+    }
+    executor = Mock()
+    executor.search_path.return_value = ["public"]
+    executor.schemata.return_value = ["public"]
+    executor.catalog_relations.return_value = [
+        ("u2", "public", "kept", "table"),
+        ("u3", "public", "new", "view"),
+    ]
+    executor.relation_columns.return_value = [
+        ("public", "new", "x", "integer", False, None)
+    ]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    pgexecute.acquire.return_value = executor
+    callbacks = [Mock()]
+
+    refresher.refresh_incremental(pgexecute, completer, Lock(), callbacks)
+    time.sleep(1)  # Wait for the thread to work.
+
+    assert callbacks[0].call_count == 1
+    fetched = list(executor.relation_columns.call_args[0][0])
+    assert fetched == [("u3", "public", "new")]
+    assert "old" not in completer.dbmetadata["tables"]["public"]
+    assert "kept" in completer.dbmetadata["tables"]["public"]
+    assert list(completer.dbmetadata["views"]["public"]["new"]) == ["x"]
+    assert set(completer.catalog_relations) == {"u2", "u3"}
+
+
+def test_incremental_refresh_keeps_columns_lazy(refresher):
+    """
+    With lazy_columns, added relations have their columns fetched when they
+    are first needed instead.
+    :param refresher:
+    """
+    from threading import Lock
+    from mzcli.pgcompleter import PGCompleter
+
+    completer = PGCompleter(settings={"lazy_columns": True})
+    completer.extend_schemata(["public"])
+    completer.catalog_relations = {}
+    executor = Mock()
+    executor.search_path.return_value = ["public"]
+    executor.schemata.return_value = ["public"]
+    executor.catalog_relations.return_value = [("u1", "public", "new", "view")]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    pgexecute.acquire.return_value = executor
+    callbacks = [Mock()]
+
+    refresher.refresh_incremental(pgexecute, completer, Lock(), callbacks)
+    time.sleep(1)  # Wait for the thread to work.
+
+    assert callbacks[0].call_count == 1
+    executor.relation_columns.assert_not_called()
+    assert "new" in completer.dbmetadata["views"]["public"]
+
+
+def test_refresh_is_queued_behind_an_update(refresher):
+    """
+    A refresh started while an in-place update runs must not wait for it on
+    the calling thread, it runs once the update completes.
+    :param refresher:
+    """
+    from threading import Event, Lock
+    from mzcli.pgcompleter import PGCompleter
+    from mzcli.packages.parseutils.ddl import DdlChange
+
+    updating = Event()
+    executor = Mock()
+
+    def named_relation_columns(schema, name):
+        updating.wait(2)
+        return []
+
+    executor.named_relation_columns.side_effect = named_relation_columns
+    executor.catalog_relations.return_value = []
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    pgexecute.acquire.return_value = executor
+    executor.round_trips = 0
+    refresher.refreshers = {}
+    update_callbacks = [Mock()]
+    refresher.refresh_objects(
+        pgexecute,
+        PGCompleter(),
+        Lock(),
+        [DdlChange("create", "views", None, "v")],
+        update_callbacks,
+    )
+    callbacks = [Mock()]
+    start = time.time()
+    result = refresher.refresh(pgexecute, Mock(), callbacks)
+    assert time.time() - start < 1
+    assert result[0][3] == "Auto-completion refresh queued."
+    callbacks[0].assert_not_called()
+
+    updating.set()
+    time.sleep(1)  # Wait for the thread to work.
+
+    assert update_callbacks[0].call_count == 1
+    assert callbacks[0].call_count == 1
+    assert not refresher.is_refreshing()
+
+
+def test_cancelled_catalog_snapshot_is_retried(refresher):
+    """
+    A cancel meant for a restarted refresh can hit the catalog snapshot of
+    the next run, which must not disable incremental refreshes.
+    :param refresher:
+    """
+    from psycopg2.extensions import QueryCanceledError
+
+    callbacks = [Mock()]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    executor = pgexecute.acquire.return_value
+    executor.round_trips = 0
+    executor.catalog_relations.side_effect = [
+        QueryCanceledError(),
+        [("u1", "public", "a", "table")],
+    ]
+    refresher.refreshers = {}
+
+    refresher.refresh(pgexecute, Mock(), callbacks)
+    time.sleep(1)  # Wait for the thread to work.
+
+    completer = callbacks[0].call_args[0][0]
+    assert completer.catalog_relations == {"u1": ("public", "a", "tables")}
+
+
+def test_refresh_objects(refresher):
+    """
+    Created objects should have their columns fetched by name, dropped and
+    renamed objects should be updated without querying the catalog.
+    :param refresher:
+    """
+    from threading import Lock
+    from mzcli.pgcompleter import PGCompleter
+    from mzcli.packages.parseutils.ddl import DdlChange
+
+    completer = PGCompleter()
+    completer.set_search_path(["public"])
+    completer.extend_schemata(["public"])
+    completer.extend_relations([("public", "dropped"), ("public", "a")], "tables")
+    executor = Mock()
+    executor.named_relation_columns.return_value = [
+        ("public", "v", "x", "integer", False, None)
+    ]
+    pgexecute = Mock(**{"is_virtual_database.return_value": False})
+    pgexecute.acquire.return_value = executor
+    callbacks = [Mock()]
+    changes = [
+        DdlChange("create", "views", None, "v"),
+        DdlChange("drop", "tables", None, "dropped"),
+        DdlChange("rename", "tables", "public", "a", "b"),
+    ]
+
+    refresher.refresh_objects(pgexecute, completer, Lock(), changes, callbacks)
+    time.sleep(1)  # Wait for the thread to work.
+
+    assert callbacks[0].call_count == 1
+    executor.named_relation_columns.assert_called_once_with(None, "v")
+    assert list(completer.dbmetadata["views"]["public"]["v"]) == ["x"]
+    assert set(completer.dbmetadata["tables"]["public"]) == {"b"}
@@ -0,0 +1,111 @@
+import threading
+import time
+from unittest.mock import MagicMock, Mock, patch
+
+import psycopg2
+
+from mzcli.live_view import ConsolidatedView, LiveView
+from mzcli.pgexecute import SubscribeCursor
+from mzcli.update_buffer import UpdateBuffer
+
+HEADERS = ["mz_timestamp", "mz_diff", "id", "name"]
+
+
+def test_apply_consolidates_updates():
+    view = ConsolidatedView(HEADERS)
+    view.apply([(1, 1, 2, "b"), (1, 1, 1, "a"), (1, 2, 3, "c")])
+
+    assert view.headers == ["id", "name"]
+    assert view.rows() == (
+        [(1, "a"), (2, "b"), (3, "c"), (3, "c")],
+        {(1, "a"), (2, "b"), (3, "c")},
+    )
+
+    view.apply([(2, -1, 3, "c"), (2, -1, 1, "a"), (2, 1, 1, "z")])
+
+    assert view.timestamp == 2
+    assert view.updates == 6
+    assert view.rows() == (
+        [(1, "z"), (2, "b"), (3, "c")],
+        {(1, "a"), (1, "z"), (3, "c")},
+    )
+    # Nothing changed since the previous call
+    assert view.rows() == ([(1, "z"), (2, "b"), (3, "c")], set())
+
+
+def test_apply_orders_updates_by_timestamp():
+    view = ConsolidatedView(HEADERS)
+    # The retraction at timestamp 3 comes after the insertion at timestamp 2
+    view.apply([(3, -1, 1, "a"), (2, 1, 1, "a"), (2, 1, 2, "b")])
+
+    assert view.timestamp == 3
+    assert view.counts == {(2, "b"): 1}
+
+
+def test_rows_with_null_values():
+    view = ConsolidatedView(HEADERS)
+    view.apply([(1, 1, None, "a"), (1, 1, 1, None)])
+
+    assert view.rows()[0] == [(1, None), (None, "a")]
+
+
+def test_run_stops_an_idle_subscription():
+    conn = MagicMock(closed=0)
+    conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    cur = conn.cursor.return_value
+    cur.protocol_error = False
+    cur.description = [("mz_timestamp",), ("mz_diff",), ("id",), ("name",)]
+    cursor = SubscribeCursor(conn, "SUBSCRIBE t")
+    cursor.fetch_timeout = 0.01
+
+    def fetchall():
+        # Every FETCH times out without updates
+        time.sleep(cursor.fetch_timeout)
+        return []
+
+    cur.fetchall.side_effect = fetchall
+    assert cursor.open()
+    view = LiveView(cursor, HEADERS, Mock(), UpdateBuffer(HEADERS))
+
+    # Leave the view as soon as it starts
+    with patch.object(LiveView, "_create_application"):
+        thread = threading.Thread(target=view.run)
+        thread.start()
+        thread.join(2)
+
+    assert not thread.is_alive()
+    assert view.error is None
+    assert cur.execute.call_args[0][0] == "ROLLBACK"
+
+
+def test_progress_messages_are_left_out():
+    conn = MagicMock(closed=0)
+    conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    cur = conn.cursor.return_value
+    cur.protocol_error = False
+    cur.description = [
+        ("mz_timestamp",),
+        ("mz_progressed",),
+        ("mz_diff",),
+        ("id",),
+        ("name",),
+    ]
+    cur.fetchall.side_effect = [
+        [(1, False, 1, 1, "a"), (2, True, None, None, None), (2, False, 1, 2, "b")],
+        [],
+    ]
+    cursor = SubscribeCursor(conn, "SUBSCRIBE t WITH (PROGRESS)")
+    assert cursor.open()
+    view = LiveView(cursor, HEADERS, Mock(), UpdateBuffer(HEADERS))
+    view._app = Mock()
+
+    view._read()
+    view.view.apply(view.buffer.get())
+
+    assert view.error is None
+    # The update of the timestamp that wasn't closed isn't shown yet
+    assert view.view.rows()[0] == [(1, "a")]
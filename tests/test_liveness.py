@@ -0,0 +1,92 @@
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import psycopg2
+
+from mzcli.liveness import LivenessMonitor
+
+
+def test_check_reconnects_broken_connections():
+    pgexecute = Mock()
+    monitor = LivenessMonitor(lambda: pgexecute, 60, attempts=3, max_delay=5)
+
+    pgexecute.ping.return_value = False
+    assert monitor.check()
+    pgexecute.reconnect.assert_not_called()
+
+    with monitor.idle(), patch(
+        "mzcli.liveness.backoff_delays", return_value=[0, 0, None]
+    ) as delays:
+        pgexecute.ping.return_value = True
+        assert monitor.check()
+        pgexecute.reconnect.assert_not_called()
+
+        pgexecute.ping.return_value = False
+        assert monitor.check()
+        pgexecute.reconnect.assert_called_once_with()
+        assert monitor.reconnect_count == 1
+        delays.assert_called_with(3, max_delay=5)
+
+        pgexecute.reconnect.side_effect = psycopg2.OperationalError()
+        assert not monitor.check()
+        assert pgexecute.reconnect.call_count == 4
+        assert monitor.reconnect_count == 1
+
+
+def test_leaving_idle_isnt_blocked_by_the_backoff():
+    pgexecute = Mock()
+    pgexecute.ping.return_value = False
+    reconnecting = threading.Event()
+
+    def reconnect():
+        reconnecting.set()
+        raise psycopg2.OperationalError()
+
+    pgexecute.reconnect.side_effect = reconnect
+    monitor = LivenessMonitor(lambda: pgexecute, 60, attempts=5, max_delay=30)
+    checks = []
+
+    with patch("mzcli.liveness.backoff_delays", return_value=[10, 10, None]):
+        with monitor.idle():
+            checker = threading.Thread(target=lambda: checks.append(monitor.check()))
+            checker.start()
+            assert reconnecting.wait(1)
+        start = time.time()
+        # The next command would run here
+        assert time.time() - start < 1
+        monitor.stop()
+        checker.join(1)
+
+    assert not checker.is_alive()
+    assert checks == [False]
+    assert pgexecute.reconnect.call_count == 1
+
+
+def test_connection_is_only_checked_while_idle():
+    pgexecute = Mock()
+    pgexecute.ping.return_value = True
+    monitor = LivenessMonitor(lambda: pgexecute, 0.01)
+    monitor.start()
+    try:
+        with monitor.idle():
+            while not pgexecute.ping.called:
+                monitor._stop.wait(0.01)
+        pings = pgexecute.ping.call_count
+        monitor._stop.wait(0.05)
+        assert pgexecute.ping.call_count == pings
+    finally:
+        monitor.stop()
+
+
+def test_idle_pooled_connections_are_evicted_periodically():
+    pgexecute = Mock()
+    evicted = threading.Event()
+    pgexecute.evict_idle.side_effect = evicted.set
+    monitor = LivenessMonitor(lambda: pgexecute, 0.01)
+
+    monitor.start()
+    try:
+        assert evicted.wait(1)
+    finally:
+        monitor.stop()
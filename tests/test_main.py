@@ -1,5 +1,7 @@
 import os
 import platform
+import threading
+from time import sleep
 from unittest import mock
 
 import pytest
@@ -16,11 +18,21 @@ from mzcli.main import (
     OutputSettings,
     COLOR_CODE_REGEX,
 )
-from mzcli.pgexecute import PGExecute
+from mzcli.pgexecute import FetchedRows, PGExecute, StreamingCursor, SubscribeCursor
+from mzcli.timing import StatementTiming
+from mzcli.update_buffer import UpdateBuffer
 from pgspecial.main import PAGER_OFF, PAGER_LONG_OUTPUT, PAGER_ALWAYS
 from utils import dbtest, run, mz_xfail
 from collections import namedtuple
 
+# Connection parameters added from the default configuration
+KEEPALIVES = {
+    "keepalives": 1,
+    "keepalives_idle": 30,
+    "keepalives_interval": 10,
+    "keepalives_count": 3,
+}
+
 
 @pytest.mark.skipif(platform.system() == "Windows", reason="Not applicable in windows")
 @pytest.mark.skipif(not setproctitle, reason="setproctitle not available")
@@ -104,6 +116,248 @@ def test_format_output_truncate_off():
     assert lines[3] == f"| {long_field_value} |"
 
 
+def test_format_output_continued_batch():
+    settings = OutputSettings(table_format="csv", dcmlfmt="d", floatfmt="g")
+    results = format_output(None, [("abc", "def")], ["head1", "head2"], None, settings)
+    assert list(results) == ['"head1","head2"', '"abc","def"']
+    results = format_output(
+        None, [("ghi", "jkl")], ["head1", "head2"], None, settings, offset=1
+    )
+    assert list(results) == ['"ghi","jkl"']
+
+    settings = OutputSettings(table_format="vertical", dcmlfmt="d", floatfmt="g")
+    results = format_output(None, [("abc",)], ["head1"], None, settings, offset=5)
+    assert list(results)[0].startswith("-[ RECORD 6 ]")
+
+
+def test_output_stream_applies_row_limit():
+    cli = PGCli(row_limit=3)
+    cur = mock.Mock(rows=4, timing=StatementTiming())
+    cur.batches.return_value = iter([[(1,), (2,)], [(3,), (4,)]])
+    settings = OutputSettings(table_format="csv", dcmlfmt="d", floatfmt="g")
+
+    with mock.patch.object(cli, "_echo_stream") as echo:
+        echo.side_effect = lambda chunks: echo.chunks.extend(chunks)
+        echo.chunks = []
+        status = cli._output_stream(None, cur, ["n"], "select n from t", settings)
+
+    assert echo.chunks == ['"n"\n"1"\n"2"\n', '"3"\n']
+    assert status == "SELECT 3"
+    assert cur.timing.format > 0
+    cur.close.assert_called_once_with()
+
+
+def test_streamed_results_are_printed_in_order():
+    cli = PGCli()
+    cli.pgexecute = mock.Mock(timing=None)
+    cur = mock.Mock(spec=StreamingCursor, timing=StatementTiming())
+    cli.pgexecute.run.return_value = [
+        (None, None, None, "SET", "set a = 1", True, False),
+        (None, cur, ["n"], None, "select n from t", True, False),
+        (None, None, None, "SET", "set b = 1", True, False),
+    ]
+    printed = []
+
+    with mock.patch.object(
+        cli, "echo_via_pager", side_effect=printed.append
+    ), mock.patch.object(cli, "_output_stream", lambda *args: printed.append("n")):
+        output, query = cli._evaluate_command("set a = 1; select n from t; set b = 1")
+
+    assert printed == ["SET", "n"]
+    assert output == ["SET"]
+
+
+def test_output_subscribe_stops_on_ctrl_c():
+    cli = PGCli()
+    cur = mock.Mock()
+
+    def batches():
+        yield [(1, 1, "a")]
+        raise KeyboardInterrupt()
+
+    cur.batches.side_effect = batches
+    settings = OutputSettings(table_format="csv", dcmlfmt="d", floatfmt="g")
+    cli.pgspecial.pager_config = PAGER_OFF
+
+    with mock.patch("click.echo") as echo, mock.patch("click.secho") as secho:
+        cli._output_subscribe(None, cur, ["mz_timestamp", "mz_diff", "c"], settings, [])
+
+    echo.assert_called_once_with(
+        '"mz_timestamp","mz_diff","c"\n"1","1","a"\n', nl=False
+    )
+    secho.assert_called_once_with("Subscription stopped after 1 updates", fg="red")
+    cur.close.assert_called_once_with()
+
+
+def test_subscribe_updates_are_written_to_the_output_file(tmpdir, capsys):
+    cli = PGCli()
+    cli.table_format = "csv"
+    cli.output_file = str(tmpdir.join("output.txt"))
+    cli.pgexecute = mock.Mock(timing=None)
+    cur = mock.Mock(spec=SubscribeCursor)
+
+    def batches():
+        yield [(1, 1, "a")]
+        yield [(2, -1, "a")]
+        raise KeyboardInterrupt()
+
+    cur.batches.side_effect = batches
+    cli.pgexecute.run.return_value = [
+        (None, cur, ["mz_timestamp", "mz_diff", "c"], None, "subscribe t", True, False)
+    ]
+
+    cli.execute_command("subscribe t")
+
+    assert '"a"' not in capsys.readouterr().out
+    with open(cli.output_file) as f:
+        assert f.read().splitlines() == [
+            "subscribe t",
+            '"mz_timestamp","mz_diff","c"',
+            '"1","1","a"',
+            '"2","-1","a"',
+            "",
+        ]
+    cur.close.assert_called_once_with()
+
+
+def test_output_subscribe_stops_an_idle_subscription_on_ctrl_c():
+    cli = PGCli()
+    cur = mock.Mock()
+
+    def batches():
+        # Every FETCH times out without updates
+        while True:
+            sleep(0.01)
+            yield []
+
+    cur.batches.side_effect = batches
+    settings = OutputSettings(table_format="csv", dcmlfmt="d", floatfmt="g")
+
+    def output():
+        with mock.patch.object(
+            UpdateBuffer, "get", side_effect=KeyboardInterrupt
+        ), mock.patch("click.secho"):
+            cli._output_subscribe(None, cur, ["mz_timestamp", "mz_diff"], settings, [])
+
+    thread = threading.Thread(target=output)
+    thread.start()
+    thread.join(2)
+    assert not thread.is_alive()
+    cur.close.assert_called_once_with()
+
+
+def test_consolidated_updates_are_never_dropped():
+    cli = PGCli()
+    cli.stream_overflow = "drop"
+    headers = ["mz_timestamp", "mz_diff", "c"]
+
+    assert cli._update_buffer(headers).policy == "drop"
+    assert cli._update_buffer(headers, consolidated=True).policy == "coalesce"
+
+
+def test_watch_subscribe_prints_current_result():
+    cli = PGCli()
+    cli.pgexecute = mock.Mock()
+    cur = cli.pgexecute.subscribe.return_value
+    cur.description = [("mz_timestamp",), ("mz_progressed",), ("mz_diff",), ("c",)]
+    cur.snapshot_complete = True
+
+    def batches():
+        yield [(1, 1, "a"), (1, 1, "b")]
+        yield [(2, -1, "a")]
+
+    cur.consistent_batches.side_effect = batches
+
+    with mock.patch("click.echo") as echo:
+        query = cli._watch_subscribe("SELECT c FROM t", 0.01)
+
+    cli.pgexecute.subscribe.assert_called_once_with("SELECT c FROM t")
+    assert query.successful
+    # Snapshots are only printed again when they change
+    outputs = [COLOR_CODE_REGEX.sub("", call[0][0]) for call in echo.call_args_list]
+    snapshots = [output for output in outputs if "SELECT" in output]
+    assert snapshots[-1].splitlines() == [
+        "+---+",
+        "| c |",
+        "|---|",
+        "| b |",
+        "+---+",
+        "SELECT 1",
+    ]
+    cur.close.assert_called_once_with()
+
+
+def test_watch_subscribe_polls_sorted_results():
+    cli = PGCli()
+    cli.pgexecute = mock.Mock()
+
+    assert cli._watch_subscribe("SELECT c FROM t ORDER BY c", 1) is None
+    cli.pgexecute.subscribe.assert_not_called()
+
+
+def test_watch_subscribe_stops_an_idle_subscription_on_ctrl_c():
+    cli = PGCli()
+    cli.pgexecute = mock.Mock()
+    cur = cli.pgexecute.subscribe.return_value
+    cur.description = [("mz_timestamp",), ("mz_progressed",), ("mz_diff",), ("c",)]
+    cur.snapshot_complete = True
+
+    def batches():
+        # Every FETCH times out without updates
+        while True:
+            sleep(0.01)
+            yield []
+
+    cur.consistent_batches.side_effect = batches
+
+    def watch():
+        with mock.patch.object(UpdateBuffer, "get", side_effect=KeyboardInterrupt):
+            watch.query = cli._watch_subscribe("SELECT c FROM t", 1)
+
+    thread = threading.Thread(target=watch)
+    thread.start()
+    thread.join(2)
+    assert not thread.is_alive()
+    assert watch.query.successful
+    cur.close.assert_called_once_with()
+
+
+def test_watch_output_skips_unchanged_results():
+    cli = PGCli()
+    cli._watch_results = {}
+    headers = ["c"]
+
+    assert cli._watch_output(0, iter([(1,), (2,)]), headers, "SELECT 2") == (
+        [(1,), (2,)],
+        headers,
+        "SELECT 2",
+    )
+    assert cli._watch_output(0, iter([(1,), (2,)]), headers, "SELECT 2") == (
+        None,
+        headers,
+        "No changes",
+    )
+    # Results of other statements are compared separately
+    assert cli._watch_output(1, iter([(1,)]), headers, "SELECT 1")[0] == [(1,)]
+
+    cli.watch_diff = True
+    cli._watch_results = {}
+    cli._watch_output(0, iter([(1,), (2,)]), headers, "SELECT 2")
+    assert cli._watch_output(0, iter([(2,), (3,)]), headers, "SELECT 2") == (
+        [("+", 3), ("-", 1)],
+        ["", "c"],
+        "1 rows added, 1 rows removed",
+    )
+
+
+def test_watch_subscribe_falls_back_to_polling():
+    cli = PGCli()
+    cli.pgexecute = mock.Mock()
+    cli.pgexecute.subscribe.return_value = None
+
+    assert cli._watch_subscribe("SHOW CLUSTERS", 1) is None
+
+
 @dbtest
 @mz_xfail("casting from integer to bigint?")
 def test_format_array_output(executor):
@@ -304,6 +558,7 @@ def test_i_works(tmpdir, executor):
 @dbtest
 def test_watch_works(executor):
     cli = PGCli(pgexecute=executor)
+    cli.watch_mode = "poll"
 
     def run_with_watch(
         query, target_call_count=1, expected_output="", expected_timing=None
@@ -326,8 +581,10 @@ def test_watch_works(executor):
             assert mock_sleep.call_args_list[i][0][0] == expected_timing
         # Validate that the output of the query was expected
         assert mock_echo.call_count == target_call_count
-        for i in range(target_call_count):
-            assert expected_output in mock_echo.call_args_list[i][0][0]
+        assert expected_output in mock_echo.call_args_list[0][0][0]
+        # The result doesn't change, so it is only printed once
+        for i in range(1, target_call_count):
+            assert "No changes" in mock_echo.call_args_list[i][0][0]
 
     # With no history, it errors.
     with mock.patch("pgcli.main.click.secho") as mock_secho:
@@ -422,6 +679,7 @@ def test_pg_service_file(tmpdir):
         "5435",
         "",
         application_name="pgcli",
+        **KEEPALIVES,
     )
     del os.environ["PGPASSWORD"]
     del os.environ["PGSERVICEFILE"]
@@ -476,5 +734,156 @@ def test_application_name_db_uri(tmpdir):
         cli = PGCli(mzclirc_file=str(tmpdir.join("rcfile")))
         cli.connect_uri("postgres://bar@baz.com/?application_name=cow")
     mock_pgexecute.assert_called_with(
-        "materialize", "bar", "", "baz.com", "6875", "", application_name="cow"
+        "materialize",
+        "bar",
+        "",
+        "baz.com",
+        "6875",
+        "",
+        application_name="cow",
+        **KEEPALIVES,
     )
+
+
+def test_refresh_stats_command():
+    from mzcli.completion_refresher import RefresherStats
+
+    cli = PGCli()
+    refresher = cli.completion_refresher
+    refresher.refresher_stats["tables"] = RefresherStats("tables", 0.5, 10, 2)
+    refresher.refresh_count = 1
+    refresher.last_refresh_seconds = 0.75
+
+    [(title, rows, headers, status)] = cli.refresh_command("stats")
+    assert rows == [("tables", "0.500", 10, 2)]
+    assert headers == ["refresher", "seconds", "rows", "round trips"]
+    assert status == "1 refreshes, 0 restarts, last refresh took 0.750s"
+
+
+def test_connect_sets_keepalives():
+    cli = PGCli()
+    with mock.patch("mzcli.main.PGExecute") as pgexecute:
+        cli.connect("db", "host", "user", "6875", "passwd")
+    assert KEEPALIVES.items() <= pgexecute.call_args[1].items()
+
+    with mock.patch("mzcli.main.PGExecute") as pgexecute:
+        cli.connect(dsn="host=h keepalives=0", passwd="passwd")
+    assert "keepalives_idle" not in pgexecute.call_args[1]
+
+
+def test_execute_command_reports_statement_timings(capsys):
+    cli = PGCli()
+    cli.pgexecute = mock.Mock()
+    cli.pgexecute.timing = timing = StatementTiming("select 1")
+    cli.pgexecute.run.return_value = [
+        (
+            None,
+            FetchedRows([(1,)], [], 1, "SELECT 1"),
+            ["a"],
+            "SELECT 1",
+            "select 1",
+            True,
+            False,
+        )
+    ]
+    cli.pgspecial.timing_enabled = True
+    cli.destructive_warning = "off"
+    hook = mock.Mock()
+    cli.timing_hooks.append(hook)
+    clock = iter(range(100))
+
+    with mock.patch("mzcli.timing.time", lambda: next(clock)), mock.patch.object(
+        cli, "echo_via_pager", return_value=False
+    ):
+        query = cli.execute_command("select 1")
+
+    hook.assert_called_once_with(timing)
+    assert query.timings == [timing]
+    assert timing.rows == 1
+    assert (timing.typecast, timing.format) == (1, 1)
+    assert "typecast: 1.000s, format: 1.000s" in capsys.readouterr().out
+    [row] = cli.session_stats.rows()
+    assert row[:3] == ("select ?", 1, 1)
+
+
+def test_pager_time_is_not_statement_time():
+    cli = PGCli()
+    cli.pgexecute = mock.Mock()
+    cli.pgexecute.timing = timing = StatementTiming("select 1")
+    cli.pgexecute.run.return_value = [
+        (
+            None,
+            FetchedRows([(1,)], [], 1, "SELECT 1"),
+            ["a"],
+            "SELECT 1",
+            "select 1",
+            True,
+            False,
+        )
+    ]
+    cli.destructive_warning = "off"
+
+    def read_in_pager(text):
+        sleep(0.05)
+        return True
+
+    with mock.patch.object(cli, "echo_via_pager", side_effect=read_in_pager):
+        query = cli.execute_command("select 1")
+
+    assert timing.pager >= 0.05
+    assert timing.total < 0.05
+    assert query.total_time < 0.05
+
+
+def test_special_commands_are_timed():
+    cli = PGCli()
+    cli.pgexecute = mock.Mock(timing=None)
+
+    def run(*args, **kwargs):
+        sleep(0.05)
+        yield None, None, None, "done", "\\dt", True, True
+
+    cli.pgexecute.run.side_effect = run
+
+    output, query = cli._evaluate_command("\\dt")
+
+    [timing] = query.timings
+    assert timing.special
+    assert timing.execute >= 0.05
+    assert query.execution_time >= 0.05
+
+
+def test_slow_query_log_is_disabled_by_default():
+    cli = PGCli()
+    assert cli.slow_query_log is None
+
+
+def test_stats_command(tmpdir):
+    cli = PGCli()
+    for seconds in (1, 3):
+        timing = StatementTiming("select  1")
+        timing.execute = seconds
+        cli.session_stats.record(timing)
+    special = StatementTiming("\\dt")
+    special.special = True
+    cli.session_stats.record(special)
+
+    [(title, rows, headers, status)] = cli.stats_command("")
+    assert rows == [
+        ("select ?", 2, 0, "1.000", "1.000", "2.974", "2.974", "3.000", "4.000")
+    ]
+    assert headers[:4] == ["query", "count", "rows", "min"]
+    assert status == "1 queries, latencies in seconds"
+
+    filename = str(tmpdir.join("stats.csv"))
+    [(_, _, _, message)] = cli.stats_command("csv %s" % filename)
+    assert message == 'Wrote statistics of 1 queries to "%s"' % filename
+    with open(filename) as f:
+        assert f.readline().strip() == "query,count,rows,min,p50,p95,p99,max,total"
+
+    [(_, _, _, message)] = cli.stats_command("reset")
+    assert message == "Query statistics reset"
+    assert list(cli.session_stats.rows()) == []
+
+    [result] = cli.stats_command("csv")
+    assert result[-1] is True
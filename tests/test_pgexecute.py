@@ -2,7 +2,7 @@ from textwrap import dedent
 
 import psycopg2
 import pytest
-from unittest.mock import patch, MagicMock
+from unittest.mock import call, patch, MagicMock
 from pgspecial.main import PGSpecial, NO_QUERY
 from utils import run, dbtest, mz_skip, mz_xfail, requires_json, requires_jsonb
 
@@ -151,6 +151,15 @@ def test_schemata_table_views_and_columns_query(executor, extra_executor):
     assert not (expected_extra_tables & default_tables)
 
 
+@dbtest
+def test_bulk_columns_match_show_columns(executor):
+    run(executor, "create table a(x text, y int)")
+    run(executor, "create view d as select 1 as e, 'f' as f")
+
+    kinds = ["r", "v", "m"]
+    assert set(executor._columns(kinds)) == set(executor._show_columns(kinds))
+
+
 @dbtest
 @mz_xfail("key constraints")
 def test_foreign_key_query(executor):
@@ -605,3 +614,501 @@ def test_virtual_database(executor):
     with patch.object(executor, "conn", virtual_connection):
         result = run(executor, "select 1")
         assert "Command not supported" in result
+
+
+def pooled_executor():
+    executor = MagicMock()
+    executor.conn.closed = 0
+    executor.conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    return executor
+
+
+def test_executor_pool_reuses_released_executors():
+    from mzcli.pgexecute import ExecutorPool
+
+    pgexecute = MagicMock()
+    pgexecute.copy.side_effect = lambda: pooled_executor()
+    pool = ExecutorPool(pgexecute, max_idle=1)
+
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second
+    pool.release(first)
+    pool.release(second)
+    # Only max_idle executors are kept open
+    assert pool.idle_count() == 1
+    second.conn.close.assert_called_once_with()
+    assert pool.acquire() is first
+    assert pgexecute.copy.call_count == 2
+
+
+def test_executor_pool_discards_unusable_executors():
+    from mzcli.pgexecute import ExecutorPool
+
+    pgexecute = MagicMock()
+    pgexecute.copy.side_effect = lambda: pooled_executor()
+    pool = ExecutorPool(pgexecute, idle_timeout=60, check_after=0)
+
+    in_transaction = pool.acquire()
+    in_transaction.conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    )
+    pool.release(in_transaction)
+    assert pool.idle_count() == 0
+
+    # Executors failing the health check are replaced
+    broken = pool.acquire()
+    pool.release(broken)
+    broken.conn.cursor.side_effect = psycopg2.OperationalError("gone")
+    assert pool.acquire() is not broken
+    broken.conn.close.assert_called_once_with()
+
+    # Executors acquired before the pool was cleared aren't reused
+    stale = pool.acquire()
+    pool.clear()
+    pool.release(stale)
+    assert pool.idle_count() == 0
+
+    # Executors idle for longer than idle_timeout are closed
+    now = [0]
+    with patch("mzcli.pgexecute.time", lambda: now[0]):
+        expired = pool.acquire()
+        pool.release(expired)
+        now[0] = 61
+        assert pool.acquire() is not expired
+    expired.conn.close.assert_called_once_with()
+
+
+def test_executor_pool_evicts_idle_executors_while_unused():
+    from mzcli.pgexecute import ExecutorPool
+
+    pool = ExecutorPool(MagicMock(), idle_timeout=60)
+    expired, recent = pooled_executor(), pooled_executor()
+    now = [0]
+    with patch("mzcli.pgexecute.time", lambda: now[0]):
+        pool._idle = [(expired, 0), (recent, 30)]
+        now[0] = 61
+        pool.evict()
+
+    assert pool.idle_count() == 1
+    expired.conn.close.assert_called_once_with()
+    recent.conn.close.assert_not_called()
+
+
+def test_bootstrap_caches_type_oids(tmp_path):
+    from mzcli import pgexecute as pgexecute_module
+    from mzcli.pgexecute import PGExecute
+
+    executor = PGExecute.__new__(PGExecute)
+    executor.host = "localhost"
+    executor.port = "6875"
+    executor.dbname = "materialize"
+    executor.server_version = "9.5.0"
+    executor.mz_version = "v0.26.0 (8f4c2b1a)"
+    cur = MagicMock(protocol_error=False)
+    cur.description = [("date", 1082), ("timestamp", 1114), ("timestamptz", 1184)]
+    cur.fetchone.return_value = (None, None, None, 114, 199, 3802, 3807, None)
+    executor.conn = MagicMock(closed=0)
+    executor.conn.cursor.return_value.__enter__.return_value = cur
+    expected = {
+        "date": [1082, 1114, 1184],
+        "json": [114, 199],
+        "jsonb": [3802, 3807],
+        "hstore": None,
+    }
+
+    cache_file = str(tmp_path / "type_oids.json")
+    with patch.object(pgexecute_module, "_type_oid_cache_file", cache_file):
+        assert executor._bootstrap() == expected
+        assert cur.execute.call_count == 1
+        assert not executor.is_virtual_database()
+
+        # The OIDs are cached per server version
+        assert executor._bootstrap() == expected
+        assert cur.execute.call_count == 1
+        executor.mz_version = "v0.27.0 (5e9a0c3d)"
+        executor._bootstrap()
+        assert cur.execute.call_count == 2
+
+        # Servers that don't report their version aren't cached
+        executor.mz_version = None
+        executor._bootstrap()
+        executor._bootstrap()
+        assert cur.execute.call_count == 4
+
+
+def test_bootstrap_detects_virtual_database():
+    from mzcli.pgexecute import PGExecute
+
+    executor = PGExecute.__new__(PGExecute)
+    executor.host = executor.port = executor.dbname = None
+    executor.server_version = ""
+    executor.mz_version = None
+    cur = MagicMock(protocol_error=True)
+    executor.conn = MagicMock(closed=0)
+    executor.conn.cursor.return_value.__enter__.return_value = cur
+
+    with patch("mzcli.pgexecute._type_oid_cache_file", None):
+        assert executor._bootstrap() is None
+    assert executor.is_virtual_database()
+    # The socket directory is only looked up when connecting over a socket
+    assert "unix_socket_directories" in cur.execute.call_args[0][0]
+
+
+def streaming_connection(rows, fetched):
+    conn = MagicMock(closed=0)
+    conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    cur = conn.cursor.return_value
+    cur.protocol_error = False
+
+    def execute(sql):
+        # The first FETCH is sent with BEGIN and DECLARE
+        sql = sql.split("; ")[-1]
+        if sql.startswith("FETCH"):
+            count = int(sql.split()[1])
+            start = sum(fetched)
+            fetched.append(len(rows[start : start + count]))
+            cur.fetchall.return_value = rows[start : start + count]
+
+    cur.execute.side_effect = execute
+    return conn
+
+
+def test_streaming_cursor_fetches_in_batches():
+    from mzcli.pgexecute import StreamingCursor
+
+    rows = [(i,) for i in range(250)]
+    fetched = []
+    conn = streaming_connection(rows, fetched)
+    cur = conn.cursor.return_value
+    stream = StreamingCursor(conn, "SELECT * FROM t", max_batch_size=150)
+
+    assert stream.open()
+    cur.execute.assert_called_once_with(
+        "BEGIN; DECLARE mzcli_stream CURSOR FOR SELECT * FROM t; "
+        "FETCH 100 mzcli_stream"
+    )
+    assert list(stream) == rows
+    # The batch size grows from 100 rows up to max_batch_size
+    assert fetched == [100, 150, 0]
+    assert stream.statusmessage == "SELECT 250"
+    assert cur.execute.call_args[0][0] == "ROLLBACK"
+
+
+def test_row_limit_is_enforced_at_fetch_time():
+    from mzcli.pgexecute import PGExecute
+
+    rows = [(i,) for i in range(5000)]
+    fetched = []
+    executor = PGExecute.__new__(PGExecute)
+    executor.conn = streaming_connection(rows, fetched)
+    executor.conn.notices = []
+    cur = executor.conn.cursor.return_value
+    cur.description = [("i",)]
+    cur.rowcount = 5000
+    cur.fetchmany.side_effect = lambda count: rows[:count]
+
+    # Only one more row than the limit, telling that there are more, is
+    # transferred, in a single round trip before the cursor is closed
+    title, result, headers, status = executor.execute_normal_sql(
+        "SELECT * FROM t", row_limit=1000
+    )
+    assert cur.execute.call_args_list == [
+        call(
+            "BEGIN; DECLARE mzcli_stream CURSOR FOR SELECT * FROM t; "
+            "FETCH 1001 mzcli_stream"
+        ),
+        call("ROLLBACK"),
+    ]
+    assert fetched == [1001]
+    assert result.rowcount == 1001
+    assert len(list(result)) == 1001
+
+    # Streamed results stop fetching after one more row than the limit
+    fetched[:] = []
+    title, result, headers, status = executor.execute_normal_sql(
+        "SELECT * FROM t", fetch_count=100, row_limit=1000
+    )
+    assert len(list(result)) == 1001
+    assert sum(fetched) == 1001
+    assert result.rowcount == 1001
+
+    # The LIMIT clause of the statement applies instead
+    fetched[:] = []
+    title, result, headers, status = executor.execute_normal_sql(
+        "SELECT * FROM t\nLIMIT\t2000", fetch_count=100, row_limit=1000
+    )
+    list(result)
+    assert sum(fetched) == 5000
+
+    # Unless it only limits a subquery
+    fetched[:] = []
+    title, result, headers, status = executor.execute_normal_sql(
+        "SELECT speed_limit FROM (SELECT * FROM t LIMIT 2000) t", row_limit=1000
+    )
+    assert fetched == [1001]
+
+    # In a user transaction, no cursor is declared, and only the rows that
+    # can be shown are converted
+    executor.conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    )
+    cur.execute.reset_mock()
+    title, result, headers, status = executor.execute_normal_sql(
+        "SELECT * FROM t", row_limit=1000
+    )
+    assert cur.execute.call_args_list == [call("SELECT * FROM t")]
+    cur.fetchmany.assert_called_once_with(1001)
+    assert result.rowcount == 5000
+    assert len(list(result)) == 1001
+
+
+def test_statement_that_cant_be_declared_runs_without_a_cursor():
+    from mzcli.pgexecute import PGExecute
+
+    executor = PGExecute.__new__(PGExecute)
+    executor.conn = conn = MagicMock(closed=0, notices=[])
+    conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    cur = conn.cursor.return_value
+    cur.protocol_error = False
+    cur.description = [("a",)]
+
+    def execute(sql):
+        if "DECLARE" in sql:
+            raise psycopg2.errors.FeatureNotSupported()
+
+    cur.execute.side_effect = execute
+
+    title, result, headers, status = executor.execute_normal_sql(
+        "SELECT 1", fetch_count=100
+    )
+    assert [c[0][0] for c in cur.execute.call_args_list] == [
+        "BEGIN; DECLARE mzcli_stream CURSOR FOR SELECT 1; FETCH 100 mzcli_stream",
+        "ROLLBACK",
+        "SELECT 1",
+    ]
+    assert headers == ["a"]
+
+    # The user's transaction is aborted, so the error is theirs
+    conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    )
+    cur.execute.side_effect = psycopg2.errors.FeatureNotSupported()
+    with pytest.raises(psycopg2.errors.FeatureNotSupported):
+        executor.execute_normal_sql("SUBSCRIBE t")
+
+
+def test_subscribe_cursor_reads_updates_until_done():
+    from mzcli.pgexecute import PGExecute, SubscribeCursor
+
+    updates = [[(1, 1, "a")], [], [(2, 1, "b"), (2, -1, "a")]]
+    executor = PGExecute.__new__(PGExecute)
+    executor.conn = conn = MagicMock(closed=0, notices=[])
+    conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    cur = conn.cursor.return_value
+    cur.protocol_error = False
+    cur.description = [("mz_timestamp",), ("mz_diff",), ("name",)]
+    # Seconds each FETCH waits: the empty batch times out, the last FETCH
+    # returns immediately because the subscription completed
+    waits = iter([0, 1, 0, 0])
+    now = [0]
+
+    def fetchall():
+        now[0] += next(waits)
+        return updates.pop(0) if updates else []
+
+    cur.fetchall.side_effect = fetchall
+
+    with patch("mzcli.pgexecute.time", lambda: now[0]):
+        title, stream, headers, status = executor.execute_normal_sql(
+            "SUBSCRIBE t", fetch_count=0
+        )
+        assert isinstance(stream, SubscribeCursor)
+        assert headers == ["mz_timestamp", "mz_diff", "name"]
+        assert "WITH (timeout = '1s')" in cur.execute.call_args[0][0]
+        assert list(stream.batches()) == [
+            [(1, 1, "a")],
+            [],
+            [(2, 1, "b"), (2, -1, "a")],
+        ]
+    assert cur.fetchall.call_count == 4
+    assert cur.execute.call_args[0][0] == "ROLLBACK"
+
+
+def test_subscribe_cursor_yields_closed_timestamps():
+    from mzcli.pgexecute import SubscribeCursor
+
+    cursor = SubscribeCursor(MagicMock(), "SUBSCRIBE t WITH (PROGRESS)")
+    cursor.description = [
+        ("mz_timestamp",),
+        ("mz_progressed",),
+        ("mz_diff",),
+        ("name",),
+    ]
+    # A snapshot split across batches, at timestamp 1
+    batches = [
+        [(1, True, None, None), (1, False, 1, "a")],
+        [(1, False, 1, "b")],
+        [(2, True, None, None), (2, False, -1, "a")],
+        [],
+        [(3, True, None, None)],
+    ]
+    snapshot_complete = []
+
+    def fake_batches():
+        for batch in batches:
+            snapshot_complete.append(cursor.snapshot_complete)
+            yield batch
+
+    with patch.object(cursor, "batches", fake_batches):
+        assert list(cursor.consistent_batches()) == [
+            [],
+            [],
+            [(1, 1, "a"), (1, 1, "b")],
+            [],
+            [(2, -1, "a")],
+        ]
+    assert snapshot_complete == [False, False, False, True, True]
+    assert cursor.frontier == 3
+
+
+def test_subscribe_to_a_single_select():
+    from mzcli.pgexecute import PGExecute
+
+    executor = PGExecute.__new__(PGExecute)
+    executor.conn = conn = MagicMock(closed=0, notices=[])
+    conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    cur = conn.cursor.return_value
+    cur.protocol_error = False
+    cur.fetchall.return_value = [(1, 1, 1)]
+
+    assert executor.subscribe("SELECT 1; SELECT 2") is None
+    assert executor.subscribe("SHOW CLUSTERS") is None
+    stream = executor.subscribe("SELECT 1;")
+    assert stream.sql == "SUBSCRIBE (SELECT 1) WITH (PROGRESS)"
+    assert cur.execute.call_args_list[1][0][0] == (
+        "DECLARE mzcli_stream CURSOR FOR SUBSCRIBE (SELECT 1) WITH (PROGRESS)"
+    )
+
+    cur.execute.side_effect = psycopg2.ProgrammingError()
+    assert executor.subscribe("SELECT 1") is None
+
+
+@pytest.mark.parametrize(
+    "status, error, closed, kept",
+    [
+        (psycopg2.extensions.TRANSACTION_STATUS_IDLE, None, 0, True),
+        (psycopg2.extensions.TRANSACTION_STATUS_INERROR, None, 0, True),
+        (
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+            psycopg2.OperationalError(),
+            0,
+            False,
+        ),
+        (psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN, None, 0, False),
+        (psycopg2.extensions.TRANSACTION_STATUS_IDLE, None, 1, False),
+    ],
+)
+def test_reset_after_cancel_keeps_healthy_connections(status, error, closed, kept):
+    from mzcli.pgexecute import PGExecute
+
+    executor = PGExecute.__new__(PGExecute)
+    executor.conn = conn = MagicMock(closed=closed)
+    conn.get_transaction_status.return_value = status
+    conn.cursor.return_value.__enter__.return_value.execute.side_effect = error
+
+    with patch.object(PGExecute, "reconnect") as reconnect:
+        assert executor.reset_after_cancel() is kept
+    assert reconnect.called is not kept
+
+
+def test_reconnect_replays_session_settings():
+    from mzcli.pgexecute import PGExecute
+
+    executor = PGExecute.__new__(PGExecute)
+    executor.conn = MagicMock(closed=0)
+    executor.conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    executor.session_settings = {}
+    for sql in [
+        "SET cluster = c1",
+        "SET search_path TO s",
+        "SET LOCAL statement_timeout = 1",
+        "SET SESSION cluster = c2",
+        "SET application_name = 'a'",
+        "RESET application_name",
+        "SELECT 1",
+    ]:
+        executor._record_session_setting(sql)
+    assert list(executor.session_settings.values()) == [
+        "SET search_path TO s",
+        "SET SESSION cluster = c2",
+    ]
+
+    new_conn = MagicMock(closed=0)
+    new_conn.get_transaction_status.return_value = (
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    )
+    attempts = []
+
+    def connect():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise psycopg2.OperationalError("server closed the connection")
+        executor.conn = new_conn
+        executor.session_settings = {}
+
+    on_retry = MagicMock()
+    with patch.object(executor, "connect", connect), patch(
+        "mzcli.pgexecute.sleep"
+    ) as sleep:
+        executor.reconnect(attempts=3, max_delay=1, on_retry=on_retry)
+
+    assert len(attempts) == 3
+    assert on_retry.call_count == sleep.call_count == 2
+    assert all(0 <= call[0][0] <= 1 for call in sleep.call_args_list)
+    cur = new_conn.cursor.return_value.__enter__.return_value
+    assert [call[0][0] for call in cur.execute.call_args_list] == [
+        "SET search_path TO s",
+        "SET SESSION cluster = c2",
+    ]
+    assert len(executor.session_settings) == 2
+
+    # The last failed attempt raises
+    with patch.object(
+        executor, "connect", side_effect=psycopg2.OperationalError()
+    ), patch("mzcli.pgexecute.sleep"):
+        with pytest.raises(psycopg2.OperationalError):
+            executor.reconnect(attempts=2)
+
+
+def test_backoff_delays():
+    from mzcli.pgexecute import backoff_delays
+
+    delays = list(backoff_delays(5, base_delay=1, max_delay=4))
+    assert delays[-1] is None
+    assert len(delays) == 5
+    assert all(0 <= delay <= bound for delay, bound in zip(delays, [1, 2, 4, 4]))
+
+
+def test_show_columns_is_not_retried_when_cancelled():
+    from mzcli.pgexecute import PGExecute
+
+    executor = PGExecute.__new__(PGExecute)
+    cur = MagicMock()
+    cur.execute.side_effect = psycopg2.extensions.QueryCanceledError()
+
+    with pytest.raises(psycopg2.extensions.QueryCanceledError):
+        executor._show_relation_columns(cur, "public", "t")
+    cur.execute.assert_called_once_with('SHOW COLUMNS FROM "public"."t"')
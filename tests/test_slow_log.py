@@ -0,0 +1,122 @@
+import json
+from unittest.mock import MagicMock, Mock
+
+import psycopg2
+
+from mzcli.slow_log import SlowQueryLog
+from mzcli.packages.parseutils.fingerprint import fingerprint
+from mzcli.timing import StatementTiming
+
+
+def timing(sql, seconds, rows=0):
+    timing = StatementTiming(sql)
+    timing.execute = seconds
+    timing.rows = rows
+    return timing
+
+
+def entries(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def pgexecute():
+    return Mock(
+        host="localhost", port=6875, user="u", dbname="d", server_version="v0.1"
+    )
+
+
+def test_only_slow_statements_are_logged(tmpdir):
+    path = tmpdir.join("slow", "queries.jsonl")
+    log = SlowQueryLog(str(path), 1, pgexecute)
+
+    log.record(timing("select 1", 0.5))
+    special = timing("\\dt", 2)
+    special.special = True
+    log.record(special)
+    log.record(timing("SUBSCRIBE t", 2))
+    assert not path.exists()
+
+    # Time spent reading the result in the pager isn't spent on the query
+    paged = timing("select 1", 0.5)
+    paged.pager = 60
+    log.record(paged)
+    assert not path.exists()
+
+    log.record(timing("select * from t where id = 1", 2, rows=3))
+    [entry] = entries(path)
+    assert entry["query"] == "select * from t where id = 1"
+    assert entry["fingerprint"] == fingerprint("select * from t where id = 2")
+    assert entry["total"] == 2
+    assert entry["phases"]["execute"] == 2
+    assert entry["rows"] == 3
+    assert entry["connection"]["host"] == "localhost"
+    assert "explain" not in entry
+
+
+def test_log_is_rotated(tmpdir):
+    path = tmpdir.join("queries.jsonl")
+    log = SlowQueryLog(str(path), 0, lambda: None, max_size=1, backup_count=2)
+
+    for i in range(4):
+        log.record(timing("select %s" % i, 1))
+
+    assert [e["query"] for e in entries(path)] == ["select 3"]
+    assert [e["query"] for e in entries(str(path) + ".1")] == ["select 2"]
+    assert [e["query"] for e in entries(str(path) + ".2")] == ["select 1"]
+    assert not tmpdir.join("queries.jsonl.3").exists()
+
+
+def test_explain_is_fetched_on_a_secondary_connection(tmpdir):
+    path = tmpdir.join("queries.jsonl")
+    executor = MagicMock()
+    cursor = executor.conn.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [("Explained Query:\n  Get t",)]
+    main = pgexecute()
+    main.acquire.return_value = executor
+    main.session_settings = {}
+    log = SlowQueryLog(str(path), 1, lambda: main, explain=True)
+
+    log.record(timing("select * from t;", 2))
+    log.flush()
+
+    cursor.execute.assert_called_once_with("EXPLAIN select * from t")
+    main.release.assert_called_once_with(executor)
+    [entry] = entries(path)
+    assert entry["explain"] == "Explained Query:\n  Get t"
+
+    cursor.execute.side_effect = psycopg2.ProgrammingError("no plan")
+    log.record(timing("select 1", 2))
+    log.flush()
+    assert entries(path)[1]["explain_error"] == "no plan"
+
+    # Only the plan of queries is fetched
+    log.record(timing("insert into t values (1)", 2))
+    log.flush()
+    assert "explain_error" not in entries(path)[2]
+    assert main.acquire.call_count == 2
+
+
+def test_explain_uses_the_session_settings(tmpdir):
+    path = tmpdir.join("queries.jsonl")
+    executor = MagicMock()
+    cursor = executor.conn.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [("plan",)]
+    main = pgexecute()
+    main.acquire.return_value = executor
+    main.session_settings = {"cluster": "SET cluster = c1"}
+    log = SlowQueryLog(str(path), 1, lambda: main, explain=True)
+
+    log.record(timing("select * from t", 2))
+    # Settings changed after the statement don't apply to its plan
+    main.session_settings = {"cluster": "SET cluster = c2"}
+    log.flush()
+
+    assert [c[0][0] for c in cursor.execute.call_args_list] == [
+        "SET cluster = c1",
+        "EXPLAIN select * from t",
+        # The pooled connection is returned with its own settings
+        "RESET ALL",
+    ]
+    main.release.assert_called_once_with(executor)
+    assert entries(path)[0]["explain"] == "plan"
@@ -1110,3 +1110,75 @@ def test_special_name_completion(completer):
             )
         ]
     )
+
+
+def test_lazy_columns_are_fetched_once():
+    from unittest.mock import Mock
+    from mzcli.pgcompleter import PGCompleter
+
+    fetcher = Mock(
+        return_value=[
+            ("public", "users", "id", "integer", False, None),
+            ("public", "users", "email", "text", False, None),
+        ]
+    )
+    completer = PGCompleter(settings={"lazy_columns": True, "column_fetcher": fetcher})
+    completer.set_search_path(["public"])
+    completer.extend_schemata(["public"])
+    completer.extend_relations([("public", "users")], kind="tables")
+
+    text = "SELECT  FROM users"
+    for _ in range(2):
+        result = completions_to_set(get_result(completer, text, position=7))
+        assert ("email", "column") in result
+    fetcher.assert_called_once_with("public", "users")
+
+    # A relation created again with the same name has its columns fetched
+    completer.remove_relations([("public", "users")], kind="tables")
+    completer.extend_relations([("public", "users")], kind="tables")
+    result = completions_to_set(get_result(completer, text, position=7))
+    assert ("email", "column") in result
+    assert fetcher.call_count == 2
+
+
+def test_lazy_columns_are_added_under_the_metadata_lock():
+    import threading
+    from mzcli.pgcompleter import PGCompleter
+
+    lock = threading.RLock()
+    acquired = []
+
+    def fetcher(schema, relname):
+        # The fetch itself doesn't hold the lock
+        def try_acquire():
+            if lock.acquire(blocking=False):
+                acquired.append(True)
+                lock.release()
+
+        thread = threading.Thread(target=try_acquire)
+        thread.start()
+        thread.join()
+        if relname == "orders":
+            # Dropped by a concurrent update while fetching
+            with lock:
+                completer.remove_relations([("public", "orders")], kind="tables")
+        return [(schema, relname, "id", "integer", False, None)]
+
+    completer = PGCompleter(
+        settings={
+            "lazy_columns": True,
+            "column_fetcher": fetcher,
+            "metadata_lock": lock,
+        }
+    )
+    completer.set_search_path(["public"])
+    completer.extend_schemata(["public"])
+    completer.extend_relations([("public", "users")], kind="tables")
+    completer.extend_relations([("public", "orders")], kind="tables")
+
+    result = completions_to_set(get_result(completer, "SELECT  FROM users", 7))
+    assert ("id", "column") in result
+    result = completions_to_set(get_result(completer, "SELECT  FROM orders", 7))
+    assert ("id", "column") not in result
+    assert "orders" not in completer.dbmetadata["tables"]["public"]
+    assert acquired == [True, True]
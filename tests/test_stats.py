@@ -0,0 +1,61 @@
+import math
+import random
+
+import pytest
+
+from mzcli.stats import LatencySketch, SessionStats
+from mzcli.timing import StatementTiming
+
+
+def test_sketch_is_empty():
+    sketch = LatencySketch()
+    assert sketch.quantile(0.5) is None
+    assert sketch.count == 0
+
+
+@pytest.mark.parametrize("q", [0.0, 0.5, 0.95, 0.99, 1.0])
+def test_sketch_quantiles_are_within_relative_accuracy(q):
+    values = [random.lognormvariate(-4, 2) for _ in range(10000)]
+    sketch = LatencySketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    expected = sorted(values)[max(math.ceil(q * len(values)), 1) - 1]
+    assert sketch.quantile(q) == pytest.approx(expected, rel=0.01)
+    assert sketch.min == min(values)
+    assert sketch.max == max(values)
+
+
+def test_sketch_counts_tiny_values_as_zero():
+    sketch = LatencySketch()
+    for value in (0.0, 0.0, 0.5):
+        sketch.add(value)
+    assert sketch.quantile(0.5) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(0.5, rel=0.01)
+
+
+def timing(sql, seconds, rows=0):
+    timing = StatementTiming(sql)
+    timing.execute = seconds
+    timing.rows = rows
+    return timing
+
+
+def test_session_stats_groups_by_normalized_query():
+    stats = SessionStats()
+    stats.record(timing("SELECT * FROM t WHERE id = 1", 0.1, rows=1))
+    stats.record(timing("select *\n  from t where id = 2", 0.3, rows=1))
+    stats.record(timing("select 2", 0.5))
+
+    rows = list(stats.rows())
+    assert [row[:3] for row in rows] == [
+        ("select ?", 1, 0),
+        ("select * from t where id = ?", 2, 2),
+    ]
+    assert rows[1][-1] == pytest.approx(0.4)
+
+
+def test_session_stats_normalize():
+    stats = SessionStats(normalize=str.upper)
+    stats.record(timing("select 1", 0.1))
+    assert list(stats.queries) == ["SELECT 1"]
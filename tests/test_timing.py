@@ -0,0 +1,24 @@
+from unittest import mock
+
+from mzcli.timing import StatementTiming
+
+
+def test_measure_adds_to_phases():
+    timing = StatementTiming("select 1")
+    clock = iter([0, 1, 5, 7, 10, 13])
+
+    with mock.patch("mzcli.timing.time", lambda: next(clock)):
+        with timing.measure("execute"):
+            pass
+        with timing.measure("fetch"):
+            pass
+        with timing.measure("execute"):
+            pass
+
+    assert timing.execute == 4
+    assert timing.fetch == 2
+    assert timing.server == timing.total == 6
+    assert timing.describe() == (
+        "execute: 4.000s, fetch: 2.000s, typecast: 0.000s, format: 0.000s, "
+        "output: 0.000s"
+    )
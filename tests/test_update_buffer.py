@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from mzcli.update_buffer import UpdateBuffer
+
+HEADERS = ["mz_timestamp", "mz_diff", "name"]
+
+
+def test_block_waits_for_updates_to_be_read():
+    buffer = UpdateBuffer(HEADERS, maxsize=2)
+    batches = [[(1, 1, "a"), (1, 1, "b"), (1, 1, "c")], [(2, 1, "d")]]
+    reader = threading.Thread(target=buffer.fill, args=(iter(batches),))
+    reader.start()
+
+    # The first batch overflows the buffer, so the second one waits
+    assert buffer.get() == batches[0]
+    assert buffer.get() == batches[1]
+    reader.join(1)
+    assert not reader.is_alive()
+    assert buffer.get() == []
+    assert buffer.finished
+    assert buffer.describe() == ""
+
+
+def test_close_stops_a_blocked_fill():
+    put = threading.Event()
+    buffer = UpdateBuffer(HEADERS, maxsize=1, callback=put.set)
+    reader = threading.Thread(
+        target=buffer.fill, args=(iter([[(1, 1, "a"), (1, 1, "b")]] * 3),)
+    )
+    reader.start()
+    assert put.wait(1)
+    buffer.close()
+    reader.join(1)
+
+    assert not reader.is_alive()
+    assert buffer.received == 2
+
+
+def test_stop_waits_for_an_idle_fill():
+    buffer = UpdateBuffer(HEADERS)
+    closed = threading.Event()
+
+    def batches():
+        # Every FETCH times out without updates
+        try:
+            while True:
+                time.sleep(0.01)
+                yield []
+        finally:
+            closed.set()
+
+    reader = threading.Thread(target=buffer.fill, args=(batches(),))
+    reader.start()
+    buffer.stop(reader)
+
+    assert not reader.is_alive()
+    assert closed.is_set()
+    assert buffer.get() == []
+
+
+def test_coalesce_merges_updates_per_row():
+    buffer = UpdateBuffer(HEADERS, maxsize=3, policy="coalesce")
+    buffer.put([(1, 1, "a"), (1, 1, "b")])
+    buffer.put([(2, -1, "a"), (2, 1, "c"), (3, 1, "b")])
+
+    assert buffer.get() == [(2, 1, "c"), (3, 2, "b")]
+    assert buffer.coalesced == 3
+    assert buffer.describe() == "3 coalesced"
+
+
+def test_coalesce_keeps_progress_messages():
+    headers = ["mz_timestamp", "mz_progressed", "mz_diff", "name"]
+    buffer = UpdateBuffer(headers, maxsize=3, policy="coalesce")
+    buffer.put([(1, False, 1, "a"), (2, True, None, None)])
+    buffer.put([(2, True, None, None), (3, False, 1, "a")])
+
+    assert buffer.get() == [
+        (2, True, None, None),
+        (2, True, None, None),
+        (3, False, 2, "a"),
+    ]
+    assert buffer.coalesced == 1
+
+
+def test_drop_keeps_a_sample_of_updates():
+    buffer = UpdateBuffer(HEADERS, maxsize=4, policy="drop")
+    buffer.put([(i, 1, str(i)) for i in range(10)])
+
+    assert [update[0] for update in buffer.get()] == [0, 4, 8]
+    assert buffer.dropped == 7
+    assert buffer.describe() == "7 dropped"
+
+
+def test_fill_keeps_errors():
+    buffer = UpdateBuffer(HEADERS)
+
+    def batches():
+        yield [(1, 1, "a")]
+        raise KeyboardInterrupt()
+
+    buffer.fill(batches())
+
+    assert buffer.get() == [(1, 1, "a")]
+    assert isinstance(buffer.error, KeyboardInterrupt)
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        UpdateBuffer(HEADERS, policy="spill")
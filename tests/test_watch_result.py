@@ -0,0 +1,31 @@
+from mzcli.watch_result import WatchResult
+
+
+def test_update_detects_changes():
+    result = WatchResult()
+
+    assert result.update(iter([(1, "a"), (2, "b")])) == [(1, "a"), (2, "b")]
+    assert result.changed
+    result.update([(1, "a"), (2, "b")])
+    assert not result.changed
+    # The order of the rows is part of the result
+    result.update([(2, "b"), (1, "a")])
+    assert result.changed
+    assert result.added == result.removed == []
+
+
+def test_update_with_diff():
+    result = WatchResult(diff=True)
+    result.update([(1, "a"), (2, "b"), (2, "b")])
+    assert result.added == []
+
+    result.update([(2, "b"), (3, [1, 2]), (3, [1, 2])])
+
+    assert result.added == [(3, [1, 2]), (3, [1, 2])]
+    assert result.removed == [(1, "a"), (2, "b")]
+    assert result.changes() == [
+        ("+", 3, [1, 2]),
+        ("+", 3, [1, 2]),
+        ("-", 1, "a"),
+        ("-", 2, "b"),
+    ]